@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third-party apps
     'crispy_forms',
@@ -41,6 +42,7 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'marketplace.overload.DegradedModeMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -75,22 +77,68 @@ DATABASES = {
     'default': dj_database_url.parse(config('DATABASE_URL'))
 }
 
-# Cloudinary configuration
+# Cache (set CACHE_BACKEND/CACHE_LOCATION to a shared cache such as Redis in production)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='arparte'),
+    }
+}
+
+# View counting: buffered in the cache and flushed to the database in bulk
+VIEW_COUNT_FLUSH_INTERVAL = config('VIEW_COUNT_FLUSH_INTERVAL', default=60, cast=int)
+# Seconds during which repeat views from one session/IP are ignored (0 disables)
+VIEW_COUNT_DEDUP_WINDOW = config('VIEW_COUNT_DEDUP_WINDOW', default=1800, cast=int)
+# Buffering needs a cache shared by all processes; otherwise each view is written directly
+VIEW_COUNT_BUFFERED = config('VIEW_COUNT_BUFFERED', cast=bool, default=CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache',
+))
+
+# Cloudinary configuration (only needed with the Cloudinary media uploader)
 CLOUDINARY_STORAGE = {
-    'CLOUD_NAME': config('CLOUDINARY_CLOUD_NAME'),
-    'API_KEY': config('CLOUDINARY_API_KEY'),
-    'API_SECRET': config('CLOUDINARY_API_SECRET'),
+    'CLOUD_NAME': config('CLOUDINARY_CLOUD_NAME', default=''),
+    'API_KEY': config('CLOUDINARY_API_KEY', default=''),
+    'API_SECRET': config('CLOUDINARY_API_SECRET', default=''),
     'SECURE': False,  # Set to False for development
 }
 
 cloudinary.config( 
-    cloud_name=config('CLOUDINARY_CLOUD_NAME'), 
-    api_key=config('CLOUDINARY_API_KEY'), 
-    api_secret=config('CLOUDINARY_API_SECRET'),
+    cloud_name=config('CLOUDINARY_CLOUD_NAME', default=''), 
+    api_key=config('CLOUDINARY_API_KEY', default=''), 
+    api_secret=config('CLOUDINARY_API_SECRET', default=''),
     secure=False  # Add this for development
 )
 
-CLOUDINARY_URL = config('CLOUDINARY_URL')
+CLOUDINARY_URL = config('CLOUDINARY_URL', default='')
+
+# Media uploads: dotted path of the uploader class (see marketplace.uploads),
+# uploads of one submission run concurrently on a shared bounded pool
+MEDIA_UPLOADER = config('MEDIA_UPLOADER', default='marketplace.uploads.CloudinaryUploader')
+# Where marketplace.uploads.LocalUploader keeps files, and the absolute URL they are served from
+LOCAL_MEDIA_ROOT = config('LOCAL_MEDIA_ROOT', default=str(BASE_DIR / 'media' / 'uploads'))
+LOCAL_MEDIA_URL = config('LOCAL_MEDIA_URL', default='http://localhost:8000/media/uploads/')
+UPLOAD_MAX_WORKERS = config('UPLOAD_MAX_WORKERS', default=4, cast=int)
+# Seconds allowed per file
+UPLOAD_TIMEOUT = config('UPLOAD_TIMEOUT', default=60, cast=int)
+# Resize/re-encode images with Pillow before uploading them (WEBP or JPEG)
+IMAGE_PREPROCESS = config('IMAGE_PREPROCESS', default=True, cast=bool)
+IMAGE_OUTPUT_FORMAT = config('IMAGE_OUTPUT_FORMAT', default='WEBP')
+# Reuse an earlier upload of the same (or near-identical) file instead of uploading again
+UPLOAD_DEDUP = config('UPLOAD_DEDUP', default=True, cast=bool)
+# The near-identical image pass of the above (re-encodes of the same photo)
+UPLOAD_DEDUP_NEAR = config('UPLOAD_DEDUP_NEAR', default=True, cast=bool)
+# 'inline' uploads during the request; 'deferred' spools the files and lets
+# the process_media_jobs worker upload them (the spool must be shared with it)
+MEDIA_PROCESSING = config('MEDIA_PROCESSING', default='inline')
+MEDIA_SPOOL_DIR = config('MEDIA_SPOOL_DIR', default=str(BASE_DIR / 'media' / 'spool'))
+
+# Overload protection (see marketplace.overload): past this rolling mean query
+# latency or database error rate, public pages are served from cache and
+# writes get a 503 until latency falls back under DEGRADED_RECOVERY_MS
+DEGRADED_MODE = config('DEGRADED_MODE', default=True, cast=bool)
+DEGRADED_LATENCY_MS = config('DEGRADED_LATENCY_MS', default=300, cast=int)
+DEGRADED_RECOVERY_MS = config('DEGRADED_RECOVERY_MS', default=100, cast=int)
+DEGRADED_ERROR_RATE = config('DEGRADED_ERROR_RATE', default=0.2, cast=float)
 
 
 # Password validation
@@ -1,10 +1,13 @@
 """
 ARPARTE Main URL Configuration
 """
+import re
+from urllib.parse import urlsplit
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from django.views.static import serve
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -16,6 +19,14 @@ if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
+# Files stored by the local media uploader, served even with DEBUG off so
+# offline load tests see the whole listing pipeline
+if settings.MEDIA_UPLOADER == 'marketplace.uploads.LocalUploader':
+    local_prefix = urlsplit(settings.LOCAL_MEDIA_URL).path.lstrip('/')
+    urlpatterns.insert(0, re_path(
+        rf'^{re.escape(local_prefix)}(?P<path>.*)$', serve, {'document_root': settings.LOCAL_MEDIA_ROOT}
+    ))
+
 
 handler404 = 'marketplace.views.error_404'
 handler403 = 'marketplace.views.error_403'
@@ -6,8 +6,10 @@ from django.db.models import Count, Avg
 from .models import (
     User, Category, Product, Service, Review,
     AvailabilityReport, PromotionPackage, Promotion,
-    ChangeRequest, Message
+    ChangeRequest, Message, MediaJob, MediaAsset
 )
+from .ratings import set_reviews_approved
+from . import media_gc
 
 
 @admin.register(User)
@@ -148,7 +150,8 @@ class ProductAdmin(admin.ModelAdmin):
     mark_as_featured.short_description = 'Mark as featured'
     
     def mark_as_active(self, request, queryset):
-        count = queryset.update(status='active')
+        # Listings still processing media are published by their job
+        count = queryset.exclude(status='processing').update(status='active')
         self.message_user(request, f'{count} product(s) marked as active.')
     mark_as_active.short_description = 'Mark as active'
     
@@ -254,7 +257,8 @@ class ServiceAdmin(admin.ModelAdmin):
     mark_as_featured.short_description = 'Mark as featured'
     
     def mark_as_active(self, request, queryset):
-        count = queryset.update(status='active')
+        # Listings still processing media are published by their job
+        count = queryset.exclude(status='processing').update(status='active')
         self.message_user(request, f'{count} service(s) marked as active.')
     mark_as_active.short_description = 'Mark as active'
     
@@ -293,12 +297,12 @@ class ReviewAdmin(admin.ModelAdmin):
     get_item.short_description = 'Item'
     
     def approve_reviews(self, request, queryset):
-        count = queryset.update(is_approved=True)
+        count = set_reviews_approved(queryset, True)
         self.message_user(request, f'{count} review(s) approved.')
     approve_reviews.short_description = 'Approve selected reviews'
     
     def unapprove_reviews(self, request, queryset):
-        count = queryset.update(is_approved=False)
+        count = set_reviews_approved(queryset, False)
         self.message_user(request, f'{count} review(s) unapproved.')
     unapprove_reviews.short_description = 'Unapprove selected reviews'
 
@@ -467,7 +471,10 @@ class ChangeRequestAdmin(admin.ModelAdmin):
     approve_requests.short_description = 'Approve selected requests'
     
     def reject_requests(self, request, queryset):
-        count = queryset.filter(status='pending').update(
+        pending = queryset.filter(status='pending')
+        # update() sends no signals; the rejected images are no longer needed
+        media_gc.release(url for images in pending.values_list('new_images', flat=True) for url in images or ())
+        count = pending.update(
             status='rejected',
             reviewed_by=request.user,
             reviewed_at=timezone.now()
@@ -506,4 +513,24 @@ class MessageAdmin(admin.ModelAdmin):
     
     def get_item(self, obj):
         return obj.product or obj.service or 'General Message'
-    get_item.short_description = 'Related Item'
\ No newline at end of file
+    get_item.short_description = 'Related Item'
+
+@admin.register(MediaJob)
+class MediaJobAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = ['product', 'service', 'files', 'attempts', 'last_error', 'started_at', 'created_at', 'finished_at']
+    actions = ['retry_jobs']
+    
+    def retry_jobs(self, request, queryset):
+        count = queryset.filter(status='failed').update(status='queued', attempts=0, available_at=timezone.now())
+        self.message_user(request, f'{count} job(s) queued again.')
+    retry_jobs.short_description = 'Retry selected failed jobs'
+
+
+@admin.register(MediaAsset)
+class MediaAssetAdmin(admin.ModelAdmin):
+    list_display = ['public_id', 'resource_type', 'owner', 'created_at', 'last_used_at', 'unreferenced_at']
+    list_filter = ['resource_type', 'created_at', 'unreferenced_at']
+    search_fields = ['public_id', 'sha256', 'owner__username']
+    readonly_fields = ['sha256', 'phash', 'colors', 'resource_type', 'public_id', 'url', 'duration', 'owner', 'created_at', 'last_used_at', 'unreferenced_at']
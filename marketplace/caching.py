@@ -0,0 +1,234 @@
+"""
+Cache helpers shared by the marketplace.
+
+Invalidation is generation based: every namespace (e.g. ``listings:product``)
+has a counter in the cache, keys built from it are never deleted, and bumping
+the counter makes every older key unreachable.
+
+``single_flight`` coalesces concurrent misses of one key: a lock in the cache
+lets one caller recompute while the others serve a stale copy or wait briefly
+for the new one, so an expiry during a traffic spike costs one set of queries.
+The page, fragment, count and listing lookup caches all go through it.
+
+``versioned_fragment`` caches rendered template fragments under one or more
+generations, with probabilistic early refresh on top of that.
+"""
+import hashlib
+import math
+import random
+import time
+
+from django.core.cache import cache
+
+from . import overload
+
+GENERATION_PREFIX = 'gen'
+
+
+def _generation_key(namespace):
+    return f'{GENERATION_PREFIX}:{namespace}'
+
+
+def get_generation(namespace):
+    """Current generation number for ``namespace``"""
+    key = _generation_key(namespace)
+    value = cache.get(key)
+    if value is None:
+        # Seed from the clock so an evicted counter never reuses an old value
+        cache.add(key, int(time.time() * 1000), None)
+        value = cache.get(key, 0)
+    return value
+
+
+def bump_generation(namespace):
+    """Invalidate everything cached under ``namespace``"""
+    key = _generation_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        value = int(time.time() * 1000)
+        cache.set(key, value, None)
+        return value
+
+
+def listing_namespace(model):
+    """Generation namespace covering every listing of ``model``"""
+    return f'listings:{model._meta.model_name}'
+
+
+# Namespaces bumped by signals outside the listing models
+CATEGORY_NAMESPACE = 'categories'
+REVIEW_NAMESPACE = 'reviews'
+
+FRAGMENT_PREFIX = 'frag'
+FRAGMENT_TIMEOUT = 60 * 15
+# A superseded copy is served for at most this long while the new one renders
+STALE_TIMEOUT = 60 * 60 * 24
+REBUILD_LOCK_TIMEOUT = 30
+# How long a caller without a stale copy waits for another one's rebuild
+SINGLE_FLIGHT_WAIT = 1.0
+SINGLE_FLIGHT_POLL = 0.05
+# XFetch tuning: >1 refreshes earlier, <1 later
+EARLY_EXPIRY_BETA = 1.0
+
+STATS_PREFIX = 'stats'
+STATS_NAMES_KEY = f'{STATS_PREFIX}:names'
+STATS_EVENTS = ('hit', 'stale', 'miss')
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def record_cache_event(name, event):
+    """Count a ``hit``/``stale``/``miss`` for the cache called ``name``"""
+    if event == 'miss':
+        names = cache.get(STATS_NAMES_KEY) or []
+        if name not in names:
+            cache.set(STATS_NAMES_KEY, sorted({*names, name}), None)
+    _count(f'{STATS_PREFIX}:{name}:{event}')
+
+
+def cache_stats(names=None):
+    """``{name: {'hit': n, 'stale': n, 'miss': n, 'hit_rate': float}}``"""
+    names = names or cache.get(STATS_NAMES_KEY) or []
+    stats = {}
+    for name in names:
+        keys = {event: f'{STATS_PREFIX}:{name}:{event}' for event in STATS_EVENTS}
+        values = cache.get_many(list(keys.values()))
+        row = {event: values.get(key, 0) for event, key in keys.items()}
+        total = sum(row.values())
+        row['hit_rate'] = (row['hit'] + row['stale']) / total if total else 0.0
+        stats[name] = row
+    return stats
+
+
+def reset_cache_stats(names=None):
+    names = names or cache.get(STATS_NAMES_KEY) or []
+    cache.delete_many([f'{STATS_PREFIX}:{name}:{event}' for name in names for event in STATS_EVENTS])
+
+
+def fragment_key(name, namespaces, vary_on=()):
+    """Cache key for ``name`` under the current generation of each namespace"""
+    generations = ':'.join(str(get_generation(namespace)) for namespace in namespaces)
+    vary = hashlib.md5(':'.join(str(value) for value in vary_on).encode()).hexdigest()
+    return f'{FRAGMENT_PREFIX}:{name}:{vary}:{generations}', f'{FRAGMENT_PREFIX}:{name}:{vary}:stale'
+
+
+def _expires_early(delta, expires_at):
+    # Probabilistic early expiration (XFetch): the closer to expiry and the
+    # slower the render, the likelier one request refreshes ahead of time
+    return time.time() - delta * EARLY_EXPIRY_BETA * math.log(1 - random.random()) >= expires_at
+
+
+def single_flight(key, compute, fresh, stale=None, wait=SINGLE_FLIGHT_WAIT, lock_timeout=REBUILD_LOCK_TIMEOUT):
+    """
+    Let one caller at a time recompute the missing cache entry ``key``.
+
+    The caller that takes the lock returns ``compute()``, which stores the new
+    entry. The others return ``stale()`` if it gives a value, otherwise poll
+    ``fresh()`` for up to ``wait`` seconds and compute it themselves when the
+    rebuild takes longer or stores nothing. ``fresh`` and ``stale`` return
+    None on a miss. Returns ``(value, event)``, the event being one of
+    ``STATS_EVENTS``. In degraded mode (``marketplace.overload``) a stale
+    copy is served without rebuilding at all.
+    """
+    if stale is not None and overload.is_degraded():
+        value = stale()
+        if value is not None:
+            return value, 'stale'
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            return compute(), 'miss'
+        finally:
+            cache.delete(lock_key)
+
+    if stale is not None:
+        value = stale()
+        if value is not None:
+            return value, 'stale'
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL)
+        rebuilt = cache.get(lock_key) is None
+        value = fresh()
+        if value is not None:
+            return value, 'hit'
+        if rebuilt:
+            break
+    return compute(), 'miss'
+
+
+def versioned_fragment(name, namespaces, render, vary_on=(), timeout=FRAGMENT_TIMEOUT):
+    """
+    Return ``render()`` cached under the generations of ``namespaces``.
+
+    Only one process re-renders a missing or expiring fragment; the others
+    keep serving the current copy, or the last copy from an older generation,
+    until it is ready.
+    """
+    key, stale_key = fragment_key(name, namespaces, vary_on)
+    entry = cache.get(key)
+    if entry is not None and not _expires_early(entry[1], entry[2]):
+        record_cache_event(name, 'hit')
+        return entry[0]
+
+    def rebuild():
+        started = time.time()
+        value = render()
+        delta = time.time() - started
+        cache.set(key, (value, delta, time.time() + timeout), timeout)
+        cache.set(stale_key, value, STALE_TIMEOUT)
+        return value
+
+    def fresh():
+        current = cache.get(key)
+        return None if current is None else current[0]
+
+    def stale():
+        # The copy being refreshed early, or the last one of an older generation
+        return entry[0] if entry is not None else cache.get(stale_key)
+
+    value, event = single_flight(key, rebuild, fresh, stale)
+    record_cache_event(name, event)
+    return value
+
+
+def detail_namespace(model, slug):
+    """Generation namespace of one listing's detail page"""
+    return f'page:{model._meta.model_name}:{slug}'
+
+
+def browse_namespace(model, category_slug=None):
+    """Generation namespace of the browse pages filtered to ``category_slug`` (or unfiltered)"""
+    return f'browse:{model._meta.model_name}:{category_slug or "*"}'
+
+
+def purge_listing_pages(model, slugs, category_ids):
+    """
+    Invalidate the cached pages showing the given listings: their detail
+    pages, the browse pages of their categories and the unfiltered browse pages.
+    """
+    from .models import Category
+    namespaces = {browse_namespace(model)}
+    namespaces.update(detail_namespace(model, slug) for slug in slugs if slug)
+    category_ids = {pk for pk in category_ids if pk}
+    if category_ids:
+        category_slugs = Category.objects.filter(pk__in=category_ids).values_list('slug', flat=True)
+        namespaces.update(browse_namespace(model, slug) for slug in category_slugs)
+    for namespace in namespaces:
+        bump_generation(namespace)
+
+
+def purge_listings(model, pks):
+    """``purge_listing_pages`` for listings looked up by primary key"""
+    rows = list(model._base_manager.filter(pk__in=pks).values_list('slug', 'category_id'))
+    if rows:
+        slugs, category_ids = zip(*rows)
+        purge_listing_pages(model, slugs, category_ids)
@@ -0,0 +1,163 @@
+"""
+Resumable, chunked video uploads.
+
+The browser reserves an upload with ``start`` and sends the video in pieces
+of at most ``CHUNK_SIZE``, each appended at the offset the server reports. A
+dropped connection resumes from ``received`` instead of starting over. Chunks
+are streamed from the request body to ``<MEDIA_SPOOL_DIR>/chunks`` in
+``BLOCK_SIZE`` blocks, so memory use does not grow with the video.
+
+The listing form takes the finished upload (``completed_path``) in place of a
+file field; ``CloudinaryUploader`` then forwards it with Cloudinary's chunked
+upload API. Chunks of one upload must be sent one at a time: ``append`` holds
+an exclusive lock on the data file while it checks the offset and writes, and
+refuses a chunk that arrives meanwhile (a client retry, say).
+"""
+import json
+import os
+import re
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development; appends are not locked
+    fcntl = None
+
+from .media_jobs import spool_dir
+from .media_probe import MAX_VIDEO_SIZE
+
+CHUNK_SIZE = 5 * 1024 * 1024
+BLOCK_SIZE = 64 * 1024
+# Unfinished uploads older than this are removed by purge_stale()
+MAX_AGE = 24 * 60 * 60
+
+VIDEO_EXTENSIONS = {'.mp4', '.m4v', '.mov', '.webm', '.mkv', '.avi'}
+
+
+class ChunkError(Exception):
+    pass
+
+
+def chunk_dir():
+    return os.path.join(spool_dir(), 'chunks')
+
+
+def _meta_path(upload_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', str(upload_id)):
+        raise ChunkError('unknown upload')
+    return os.path.join(chunk_dir(), f'{upload_id}.json')
+
+
+def _load(upload_id, owner):
+    """``(data path, metadata)`` of an upload that belongs to ``owner``"""
+    try:
+        with open(_meta_path(upload_id)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise ChunkError('unknown upload')
+    if meta['owner'] != str(owner.pk):
+        raise ChunkError('unknown upload')
+    return os.path.join(chunk_dir(), meta['file']), meta
+
+
+def start(owner, name, size):
+    """Reserve an upload of ``size`` bytes and return its id"""
+    if not 0 < size <= MAX_VIDEO_SIZE:
+        raise ChunkError(f'videos must be at most {MAX_VIDEO_SIZE // (1024 * 1024)}MB')
+    _, extension = os.path.splitext(name or '')
+    extension = extension.lower() if extension.lower() in VIDEO_EXTENSIONS else ''
+    upload_id = uuid.uuid4().hex
+    os.makedirs(chunk_dir(), exist_ok=True)
+    open(os.path.join(chunk_dir(), upload_id + extension), 'wb').close()
+    with open(_meta_path(upload_id), 'w') as f:
+        json.dump({'owner': str(owner.pk), 'file': upload_id + extension, 'size': size}, f)
+    return upload_id
+
+
+def received(upload_id, owner):
+    """``(bytes received, total size)``"""
+    path, meta = _load(upload_id, owner)
+    try:
+        return os.path.getsize(path), meta['size']
+    except OSError:
+        raise ChunkError('unknown upload')
+
+
+def append(upload_id, owner, offset, stream, length):
+    """
+    Append ``length`` bytes read from ``stream`` at ``offset`` (which must be
+    the number of bytes received so far); returns the new offset. Bytes that
+    arrived before the client went away are kept.
+    """
+    path, meta = _load(upload_id, owner)
+    if length > CHUNK_SIZE:
+        raise ChunkError('chunk too large')
+    try:
+        # Without O_CREAT, so an upload that was moved away is not started again
+        f = os.fdopen(os.open(path, os.O_WRONLY | os.O_APPEND), 'ab')
+    except FileNotFoundError:
+        raise ChunkError('unknown upload')
+    with f:
+        if fcntl:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise ChunkError('another chunk of this upload is being received')
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise ChunkError(f'expected offset {current}')
+        if offset + length > meta['size']:
+            raise ChunkError('chunk too large')
+        remaining = length
+        while remaining:
+            block = stream.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            f.write(block)
+            remaining -= len(block)
+    return offset + length - remaining
+
+
+def completed_path(upload_id, owner):
+    """Path of a fully received upload"""
+    path, meta = _load(upload_id, owner)
+    if not os.path.exists(path) or os.path.getsize(path) != meta['size']:
+        raise ChunkError('upload is incomplete')
+    return path
+
+
+def discard(upload_id):
+    """Remove an upload's files; its data may already have been moved away"""
+    try:
+        meta_path = _meta_path(upload_id)
+        with open(meta_path) as f:
+            data_path = os.path.join(chunk_dir(), json.load(f)['file'])
+    except (ChunkError, OSError, ValueError, KeyError):
+        return
+    for path in (data_path, meta_path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def purge_stale(max_age=MAX_AGE):
+    """Delete uploads untouched for ``max_age`` seconds; returns how many"""
+    try:
+        entries = list(os.scandir(chunk_dir()))
+    except FileNotFoundError:
+        return 0
+    # Metadata and data files both start with the 32 character upload id
+    newest = {}
+    for entry in entries:
+        upload_id = entry.name[:32]
+        newest[upload_id] = max(newest.get(upload_id, 0), entry.stat().st_mtime)
+    stale = {upload_id for upload_id, mtime in newest.items() if mtime < time.time() - max_age}
+    for entry in entries:
+        if entry.name[:32] in stale:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    return len(stale)
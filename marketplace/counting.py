@@ -0,0 +1,114 @@
+"""
+Result counts for the browse pages.
+
+Exact ``COUNT(*)`` is only run when it is known to be cheap. Counts are cached
+per normalized filter combination under the listing generation (so any listing
+write invalidates them); large result sets are reported as "1,000+" using either
+the PostgreSQL planner estimate or a count capped at ``EXACT_COUNT_LIMIT`` rows.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db import connections
+
+from .caching import get_generation, listing_namespace, single_flight
+
+EXACT_COUNT_LIMIT = 1000
+
+# Trust the planner outright once it expects this many rows
+PLANNER_TRUST_FACTOR = 10
+
+COUNT_CACHE_TIMEOUT = 60 * 10
+
+# Request parameters that change the rows but not the count
+NON_FILTER_PARAMS = frozenset({'sort', 'page', 'after', 'before'})
+
+
+class ResultCount:
+    """A result count that may be a lower bound ("1,000+")"""
+
+    def __init__(self, value, is_estimate=False):
+        self.value = value
+        self.is_estimate = is_estimate
+
+    def __int__(self):
+        return self.value
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, ResultCount):
+            return (self.value, self.is_estimate) == (other.value, other.is_estimate)
+        return not self.is_estimate and self.value == other
+
+    def __str__(self):
+        return f'{self.value:,}+' if self.is_estimate else f'{self.value:,}'
+
+    def __repr__(self):
+        return f'<ResultCount {self}>'
+
+
+def normalize_filters(params):
+    """Canonical, order independent form of the browse filter parameters"""
+    normalized = {}
+    for key in sorted(params):
+        if key in NON_FILTER_PARAMS:
+            continue
+        value = ' '.join(str(params.get(key, '')).split()).lower()
+        if value:
+            normalized[key] = value
+    return normalized
+
+
+def count_cache_key(model, params):
+    filters = json.dumps(normalize_filters(params), sort_keys=True)
+    digest = hashlib.md5(filters.encode()).hexdigest()
+    generation = get_generation(listing_namespace(model))
+    return f'count:{model._meta.model_name}:{generation}:{digest}'
+
+
+def planner_estimate(queryset):
+    """Row estimate from the PostgreSQL planner, or None on other backends"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def capped_count(queryset, limit=EXACT_COUNT_LIMIT):
+    """COUNT(*) over at most ``limit + 1`` rows"""
+    return queryset.order_by().values('pk')[:limit + 1].count()
+
+
+def count_results(queryset, params):
+    """
+    Count ``queryset`` for the filters in ``params`` (usually ``request.GET``).
+
+    Returns a ``ResultCount``; ``is_estimate`` is set when the real number is
+    only known to be above ``EXACT_COUNT_LIMIT``.
+    """
+    key = count_cache_key(queryset.model, params)
+    cached = cache.get(key)
+    if cached is not None:
+        return ResultCount(*cached)
+
+    def count():
+        estimate = planner_estimate(queryset)
+        if estimate is not None and estimate >= EXACT_COUNT_LIMIT * PLANNER_TRUST_FACTOR:
+            value = (EXACT_COUNT_LIMIT, True)
+        else:
+            exact = capped_count(queryset, EXACT_COUNT_LIMIT)
+            value = (EXACT_COUNT_LIMIT, True) if exact > EXACT_COUNT_LIMIT else (exact, False)
+        cache.set(key, value, COUNT_CACHE_TIMEOUT)
+        return value
+
+    value, _ = single_flight(key, count, lambda: cache.get(key))
+    return ResultCount(*value)
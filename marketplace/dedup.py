@@ -0,0 +1,185 @@
+"""
+Upload dedup.
+
+Before a file is uploaded its SHA-256 (and, for images, a 64-bit dHash plus a
+4x4 colour grid) is looked up among its owner's ``MediaAsset`` rows, so one
+seller's uploads are never handed to another. An exact hit reuses the
+stored URL and skips the upload. So does an image within
+``PHASH_MAX_DISTANCE`` bits whose colour grid also agrees within
+``COLOR_MAX_DISTANCE``. The dHash is grayscale, so it cannot tell a red
+phone from a blue one on its own, and a flat picture has no dHash detail at
+all (``PHASH_MIN_DETAIL``); such images only match exactly.
+``UPLOAD_DEDUP_NEAR`` turns the near-duplicate pass off on its own.
+Hashes are taken from the original bytes, before any pre-processing.
+"""
+import hashlib
+
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+PHASH_MAX_DISTANCE = 2
+# dHashes with fewer set (or unset) bits describe too little structure to compare
+PHASH_MIN_DETAIL = 8
+# Largest difference of any channel in any cell of the colour grid (0-255)
+COLOR_MAX_DISTANCE = 16
+COLOR_GRID = 4
+# How many of the owner's recent images a near-duplicate lookup compares
+PHASH_CANDIDATES = 500
+CHUNK_SIZE = 1024 * 1024
+
+
+def is_enabled():
+    return getattr(settings, 'UPLOAD_DEDUP', True)
+
+
+def near_matching_enabled():
+    return getattr(settings, 'UPLOAD_DEDUP_NEAR', True)
+
+
+def _rewind(source):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+
+def content_hash(source):
+    """SHA-256 of a path or file object (left rewound)"""
+    digest = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    _rewind(source)
+    chunks = source.chunks(CHUNK_SIZE) if hasattr(source, 'chunks') else iter(lambda: source.read(CHUNK_SIZE), b'')
+    for chunk in chunks:
+        digest.update(chunk)
+    _rewind(source)
+    return digest.hexdigest()
+
+
+def perceptual_hash(source):
+    """
+    ``(dhash, colors)``: a 64-bit difference hash as 16 hex digits and the
+    average RGB of a ``COLOR_GRID`` square grid as hex, or ``('', '')`` for
+    unreadable images
+    """
+    try:
+        with Image.open(source) as image:
+            image.draft('RGB', (64, 64))
+            image = image.convert('RGB')
+            pixels = list(image.convert('L').resize((9, 8), Image.Resampling.LANCZOS).getdata())
+            grid = image.resize((COLOR_GRID, COLOR_GRID), Image.Resampling.BOX).tobytes()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return '', ''
+    finally:
+        _rewind(source)
+    bits = 0
+    for row in range(8):
+        for column in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return f'{bits:016x}', grid.hex()
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def color_distance(a, b):
+    """Largest per-channel difference between two colour grids"""
+    return max((abs(x - y) for x, y in zip(bytes.fromhex(a), bytes.fromhex(b))), default=0)
+
+
+def has_detail(phash):
+    return PHASH_MIN_DETAIL <= bin(int(phash, 16)).count('1') <= 64 - PHASH_MIN_DETAIL
+
+
+def is_near_duplicate(phash, colors, row):
+    """Whether an image with ``phash`` and ``colors`` looks the same as the stored ``row``"""
+    return (
+        bool(row.colors) and len(row.colors) == len(colors)
+        and hamming(phash, row.phash) <= PHASH_MAX_DISTANCE
+        and color_distance(colors, row.colors) <= COLOR_MAX_DISTANCE
+    )
+
+
+def fingerprint(source, resource_type):
+    """``(sha256, phash, colors)`` for one file"""
+    phash, colors = perceptual_hash(source) if resource_type == 'image' else ('', '')
+    return content_hash(source), phash, colors
+
+
+def _reused(row):
+    from .uploads import UploadedAsset
+    return UploadedAsset(
+        url=row.url, public_id=row.public_id, resource_type=row.resource_type,
+        duration=row.duration, reused=True, placeholder=row.placeholder or None,
+    )
+
+
+def lookup(fingerprints, resource_types, owner=None):
+    """
+    ``owner``'s known assets for ``fingerprints`` (``{name: (sha256, phash, colors)}``);
+    returns ``{name: UploadedAsset}`` for the hits and marks them as just used,
+    which keeps ``media_gc`` off them for its grace period.
+    """
+    from .models import MediaAsset
+    if owner is None or not owner.is_authenticated:
+        return {}
+    by_hash = {
+        row.sha256: row
+        for row in MediaAsset.objects.filter(owner=owner, sha256__in=[sha for sha, _, _ in fingerprints.values()])
+    }
+    hits = {}
+    for name, (sha, _, _) in fingerprints.items():
+        row = by_hash.get(sha)
+        if row and row.resource_type == resource_types[name]:
+            hits[name] = row
+
+    near = {
+        name: (phash, colors) for name, (_, phash, colors) in fingerprints.items()
+        if phash and colors and has_detail(phash) and name not in hits
+    }
+    if near and near_matching_enabled():
+        candidates = list(
+            MediaAsset.objects.filter(owner=owner, resource_type='image').exclude(phash='').exclude(colors='')
+            [:PHASH_CANDIDATES]
+        )
+        for name, (phash, colors) in near.items():
+            matches = [row for row in candidates if is_near_duplicate(phash, colors, row)]
+            if matches:
+                hits[name] = min(matches, key=lambda row: hamming(phash, row.phash))
+
+    if hits:
+        MediaAsset.objects.filter(pk__in={row.pk for row in hits.values()}).update(last_used_at=timezone.now())
+    return {name: _reused(row) for name, row in hits.items()}
+
+
+def remember(assets, fingerprints, owner=None):
+    """
+    Record freshly uploaded ``assets`` (``{name: UploadedAsset}``). Every
+    upload is recorded, so ``marketplace.media_gc`` can delete it if it is
+    never used; only fingerprinted ones can be found again.
+    """
+    from .models import MediaAsset
+    owner = owner if owner is not None and owner.is_authenticated else None
+    now = timezone.now()
+    rows = []
+    for name, asset in assets.items():
+        if asset.reused:
+            continue
+        sha, phash, colors = fingerprints.get(name, (None, '', ''))
+        rows.append(MediaAsset(
+            sha256=sha, phash=phash, colors=colors,
+            resource_type=asset.resource_type, public_id=asset.public_id,
+            url=asset.url, duration=asset.duration or 0,
+            placeholder=asset.placeholder or {}, owner=owner, unreferenced_at=now,
+        ))
+    # A concurrent upload of the same bytes by the same owner may have won; keep its row
+    MediaAsset.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def forget(asset):
+    """Drop the record of an asset that is being deleted"""
+    from .models import MediaAsset
+    MediaAsset.objects.filter(public_id=asset.public_id).delete()
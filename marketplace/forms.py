@@ -1,6 +1,10 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
+import json
+
 from .models import User, Product, Service, Review, AvailabilityReport, ChangeRequest
+from . import chunked_uploads, media_probe
+from .uploads import UploadError, verify_direct_upload
 
 class UserRegisterForm(UserCreationForm):
     email = forms.EmailField(required=True)
@@ -21,7 +25,85 @@ class UserLoginForm(forms.Form):
     username = forms.CharField(max_length=150, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Username'}))
     password = forms.CharField(widget=forms.PasswordInput(attrs={'class': 'form-control', 'placeholder': 'Password'}))
 
-class ProductForm(forms.ModelForm):
+class DirectUploadMixin:
+    """
+    Lets the media fields arrive as a Cloudinary upload response (posted in a
+    hidden ``<name>_direct`` field by direct_upload.js) instead of a file.
+    Verified uploads end up in ``self.direct_assets``.
+    """
+    DIRECT_UPLOAD_FIELDS = {'image1': 'image', 'image2': 'image', 'image3': 'image', 'video': 'video'}
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.direct_assets = {}
+        for name in self.DIRECT_UPLOAD_FIELDS:
+            self.fields[f'{name}_direct'] = forms.CharField(required=False, widget=forms.HiddenInput)
+            if self.data.get(f'{name}_direct') and name in self.fields:
+                self.fields[name].required = False
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        for name, resource_type in self.DIRECT_UPLOAD_FIELDS.items():
+            raw = cleaned_data.get(f'{name}_direct')
+            if not raw:
+                continue
+            try:
+                self.direct_assets[name] = verify_direct_upload(json.loads(raw), resource_type)
+            except (ValueError, UploadError) as e:
+                self.add_error(name if name in self.fields else None, f'Upload could not be verified: {e}')
+        return cleaned_data
+
+class VideoProbeMixin:
+    """
+    Reads the uploaded video's container metadata (``marketplace.media_probe``)
+    and rejects it before any upload when it is too long, too short or too
+    large. The probe result is kept in ``self.video_info``.
+    
+    The video may also arrive as a finished resumable upload
+    (``marketplace.chunked_uploads``) whose id is posted in the hidden
+    ``video_upload`` field; pass ``user`` so its owner can be checked.
+    """
+    
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        self.video_info = None
+        self.chunked_files = {}
+        self.fields['video_upload'] = forms.CharField(required=False, widget=forms.HiddenInput)
+    
+    def clean_video(self):
+        video = self.cleaned_data.get('video')
+        source = video
+        upload_id = self.data.get('video_upload')
+        if not video and upload_id and self.user is not None:
+            try:
+                source = chunked_uploads.completed_path(upload_id, self.user)
+            except chunked_uploads.ChunkError as e:
+                raise forms.ValidationError(f'Video upload could not be used: {e}')
+            self.chunked_files['video'] = source
+        if not source:
+            return video
+        try:
+            info = media_probe.probe(source)
+        except media_probe.ProbeError:
+            # Formats we cannot read are left for Cloudinary to judge
+            return video
+        reason = media_probe.rejection_reason(info)
+        if reason:
+            raise forms.ValidationError(reason)
+        self.video_info = info
+        return video
+    
+    def media_files(self, request_files):
+        """The submitted files, with a finished resumable upload given by path"""
+        return {**{name: request_files.get(name) for name in request_files}, **self.chunked_files}
+    
+    def release_chunked_upload(self):
+        """Remove what is left of the resumable upload once it has been used"""
+        if self.chunked_files:
+            chunked_uploads.discard(self.data.get('video_upload'))
+
+class ProductForm(VideoProbeMixin, DirectUploadMixin, forms.ModelForm):
     # Image file fields (not URL fields)
     image1 = forms.ImageField(
         required=True,
@@ -70,7 +152,7 @@ class ProductForm(forms.ModelForm):
             'vendor_price': 'Enter your desired price. Commission will be added automatically.',
         }
 
-class ServiceForm(forms.ModelForm):
+class ServiceForm(VideoProbeMixin, DirectUploadMixin, forms.ModelForm):
     # Image file fields (optional for services)
     image1 = forms.ImageField(
         required=False,
@@ -0,0 +1,141 @@
+"""
+HTTP caching for public pages.
+
+``cache_policy`` sets ``Cache-Control`` per view: shared caches (the CDN) may
+keep anonymous pages for ``s_maxage`` seconds and serve them stale for
+``stale_while_revalidate`` more, while pages rendered for a signed-in user are
+``private``. ``Vary: Cookie`` keeps the two apart.
+
+The ETag helpers feed ``django.views.decorators.http.condition`` so a
+revalidation is answered with a 304 before the view runs. ETags are built from
+the cache generations the page depends on, so they change on every write that
+purges the page. No page sends Last-Modified: ``updated_at`` does not move for
+reviews, rating aggregates, related listings or deletions.
+"""
+import hashlib
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from . import overload
+from .caching import (
+    CATEGORY_NAMESPACE, REVIEW_NAMESPACE, browse_namespace, detail_namespace,
+    get_generation, listing_namespace, single_flight,
+)
+from .view_counter import record_view
+
+LISTING_PK_PREFIX = 'listing-pk'
+STATE_TIMEOUT = 60 * 60
+
+
+def cache_policy(s_maxage, stale_while_revalidate=0):
+    """Per-view ``Cache-Control``: public for anonymous visitors, private otherwise"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if response.has_header('Cache-Control'):
+                return response
+            if request.user.is_authenticated or response.cookies or response.status_code != 200:
+                patch_cache_control(response, private=True, no_cache=True)
+            elif overload.is_degraded():
+                # A reduced or stale page; shared caches may only shield the database briefly
+                patch_cache_control(response, public=True, max_age=0, s_maxage=overload.DEGRADED_PAGE_TIMEOUT)
+            else:
+                patch_cache_control(
+                    response, public=True, max_age=0, s_maxage=s_maxage,
+                    stale_while_revalidate=stale_while_revalidate,
+                )
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
+
+
+def _visitor(request):
+    """Part of the ETag that keeps one user's pages from validating another's"""
+    if len(get_messages(request)):
+        # Never answer 304 while a flash message is waiting to be shown
+        return None
+    user = request.user
+    return f'u{user.pk}' if user.is_authenticated else 'anon'
+
+
+def _etag(request, namespaces):
+    visitor = _visitor(request)
+    if visitor is None:
+        return None
+    generations = ':'.join(f'{namespace}={get_generation(namespace)}' for namespace in namespaces)
+    # Pages served in degraded mode must not validate once it is over
+    degraded = ':degraded' if overload.is_degraded() else ''
+    return hashlib.md5(f'{visitor}:{generations}{degraded}'.encode()).hexdigest()
+
+
+def _store(key, value):
+    cache.set(key, value, STATE_TIMEOUT)
+    return value
+
+
+def home_etag(request):
+    from .models import Product, Service
+    return _etag(request, [
+        listing_namespace(Product), listing_namespace(Service),
+        CATEGORY_NAMESPACE, REVIEW_NAMESPACE,
+    ])
+
+
+def categories_etag(request):
+    return _etag(request, [CATEGORY_NAMESPACE])
+
+
+def browse_etag(model):
+    def etag(request):
+        category = request.GET.get('category', '').strip()
+        return _etag(request, [browse_namespace(model, category), CATEGORY_NAMESPACE])
+    return etag
+
+
+def _detail_pk(request, model, slug):
+    """Primary key of the listing at ``slug`` (None when there is none), fetched once per request"""
+    pks = request.__dict__.setdefault('_listing_pks', {})
+    if (model, slug) not in pks:
+        namespace = detail_namespace(model, slug)
+        key = f'{LISTING_PK_PREFIX}:{namespace}:{get_generation(namespace)}'
+        pk = cache.get(key)
+        if pk is None:
+            pk, _ = single_flight(key, lambda: _store(
+                key, model._base_manager.filter(slug=slug).values_list('pk', flat=True).first() or ''
+            ), lambda: cache.get(key))
+        pks[model, slug] = pk or None
+    return pks[model, slug]
+
+
+def detail_etag(model):
+    def etag(request, slug):
+        if _detail_pk(request, model, slug) is None:
+            return None
+        return _etag(request, [detail_namespace(model, slug), CATEGORY_NAMESPACE])
+    return etag
+
+
+def conditional_detail(model):
+    """
+    ``condition`` for a listing detail view; a 304 still counts as a view of
+    the listing, except in degraded mode.
+    """
+    def decorator(view):
+        conditional = condition(etag_func=detail_etag(model))(view)
+
+        @wraps(view)
+        def wrapper(request, slug):
+            response = conditional(request, slug)
+            if response.status_code == 304 and not overload.is_degraded():
+                pk = _detail_pk(request, model, slug)
+                if pk:
+                    record_view(request, model(pk=pk))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,116 @@
+"""
+Local image pre-processing before upload.
+
+Phone photos arrive at 5-12MB. ``preprocess_image`` applies the EXIF
+orientation, shrinks the picture to fit ``MAX_SIZE`` (the same bound the
+Cloudinary transformation uses), drops all metadata and re-encodes it as
+WebP or JPEG, so only a few hundred KB leave the server. ``placeholder``
+computes the inline preview shown while a listing image loads.
+"""
+import base64
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+MAX_SIZE = (800, 600)
+QUALITY = {'WEBP': 80, 'JPEG': 82}
+EXTENSIONS = {'WEBP': '.webp', 'JPEG': '.jpg'}
+
+
+def output_format():
+    return getattr(settings, 'IMAGE_OUTPUT_FORMAT', 'WEBP').upper()
+
+
+def is_enabled():
+    return getattr(settings, 'IMAGE_PREPROCESS', True)
+
+
+def _source_name(source):
+    name = getattr(source, 'name', None) or (source if isinstance(source, str) else 'image')
+    return os.path.splitext(os.path.basename(name))[0] or 'image'
+
+
+def preprocess_image(source, max_size=MAX_SIZE, fmt=None, quality=None):
+    """
+    Return a ``ContentFile`` with the resized, re-encoded image; ``source``
+    is a path or file object. Unreadable images are returned unchanged.
+    """
+    fmt = (fmt or output_format()).upper()
+    quality = quality or QUALITY[fmt]
+    try:
+        with Image.open(source) as image:
+            # Let the JPEG decoder skip detail we would throw away (DCT scaling)
+            image.draft('RGB', (max_size[0] * 2, max_size[1] * 2))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+            has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+            if fmt == 'WEBP' and has_alpha:
+                image = image.convert('RGBA')
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            buffer = io.BytesIO()
+            # Saving without exif/icc_profile strips the metadata
+            options = {'quality': quality, 'optimize': True}
+            if fmt == 'WEBP':
+                options = {'quality': quality, 'method': 4}
+            elif fmt == 'JPEG':
+                options['progressive'] = True
+            image.save(buffer, fmt, **options)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        logger.warning('Image pre-processing skipped: %s', e)
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return source
+    return ContentFile(buffer.getvalue(), name=_source_name(source) + EXTENSIONS[fmt])
+
+
+# Low-quality image placeholders: a blurred preview small enough to inline in
+# the page, plus the size the image is delivered at so the browser can reserve
+# its box before it loads.
+
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 30
+
+
+def _delivered_size(size, orientation, max_size=MAX_SIZE):
+    width, height = size
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    scale = min(1.0, max_size[0] / width, max_size[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def placeholder(source, size=None):
+    """
+    ``{'width', 'height', 'lqip'}`` for an image, ``lqip`` being a
+    ``PLACEHOLDER_SIZE`` px WebP data URI of a few hundred bytes; ``None``
+    when the image cannot be read. Pass the original's ``size`` when
+    ``source`` is a reduced copy of it.
+    """
+    try:
+        with Image.open(source) as image:
+            if size:
+                width, height = _delivered_size(size, None)
+            else:
+                width, height = _delivered_size(image.size, image.getexif().get(0x0112))
+            image.draft('RGB', (PLACEHOLDER_SIZE * 8, PLACEHOLDER_SIZE * 8))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BOX)
+            buffer = io.BytesIO()
+            image.save(buffer, 'WEBP', quality=PLACEHOLDER_QUALITY)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        logger.warning('No placeholder for image: %s', e)
+        return None
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+    lqip = 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    return {'width': width, 'height': height, 'lqip': lqip}
@@ -0,0 +1,66 @@
+import io
+import time
+import urllib.request
+
+from django.core.management.base import BaseCommand
+from marketplace.imaging import placeholder
+from marketplace.models import Product, Service
+
+IMAGE_FIELDS = ('image1', 'image2', 'image3')
+MAX_DOWNLOAD = 20 * 1024 * 1024
+
+
+def download(url, timeout):
+    request = urllib.request.Request(url, headers={'User-Agent': 'arparte-placeholders'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return io.BytesIO(response.read(MAX_DOWNLOAD))
+
+
+class Command(BaseCommand):
+    help = 'Compute inline image placeholders for listing images that have none (older ones, or direct uploads whose copy could not be fetched)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=500, help='Listings updated per model and pass')
+        parser.add_argument('--timeout', type=int, default=10, help='Seconds allowed per image download')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running and backfill every --interval seconds'
+        )
+        parser.add_argument('--interval', type=int, default=300)
+
+    def handle(self, *args, **options):
+        while True:
+            for model in (Product, Service):
+                updated, failed = self.backfill(model, options['limit'], options['timeout'])
+                self.stdout.write(self.style.SUCCESS(
+                    f'Updated placeholders of {updated} {model._meta.verbose_name_plural}'
+                    + (f', {failed} image(s) could not be read' if failed else '')
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def backfill(self, model, limit, timeout):
+        updated = failed = 0
+        listings = model.objects.only('pk', *IMAGE_FIELDS, 'image_placeholders').order_by('pk')
+        for listing in listings.iterator():
+            urls = {getattr(listing, field) for field in IMAGE_FIELDS} - {''}
+            current = {url: value for url, value in listing.image_placeholders.items() if url in urls}
+            missing = urls - set(current)
+            for url in missing:
+                try:
+                    value = placeholder(download(url, timeout))
+                except (OSError, ValueError) as e:
+                    self.stderr.write(f'{url}: {e}')
+                    value = None
+                if value:
+                    current[url] = value
+                else:
+                    failed += 1
+            if current != listing.image_placeholders:
+                # Through the listing queryset so cached pages showing it are purged
+                model.objects.filter(pk=listing.pk).update(image_placeholders=current)
+                updated += 1
+                if updated >= limit:
+                    break
+        return updated, failed
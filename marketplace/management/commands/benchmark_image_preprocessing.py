@@ -0,0 +1,75 @@
+import io
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from marketplace import imaging
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.heic', '.bmp', '.tif', '.tiff'}
+
+
+class Command(BaseCommand):
+    help = 'Measure image pre-processing (bytes saved, time) over a folder of sample photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', nargs='?', help='Folder of sample images')
+        parser.add_argument(
+            '--synthetic', type=int, default=0,
+            help='Generate this many 12MP phone-like JPEGs instead of reading a folder'
+        )
+        parser.add_argument('--format', default=None, help='WEBP or JPEG (default: IMAGE_OUTPUT_FORMAT)')
+        parser.add_argument(
+            '--bandwidth', type=float, default=5.0,
+            help='Uplink in Mbit/s used to estimate upload time'
+        )
+
+    def handle(self, *args, **options):
+        samples = self.samples(options)
+        if not samples:
+            raise CommandError('No images found; pass a folder or --synthetic N')
+
+        fmt = (options['format'] or imaging.output_format()).upper()
+        bytes_per_second = options['bandwidth'] * 1_000_000 / 8
+        total_in = total_out = total_time = 0
+        for name, source, size in samples:
+            started = time.perf_counter()
+            processed = imaging.preprocess_image(source, fmt=fmt)
+            elapsed = time.perf_counter() - started
+            out = processed.size if hasattr(processed, 'size') else size
+            total_in += size
+            total_out += out
+            total_time += elapsed
+            self.stdout.write(
+                f'{name:<32} {size / 1024:>9.0f} KB -> {out / 1024:>7.0f} KB  {elapsed * 1000:>7.0f} ms'
+            )
+
+        upload_before = total_in / bytes_per_second
+        upload_after = total_out / bytes_per_second + total_time
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(samples)} images ({fmt}): {total_in / 1024 / 1024:.1f} MB -> {total_out / 1024 / 1024:.2f} MB '
+            f'({total_in / max(total_out, 1):.0f}x smaller), '
+            f'{total_time / len(samples) * 1000:.0f} ms per image; '
+            f'est. upload at {options["bandwidth"]:g} Mbit/s: {upload_before:.1f}s -> {upload_after:.1f}s'
+        ))
+
+    def samples(self, options):
+        if options['synthetic']:
+            return [self.synthetic(i) for i in range(options['synthetic'])]
+        corpus = options['corpus']
+        if not corpus or not os.path.isdir(corpus):
+            return []
+        return [
+            (name, os.path.join(corpus, name), os.path.getsize(os.path.join(corpus, name)))
+            for name in sorted(os.listdir(corpus))
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+        ]
+
+    def synthetic(self, index):
+        """A noisy 4000x3000 JPEG at phone-camera quality (~6-10MB)"""
+        image = Image.merge('RGB', [Image.effect_noise((4000, 3000), 40 + 10 * band + index) for band in range(3)])
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=95)
+        buffer.seek(0)
+        return f'synthetic-{index}.jpg', buffer, buffer.getbuffer().nbytes
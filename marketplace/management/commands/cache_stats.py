@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from marketplace.caching import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show hit rates of the versioned fragment caches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Cache names (default: every tracked cache)')
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing')
+
+    def handle(self, *args, **options):
+        stats = cache_stats(options['names'])
+        if not stats:
+            self.stdout.write('No cache activity recorded yet.')
+        for name, row in stats.items():
+            self.stdout.write(
+                f"{name:<28} {row['hit_rate']:>6.1%}  "
+                f"hit={row['hit']} stale={row['stale']} miss={row['miss']}"
+            )
+        if options['reset']:
+            reset_cache_stats(list(stats))
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
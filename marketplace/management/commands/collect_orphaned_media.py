@@ -0,0 +1,52 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from marketplace import media_gc
+from marketplace.uploads import DESTROY_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Delete uploaded images and videos that no listing or pending change request uses any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=int(media_gc.GRACE_PERIOD.total_seconds() // 3600),
+            help='Hours an asset must have been unreferenced before it is deleted'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DESTROY_BATCH_SIZE,
+            help=f'Assets per bulk delete call (at most {DESTROY_BATCH_SIZE})'
+        )
+        parser.add_argument('--max-batches', type=int, default=50, help='Bulk delete calls per pass')
+        parser.add_argument(
+            '--pause', type=float, default=media_gc.BATCH_PAUSE,
+            help='Seconds between bulk delete calls, to stay within the API rate limit'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='List what would be deleted')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running and collect every --interval seconds'
+        )
+        parser.add_argument('--interval', type=int, default=3600)
+
+    def handle(self, *args, **options):
+        while True:
+            outcome = media_gc.collect(
+                grace=timedelta(hours=options['grace']),
+                batch_size=options['batch_size'],
+                max_batches=options['max_batches'],
+                pause=options['pause'],
+                dry_run=options['dry_run'],
+            )
+            if options['dry_run']:
+                for public_id in outcome['deleted']:
+                    self.stdout.write(public_id)
+            self.stdout.write(self.style.SUCCESS(
+                f"{'Would delete' if options['dry_run'] else 'Deleted'} {len(outcome['deleted'])} orphaned asset(s), "
+                f"{outcome['kept']} still in use"
+                + (f", {outcome['failed']} could not be deleted" if outcome['failed'] else '')
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from marketplace.models import Product, Service
+from marketplace import related
+
+
+class Command(BaseCommand):
+    help = 'Precompute "related listings" for products and services that changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every active listing')
+        parser.add_argument('--top-k', type=int, default=related.TOP_K, help='Neighbours kept per listing')
+
+    def handle(self, *args, **options):
+        if related.np is None:
+            self.stdout.write(self.style.WARNING('NumPy not installed, using the pure-Python scorer'))
+        for model in (Product, Service):
+            scored = related.refresh_related(model, full=options['full'], k=options['top_k'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Scored {scored} {model._meta.verbose_name_plural}'
+            ))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from marketplace.promotions import BATCH_SIZE, expire_due
+
+
+class Command(BaseCommand):
+    help = 'Expire finished promotions and unfeature listings past featured_until'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running and expire every --interval seconds'
+        )
+        parser.add_argument('--interval', type=int, default=300)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            touched = expire_due(batch_size=options['batch_size'])
+            elapsed = (time.monotonic() - started) * 1000
+            summary = ', '.join(f'{count} {name}' for name, count in touched.items())
+            self.stdout.write(self.style.SUCCESS(
+                f'Expired {summary} ({sum(touched.values())} rows in {elapsed:.0f} ms)'
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from marketplace.view_counter import flush_view_counts
+
+
+class Command(BaseCommand):
+    help = 'Write buffered listing view counts to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running and flush every --interval seconds'
+        )
+        parser.add_argument('--interval', type=int, default=30)
+
+    def handle(self, *args, **options):
+        while True:
+            applied = flush_view_counts()
+            if applied is None:
+                self.stdout.write('Another flush is in progress, skipping.')
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Flushed {applied} view(s)'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
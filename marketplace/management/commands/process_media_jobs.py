@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from marketplace.media_jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Upload spooled listing media and publish the listings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running and poll for jobs every --interval seconds'
+        )
+        parser.add_argument('--interval', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=10, help='Jobs claimed per pass')
+
+    def handle(self, *args, **options):
+        while True:
+            outcome = run_pending(limit=options['limit'])
+            if any(outcome.values()) or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Media jobs: {outcome['done']} done, {outcome['retried']} retried, {outcome['failed']} failed, "
+                    f"{outcome['superseded']} superseded"
+                ))
+            if not options['loop']:
+                break
+            # Drain a backlog without sleeping between full batches
+            if sum(outcome.values()) < options['limit']:
+                time.sleep(options['interval'])
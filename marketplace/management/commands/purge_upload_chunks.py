@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from marketplace import chunked_uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable video uploads that were abandoned before the listing was submitted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=chunked_uploads.MAX_AGE // 3600,
+            help='Hours since the last chunk arrived'
+        )
+
+    def handle(self, *args, **options):
+        purged = chunked_uploads.purge_stale(max_age=options['max_age'] * 3600)
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} abandoned upload(s)'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from marketplace.models import Product, Service
+from marketplace import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for products and services'
+
+    def handle(self, *args, **kwargs):
+        for model in (Product, Service):
+            count = search.rebuild_index(model)
+            self.stdout.write(self.style.SUCCESS(
+                f'Indexed {count} {model._meta.verbose_name_plural}'
+            ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from marketplace.models import Product, Service
+from marketplace import ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized rating aggregates that drifted from approved reviews'
+
+    def handle(self, *args, **kwargs):
+        for model, review_field in ((Product, 'product'), (Service, 'service')):
+            fixed = ratings.reconcile(model, review_field)
+            self.stdout.write(self.style.SUCCESS(
+                f'Reconciled {fixed} {model._meta.verbose_name_plural}'
+            ))
@@ -0,0 +1,151 @@
+"""
+Garbage collection of orphaned uploads.
+
+Every uploaded file has a ``MediaAsset`` row (``dedup.remember``). Rows
+start out unreferenced, and ``release`` marks them again when a listing is
+deleted, a listing's image or video is replaced, or an image change request
+is rejected or deleted. ``collect`` takes the rows that have been
+unreferenced (and unused) for ``GRACE_PERIOD``, checks listings and pending
+change requests for the URL once more, and deletes the rest through the
+uploader in batches of ``DESTROY_BATCH_SIZE`` (Cloudinary's bulk delete API),
+pausing between calls to stay within the Admin API rate limit.
+
+Files uploaded before the ledger existed get a row when their listing lets
+go of them, with the public id read back from the URL.
+"""
+import logging
+import re
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .uploads import DESTROY_BATCH_SIZE, get_uploader
+
+logger = logging.getLogger(__name__)
+
+MEDIA_FIELDS = ('image1', 'image2', 'image3', 'video')
+GRACE_PERIOD = timedelta(hours=24)
+# Seconds between bulk delete calls; Cloudinary allows 500 Admin API calls an hour by default
+BATCH_PAUSE = 2.0
+
+CLOUDINARY_URL = re.compile(r'^https?://res\.cloudinary\.com/[^/]+/(?P<resource_type>image|video)/upload/(?P<path>.+)$')
+# Transformation segments (c_limit,w_800 or q_auto) before the version or public id
+TRANSFORMATION_SEGMENT = re.compile(r'^(?:[a-z]{1,3}_[^/]*)$')
+
+
+def listing_media(listing):
+    return {getattr(listing, field) for field in MEDIA_FIELDS} - {''}
+
+
+def _legacy_asset(url):
+    """Ledger row for a file uploaded before the ledger existed, or None"""
+    from .models import MediaAsset
+    match = CLOUDINARY_URL.match(url)
+    if match:
+        segments = match['path'].split('/')
+        versions = [i for i, segment in enumerate(segments) if re.fullmatch(r'v\d+', segment)]
+        if versions:
+            segments = segments[versions[0] + 1:]
+        else:
+            while len(segments) > 1 and TRANSFORMATION_SEGMENT.match(segments[0]):
+                segments = segments[1:]
+        public_id, _, _ = '/'.join(segments).rpartition('.')
+        return MediaAsset(url=url, public_id=public_id or '/'.join(segments), resource_type=match['resource_type'])
+    local_url = getattr(settings, 'LOCAL_MEDIA_URL', '')
+    if local_url and url.startswith(local_url):
+        public_id = url[len(local_url):]
+        resource_type = 'video' if public_id.startswith('arparte_videos/') else 'image'
+        return MediaAsset(url=url, public_id=public_id, resource_type=resource_type)
+    return None
+
+
+def release(urls):
+    """Mark the files at ``urls`` as possibly unused; ``collect`` decides"""
+    from .models import MediaAsset
+    urls = {url for url in urls if url}
+    if not urls:
+        return
+    now = timezone.now()
+    known = set(MediaAsset.objects.filter(url__in=urls).values_list('url', flat=True))
+    MediaAsset.objects.filter(url__in=known).update(unreferenced_at=now)
+    legacy = [asset for asset in map(_legacy_asset, urls - known) if asset]
+    for asset in legacy:
+        asset.unreferenced_at = asset.last_used_at = now
+    MediaAsset.objects.bulk_create(legacy, ignore_conflicts=True)
+
+
+def referenced_urls(urls):
+    """Those of ``urls`` a listing or a pending image change request still uses"""
+    from .models import ChangeRequest, Product, Service
+    urls = set(urls)
+    in_use = set()
+    query = Q()
+    for field in MEDIA_FIELDS:
+        query |= Q(**{f'{field}__in': urls})
+    for model in (Product, Service):
+        for values in model._base_manager.filter(query).values_list(*MEDIA_FIELDS):
+            in_use.update(values)
+    pending = ChangeRequest.objects.filter(status='pending', request_type='images')
+    for images in pending.values_list('new_images', flat=True):
+        in_use.update(images or ())
+    return in_use & urls
+
+
+def collect(uploader=None, grace=GRACE_PERIOD, batch_size=DESTROY_BATCH_SIZE, max_batches=None,
+            pause=BATCH_PAUSE, dry_run=False):
+    """
+    Delete orphaned assets; returns ``{'deleted': [public ids], 'kept': n,
+    'failed': n}``. With ``dry_run`` nothing changes and ``deleted`` lists
+    what would go. Stops at the first failed batch (usually a rate limit),
+    leaving the rest for the next run.
+    """
+    from .models import MediaAsset
+    uploader = uploader or get_uploader()
+    batch_size = min(batch_size, DESTROY_BATCH_SIZE)
+    cutoff = timezone.now() - grace
+    candidates = MediaAsset.objects.filter(
+        unreferenced_at__lte=cutoff, last_used_at__lte=cutoff,
+    ).order_by('pk')
+    outcome = {'deleted': [], 'kept': 0, 'failed': 0}
+    last_pk = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = list(candidates.filter(pk__gt=last_pk)[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1].pk
+        in_use = referenced_urls(row.url for row in rows)
+        kept = [row.pk for row in rows if row.url in in_use]
+        orphans = [row for row in rows if row.url not in in_use]
+        outcome['kept'] += len(kept)
+        if dry_run:
+            outcome['deleted'].extend(row.public_id for row in orphans)
+            batches += bool(orphans)
+            continue
+        MediaAsset.objects.filter(pk__in=kept).update(unreferenced_at=None)
+        if not orphans:
+            continue
+
+        # Skip any the dedup lookup handed out again meanwhile
+        claimed = set(MediaAsset.objects.filter(
+            pk__in=[row.pk for row in orphans], unreferenced_at__lte=cutoff, last_used_at__lte=cutoff,
+        ).values_list('pk', flat=True))
+        orphans = [row for row in orphans if row.pk in claimed]
+        if not orphans:
+            continue
+        if batches:
+            time.sleep(pause)
+        batches += 1
+        try:
+            gone = uploader.destroy_many(orphans)
+        except Exception:
+            logger.exception('Bulk delete of %d orphaned assets failed', len(orphans))
+            outcome['failed'] += len(orphans)
+            break
+        MediaAsset.objects.filter(pk__in=[row.pk for row in orphans if row.public_id in gone]).delete()
+        outcome['deleted'].extend(row.public_id for row in orphans if row.public_id in gone)
+        outcome['failed'] += sum(1 for row in orphans if row.public_id not in gone)
+    return outcome
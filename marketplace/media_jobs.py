@@ -0,0 +1,246 @@
+"""
+Deferred media processing for new listings.
+
+With ``MEDIA_PROCESSING = 'deferred'`` the create views spool the raw files
+to ``MEDIA_SPOOL_DIR``, save the listing as ``processing`` (hidden, and not
+something moderators can approve) and queue a ``MediaJob``.
+``process_media_jobs`` claims queued jobs, uploads the files
+(``marketplace.uploads``), checks the video duration and flips the listing to
+``active``. Failed jobs are retried with backoff up to ``MAX_ATTEMPTS`` times.
+
+A job stuck in ``processing`` for ``PROCESSING_TIMEOUT`` is reclaimed by
+another worker. Reclaiming is idempotent: every upload lands in the dedup
+ledger, so the new attempt reuses whatever the old one managed to upload, and
+a job is only settled by the worker holding the current claim. A worker that
+lost its claim leaves its uploads to the ledger (and ``media_gc``) untouched.
+
+The spool directory must be shared by the web process and the worker.
+"""
+import logging
+import os
+import shutil
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .media_probe import VIDEO_DURATION_RANGE
+from .uploads import upload_files
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30
+# A job left in "processing" this long belongs to a dead worker
+PROCESSING_TIMEOUT = 60 * 10
+
+MEDIA_FIELDS = ('image1', 'image2', 'image3', 'video')
+
+
+def is_deferred():
+    return getattr(settings, 'MEDIA_PROCESSING', 'inline') == 'deferred'
+
+
+def spool_dir():
+    return os.fspath(getattr(settings, 'MEDIA_SPOOL_DIR', os.path.join(settings.MEDIA_ROOT, 'spool')))
+
+
+def spool_files(request_files):
+    """
+    Write the submitted media files to a fresh spool directory; returns
+    ``{field: path}``. Files given as paths (finished chunked uploads) are moved.
+    """
+    directory = os.path.join(spool_dir(), uuid.uuid4().hex)
+    os.makedirs(directory, exist_ok=True)
+    spooled = {}
+    for name in MEDIA_FIELDS:
+        upload = request_files.get(name)
+        if not upload:
+            continue
+        _, extension = os.path.splitext(upload if isinstance(upload, str) else upload.name)
+        path = os.path.join(directory, f'{name}{extension.lower()}')
+        if isinstance(upload, str):
+            shutil.move(upload, path)
+        else:
+            with open(path, 'wb') as destination:
+                for chunk in upload.chunks():
+                    destination.write(chunk)
+        spooled[name] = path
+    return spooled
+
+
+def enqueue(listing, request_files):
+    """Spool ``request_files`` (see ``spool_files``) and queue a job for the (already saved) listing"""
+    from .models import MediaJob
+    field = listing._meta.model_name
+    return MediaJob.objects.create(**{field: listing, 'files': spool_files(request_files)})
+
+
+def discard_spool(job):
+    directories = {os.path.dirname(path) for path in job.files.values()}
+    for directory in directories:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _claimable(now):
+    return (
+        Q(status='queued', available_at__lte=now)
+        | Q(status='processing', started_at__lt=now - timedelta(seconds=PROCESSING_TIMEOUT))
+    )
+
+
+def claim_jobs(limit=10):
+    """Claim up to ``limit`` due jobs; safe with several workers running"""
+    from .models import MediaJob
+    now = timezone.now()
+    candidates = list(
+        MediaJob.objects.filter(_claimable(now)).order_by('available_at').values_list('pk', flat=True)[:limit]
+    )
+    claimed = [
+        pk for pk in candidates
+        # Compare-and-set: only one worker's UPDATE matches
+        if MediaJob.objects.filter(_claimable(now), pk=pk).update(
+            status='processing', started_at=now, attempts=F('attempts') + 1,
+        )
+    ]
+    return list(MediaJob.objects.filter(pk__in=claimed).select_related('product', 'service'))
+
+
+def _claimed(job):
+    from .models import MediaJob
+    return MediaJob.objects.filter(pk=job.pk, status='processing', started_at=job.started_at)
+
+
+def _holds_claim(job):
+    return _claimed(job).exists()
+
+
+def _settle(job, **fields):
+    """
+    Update the job if this worker still holds its claim; False when another
+    worker reclaimed it in the meantime
+    """
+    settled = _claimed(job).update(**fields)
+    for name, value in fields.items():
+        setattr(job, name, value)
+    return bool(settled)
+
+
+def _drop_unrecorded(batch):
+    """
+    Delete this attempt's uploads that lost the race for a dedup ledger row
+    (the reclaiming worker recorded the same bytes first); recorded ones stay
+    for reuse or ``media_gc``
+    """
+    from .models import MediaAsset
+    fresh = {name: asset for name, asset in batch.assets.items() if not asset.reused}
+    recorded = set(
+        MediaAsset.objects.filter(public_id__in=[asset.public_id for asset in fresh.values()])
+        .values_list('public_id', flat=True)
+    )
+    unrecorded = [name for name, asset in fresh.items() if asset.public_id not in recorded]
+    if unrecorded:
+        batch.discard(*unrecorded)
+
+
+def _finish(job, status, error=''):
+    return _settle(job, status=status, last_error=error, finished_at=timezone.now())
+
+
+def _retry_or_fail(job, error):
+    if job.attempts >= MAX_ATTEMPTS:
+        logger.error('Media job %s failed: %s', job.pk, error)
+        if not _finish(job, 'failed', error):
+            return 'superseded'
+        discard_spool(job)
+        return 'failed'
+    if not _settle(
+        job, status='queued', last_error=error,
+        available_at=timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1)),
+    ):
+        return 'superseded'
+    return 'retried'
+
+
+def process_job(job, uploader=None):
+    """
+    Upload one job's files and publish its listing; returns 'done', 'retried',
+    'failed' or 'superseded' (another worker reclaimed the job meanwhile)
+    """
+    listing = job.product or job.service
+    if listing is None:
+        if not _finish(job, 'failed', 'listing no longer exists'):
+            return 'superseded'
+        discard_spool(job)
+        return 'failed'
+
+    missing = [name for name, path in job.files.items() if not os.path.exists(path)]
+    if missing:
+        if not _finish(job, 'failed', f'spooled files missing: {", ".join(missing)}'):
+            return 'superseded'
+        return 'failed'
+
+    # Files an earlier, reclaimed attempt already uploaded are found in the dedup ledger
+    batch = upload_files(
+        {name: (path, 'video' if name == 'video' else 'image') for name, path in job.files.items()},
+        uploader=uploader,
+        owner=getattr(listing, listing.OWNER_FIELD),
+    )
+    if batch.errors:
+        if not _holds_claim(job):
+            # The worker that reclaimed the job may be reusing these uploads
+            _drop_unrecorded(batch)
+            return 'superseded'
+        # Retry the whole submission so the listing never goes live half uploaded
+        batch.discard()
+        return _retry_or_fail(job, batch.error_summary())
+
+    notes = ''
+    for name in ('image1', 'image2', 'image3'):
+        if name in batch.assets:
+            setattr(listing, name, batch.url(name))
+    listing.image_placeholders = {**listing.image_placeholders, **batch.placeholders()}
+    video = batch.assets.get('video')
+    if video:
+        low, high = VIDEO_DURATION_RANGE
+        if low <= video.duration <= high:
+            listing.video = video.url
+            listing.video_duration = video.duration
+        else:
+            batch.discard('video')
+            listing.video_info = {}
+            notes = f'video dropped: {video.duration} seconds is outside {low}-{high}'
+
+    with transaction.atomic():
+        # Settle the job before publishing; if it was reclaimed, the other worker publishes
+        published = _finish(job, 'done', notes)
+        if published:
+            listing.status = 'active'
+            listing.save(update_fields=[
+                'image1', 'image2', 'image3', 'image_placeholders', 'video', 'video_duration', 'video_info',
+                'status', 'updated_at',
+            ])
+    if not published:
+        _drop_unrecorded(batch)
+        return 'superseded'
+    discard_spool(job)
+    return 'done'
+
+
+def run_pending(limit=10, uploader=None):
+    """
+    Process up to ``limit`` due jobs; returns
+    ``{'done': n, 'retried': n, 'failed': n, 'superseded': n}``
+    """
+    outcome = {'done': 0, 'retried': 0, 'failed': 0, 'superseded': 0}
+    for job in claim_jobs(limit):
+        try:
+            result = process_job(job, uploader)
+        except Exception as e:
+            logger.exception('Media job %s crashed', job.pk)
+            result = _retry_or_fail(job, str(e))
+        outcome[result] += 1
+    return outcome
@@ -0,0 +1,331 @@
+"""
+Local video probing before upload.
+
+``probe`` reads duration, frame size and byte size from the container
+metadata of an uploaded video without decoding it: the box tree of MP4/MOV
+(ISO base media) files, or the EBML tree of WebM/Matroska files. Listing
+forms use it to reject videos outside ``VIDEO_DURATION_RANGE`` or over
+``MAX_VIDEO_SIZE`` before anything is sent to Cloudinary.
+"""
+import os
+import struct
+from dataclasses import asdict, dataclass
+
+VIDEO_DURATION_RANGE = (30, 90)
+MAX_VIDEO_SIZE = 50 * 1024 * 1024
+
+
+@dataclass
+class VideoInfo:
+    container: str
+    size: int
+    # None when the container does not record it
+    duration: float | None = None
+    width: int | None = None
+    height: int | None = None
+
+    def as_dict(self):
+        return asdict(self)
+
+
+class ProbeError(Exception):
+    """The file is not a video container we can read"""
+
+
+def rejection_reason(info):
+    """Why a probed video cannot be listed, or ``None``"""
+    low, high = VIDEO_DURATION_RANGE
+    if info.size > MAX_VIDEO_SIZE:
+        return f'Video must be at most {MAX_VIDEO_SIZE // (1024 * 1024)}MB. Your video is {info.size / (1024 * 1024):.0f}MB.'
+    if info.duration is not None and not low <= info.duration <= high:
+        return f'Video duration must be between {low}-{high} seconds. Your video is {info.duration:.0f} seconds.'
+    return None
+
+
+def probe(source):
+    """
+    ``VideoInfo`` for a path or seekable file object (rewound afterwards);
+    raises ``ProbeError`` for anything but a readable MP4/MOV/WebM/Matroska.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return _probe(f, os.path.getsize(source))
+    try:
+        source.seek(0, os.SEEK_END)
+        size = source.tell()
+        return _probe(source, size)
+    finally:
+        source.seek(0)
+
+
+def _probe(f, size):
+    f.seek(0)
+    head = f.read(8)
+    try:
+        if int.from_bytes(head[:4], 'big') == EBML_HEADER:
+            return _probe_matroska(f, size)
+        if head[4:8] in MP4_TOP_LEVEL:
+            return _probe_mp4(f, size)
+    except (struct.error, ValueError, OverflowError, IndexError) as e:
+        # IndexError: a short read of a truncated file (e.g. an interrupted upload)
+        raise ProbeError(f'corrupt video container: {e}')
+    raise ProbeError('not an MP4, MOV or WebM file')
+
+
+# MP4 / MOV
+
+MP4_TOP_LEVEL = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'}
+
+
+def _boxes(f, start, end):
+    """``(type, data start, data end)`` for the boxes in ``[start, end)``"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            raise ProbeError(f'corrupt {kind!r} box')
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _child(f, start, end, kind):
+    return next(((s, e) for k, s, e in _boxes(f, start, end) if k == kind), None)
+
+
+def _full_box(f, start):
+    """Version of a full box, leaving ``f`` after its version/flags"""
+    f.seek(start)
+    return f.read(4)[0]
+
+
+def _probe_mp4(f, size):
+    info = VideoInfo(container='mp4', size=size)
+    moov = None
+    for kind, start, end in _boxes(f, 0, size):
+        if kind == b'ftyp':
+            f.seek(start)
+            if f.read(4) == b'qt  ':
+                info.container = 'mov'
+        elif kind == b'moov':
+            moov = (start, end)
+    if moov is None:
+        raise ProbeError('no moov box')
+
+    timescale = None
+    for kind, start, end in _boxes(f, *moov):
+        if kind == b'mvhd':
+            if _full_box(f, start) == 1:
+                _, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+            else:
+                _, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+            if timescale and duration:
+                info.duration = duration / timescale
+        elif kind == b'mvex' and info.duration is None and timescale:
+            # Fragmented files keep the total in the movie extends header
+            mehd = _child(f, start, end, b'mehd')
+            if mehd:
+                version = _full_box(f, mehd[0])
+                duration = struct.unpack('>Q' if version == 1 else '>I', f.read(8 if version == 1 else 4))[0]
+                info.duration = duration / timescale or None
+        elif kind == b'trak' and info.width is None:
+            _read_video_track(f, start, end, info)
+    return info
+
+
+def _read_video_track(f, start, end, info):
+    mdia = _child(f, start, end, b'mdia')
+    hdlr = mdia and _child(f, *mdia, b'hdlr')
+    if not hdlr:
+        return
+    f.seek(hdlr[0] + 8)
+    if f.read(4) != b'vide':
+        return
+    tkhd = _child(f, start, end, b'tkhd')
+    if not tkhd:
+        return
+    version = _full_box(f, tkhd[0])
+    # Skip times, track id and duration, then reserved, layer, group and volume
+    f.seek(tkhd[0] + 4 + (32 if version == 1 else 20) + 16)
+    a, b = struct.unpack('>ii', f.read(8))
+    f.seek(28, os.SEEK_CUR)
+    width, height = (value >> 16 for value in struct.unpack('>II', f.read(8)))
+    if a == 0 and b != 0:
+        # Rotated a quarter turn (portrait phone video)
+        width, height = height, width
+    info.width, info.height = width or None, height or None
+
+
+# WebM / Matroska
+
+EBML_HEADER = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_TYPE = 0x83
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+CLUSTER = 0x1F43B675
+CLUSTER_TIMECODE = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+# Children of Segment (SeekHead, Info, Tracks, Cluster, Cues, Attachments,
+# Chapters, Tags); meeting one ends a cluster of unknown size
+SEGMENT_CHILDREN = {
+    0x114D9B74, INFO, TRACKS, CLUSTER, 0x1C53BB6B, 0x1941A469, 0x1043A770, 0x1254C367,
+}
+
+
+def _vint_length(first):
+    if not first:
+        raise ProbeError('corrupt EBML variable-length integer')
+    return 9 - first.bit_length()
+
+
+def _element(f, pos):
+    """``(id, data start, data size)`` at ``pos``; the size is None when unknown"""
+    f.seek(pos)
+    first = f.read(1)
+    if not first:
+        return None
+    id_length = _vint_length(first[0])
+    if id_length > 4:
+        raise ProbeError('corrupt EBML element id')
+    element_id = int.from_bytes(first + f.read(id_length - 1), 'big')
+    size_first = f.read(1)
+    size_length = _vint_length(size_first[0] if size_first else 0)
+    mask = (1 << (7 * size_length)) - 1
+    size = int.from_bytes(size_first + f.read(size_length - 1), 'big') & mask
+    return element_id, pos + id_length + size_length, None if size == mask else size
+
+
+def _elements(f, start, end):
+    pos = start
+    while pos < end:
+        element = _element(f, pos)
+        if element is None or element[2] is None:
+            return
+        yield element
+        pos = element[1] + element[2]
+
+
+def _uint(f, start, size):
+    f.seek(start)
+    return int.from_bytes(f.read(size), 'big')
+
+
+def _float(f, start, size):
+    f.seek(start)
+    return struct.unpack('>f' if size == 4 else '>d', f.read(size))[0]
+
+
+def _probe_matroska(f, size):
+    element_id, start, length = _element(f, 0)
+    info = VideoInfo(container='matroska', size=size)
+    for child_id, child_start, child_size in _elements(f, start, start + (length or 0)):
+        if child_id == DOC_TYPE:
+            f.seek(child_start)
+            info.container = f.read(child_size).rstrip(b'\0').decode('ascii', 'replace')
+
+    segment = _element(f, start + (length or 0))
+    if not segment or segment[0] != SEGMENT:
+        raise ProbeError('no Matroska segment')
+    pos, segment_end = segment[1], size if segment[2] is None else min(size, segment[1] + segment[2])
+
+    scale = 1_000_000
+    duration = None
+    last_timecode = None
+    while pos < segment_end:
+        element = _element(f, pos)
+        if element is None:
+            break
+        element_id, start, length = element
+        if element_id == INFO and length is not None:
+            for child_id, child_start, child_size in _elements(f, start, start + length):
+                if child_id == TIMECODE_SCALE:
+                    scale = _uint(f, child_start, child_size)
+                elif child_id == DURATION:
+                    duration = _float(f, child_start, child_size)
+        elif element_id == TRACKS and length is not None:
+            _read_video_entry(f, start, start + length, info)
+        elif element_id == CLUSTER:
+            if duration is not None and info.width is not None:
+                break
+            # Live recordings (e.g. MediaRecorder) leave Duration out; take the last block time
+            pos, timecode = _scan_cluster(f, start, length, segment_end)
+            if timecode is not None:
+                last_timecode = max(timecode, last_timecode or 0)
+            continue
+        if length is None:
+            break
+        pos = start + length
+
+    if duration is None:
+        duration = last_timecode
+    if duration:
+        info.duration = duration * scale / 1e9
+    return info
+
+
+def _read_video_entry(f, start, end, info):
+    for entry_id, entry_start, entry_size in _elements(f, start, end):
+        if entry_id != TRACK_ENTRY:
+            continue
+        children = list(_elements(f, entry_start, entry_start + entry_size))
+        if not any(i == TRACK_TYPE and _uint(f, s, n) == 1 for i, s, n in children):
+            continue
+        for child_id, child_start, child_size in children:
+            if child_id == VIDEO:
+                for video_id, video_start, video_size in _elements(f, child_start, child_start + child_size):
+                    if video_id == PIXEL_WIDTH:
+                        info.width = _uint(f, video_start, video_size)
+                    elif video_id == PIXEL_HEIGHT:
+                        info.height = _uint(f, video_start, video_size)
+        return
+
+
+def _block_timecode(f, start):
+    """Timecode of a (Simple)Block relative to its cluster"""
+    f.seek(start)
+    track_length = _vint_length(f.read(1)[0])
+    f.seek(start + track_length)
+    return struct.unpack('>h', f.read(2))[0]
+
+
+def _scan_cluster(f, start, length, segment_end):
+    """``(end of the cluster, latest block timecode in it)``"""
+    end = segment_end if length is None else start + length
+    base = 0
+    latest = None
+    pos = start
+    while pos < end:
+        element = _element(f, pos)
+        if element is None:
+            return end, latest
+        element_id, data_start, size = element
+        if length is None and element_id in SEGMENT_CHILDREN:
+            return pos, latest
+        if size is None:
+            return end, latest
+        if element_id == CLUSTER_TIMECODE:
+            base = _uint(f, data_start, size)
+        elif element_id == SIMPLE_BLOCK:
+            latest = max(latest or 0, base + _block_timecode(f, data_start))
+        elif element_id == BLOCK_GROUP:
+            for child_id, child_start, _ in _elements(f, data_start, data_start + size):
+                if child_id == BLOCK:
+                    latest = max(latest or 0, base + _block_timecode(f, child_start))
+        pos = data_start + size
+    return end, latest
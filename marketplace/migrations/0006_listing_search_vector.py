@@ -0,0 +1,61 @@
+# Generated by Django 5.1.3 on 2026-10-17 19:11
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+LISTING_TABLES = ('marketplace_product', 'marketplace_service')
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in LISTING_TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                f"UPDATE {table} SET search_vector = "
+                f"setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+                f"setweight(to_tsvector('english', coalesce(campus, '') || ' ' || coalesce(location, '')), 'B') || "
+                f"setweight(to_tsvector('english', coalesce(description, '')), 'C')"
+            )
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_search_gin ON {table} USING gin (search_vector)"
+            )
+        elif vendor == 'sqlite':
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5("
+                f"listing_id UNINDEXED, title, description, location, campus, "
+                f"tokenize='porter unicode61')"
+            )
+            schema_editor.execute(
+                f"INSERT INTO {table}_fts (listing_id, title, description, location, campus) "
+                f"SELECT id, title, description, location, campus FROM {table}"
+            )
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in LISTING_TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_gin")
+        elif vendor == 'sqlite':
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0005_product_is_available_product_marked_unavailable_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.1.3 on 2026-10-17 19:17
+
+from django.db import migrations, models
+from django.db.models import Count, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+
+def backfill_ratings(apps, schema_editor):
+    Review = apps.get_model('marketplace', 'Review')
+    for model_name, review_field in (('Product', 'product'), ('Service', 'service')):
+        model = apps.get_model('marketplace', model_name)
+        approved = Review.objects.filter(**{review_field: OuterRef('pk')}, is_approved=True).order_by()
+        total = Coalesce(
+            Subquery(approved.values(review_field).annotate(total=Sum('rating')).values('total')),
+            Value(0),
+        )
+        reviews = Coalesce(
+            Subquery(approved.values(review_field).annotate(reviews=Count('id')).values('reviews')),
+            Value(0),
+        )
+        model.objects.update(
+            rating_sum=total,
+            rating_count=reviews,
+            rating_avg=Coalesce(Cast(total, FloatField()) / NullIf(reviews, Value(0)), Value(0.0)),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0008_listing_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='rating_avg',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'rating_avg', 'id'], name='marketplace_status_d7d5bd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['status', 'rating_avg', 'id'], name='marketplace_status_b50435_idx'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.3 on 2026-10-17 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0010_related_listings'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_featured', 'featured_until'], name='marketplace_is_feat_9ae898_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='promotion',
+            index=models.Index(fields=['status', 'end_date'], name='marketplace_status_cb9507_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['is_featured', 'featured_until'], name='marketplace_is_feat_5d03f2_idx'),
+        ),
+    ]
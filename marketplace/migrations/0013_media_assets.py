@@ -0,0 +1,35 @@
+# Generated by Django 5.1.3 on 2026-10-17 19:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0012_media_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('phash', models.CharField(blank=True, max_length=16)),
+                ('resource_type', models.CharField(choices=[('image', 'Image'), ('video', 'Video')], default='image', max_length=10)),
+                ('public_id', models.CharField(max_length=255, unique=True)),
+                ('url', models.URLField(max_length=500)),
+                ('duration', models.FloatField(default=0)),
+                ('use_count', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='media_assets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['owner', 'resource_type', '-created_at'], name='marketplace_owner_i_1499ef_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-17 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0014_image_placeholders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='video_info',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='video_info',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
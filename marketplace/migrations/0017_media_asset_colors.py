@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-17 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0016_media_asset_gc'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaasset',
+            name='colors',
+            field=models.CharField(blank=True, max_length=96),
+        ),
+    ]
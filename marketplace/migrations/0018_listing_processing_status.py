@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-17 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0017_media_asset_colors'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('sold', 'Sold'), ('inactive', 'Inactive'), ('pending', 'Pending Approval'), ('processing', 'Processing Media')], default='active', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='service',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('inactive', 'Inactive'), ('pending', 'Pending Approval'), ('processing', 'Processing Media')], default='active', max_length=20),
+        ),
+    ]
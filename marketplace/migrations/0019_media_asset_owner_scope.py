@@ -0,0 +1,26 @@
+# Generated by Django 5.1.3 on 2026-10-17 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0018_listing_processing_status'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='mediaasset',
+            name='use_count',
+        ),
+        migrations.AlterField(
+            model_name='mediaasset',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='mediaasset',
+            constraint=models.UniqueConstraint(fields=('owner', 'sha256'), name='media_asset_owner_sha256'),
+        ),
+    ]
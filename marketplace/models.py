@@ -1,9 +1,16 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from django.utils.text import slugify
 import uuid
 from decimal import Decimal
+from . import search
+from .caching import bump_generation, listing_namespace, purge_listing_pages
+
+# Engagement counters that do not change what a listing shows up for
+LISTING_METRIC_FIELDS = frozenset({'views', 'availability_reports'})
 
 class User(AbstractUser):
     ACCOUNT_TYPE = (
@@ -40,6 +47,41 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class ListingQuerySet(models.QuerySet):
+    """Shared queryset for Product and Service listings"""
+
+    def update(self, **kwargs):
+        if LISTING_METRIC_FIELDS.issuperset(kwargs):
+            return super().update(**kwargs)
+        # Bulk updates skip signals, so re-index text changes and purge the
+        # cached pages of the affected rows here
+        before = list(self.values_list('pk', 'slug', 'category_id'))
+        rows = super().update(**kwargs)
+        if search.SEARCH_FIELDS.intersection(kwargs):
+            search.index_listings(self.model, [row[0] for row in before], using=self.db)
+        bump_generation(listing_namespace(self.model))
+        if before:
+            _, slugs, category_ids = zip(*before)
+            category = kwargs.get('category_id', kwargs.get('category'))
+            if not hasattr(category, 'resolve_expression'):
+                category_ids += (getattr(category, 'pk', category),)
+            purge_listing_pages(self.model, slugs, category_ids)
+        return rows
+    update.alters_data = True
+
+    def for_cards(self):
+        """
+        Everything a listing card renders in a single query: category and
+        owner joined in, only the card columns loaded, ratings from the
+        denormalized aggregates.
+        """
+        owner = self.model.OWNER_FIELD
+        return self.select_related('category', owner).only(
+            *self.model.CARD_FIELDS,
+            'category__name', 'category__slug', 'category__icon',
+            f'{owner}__username', f'{owner}__is_verified',
+        )
+
 class Product(models.Model):
     CONDITION_CHOICES = (
         ('new', 'Brand New'),
@@ -54,6 +96,8 @@ class Product(models.Model):
         ('sold', 'Sold'),
         ('inactive', 'Inactive'),
         ('pending', 'Pending Approval'),
+        # Deferred media still uploading (marketplace.media_jobs)
+        ('processing', 'Processing Media'),
     )
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -84,6 +128,8 @@ class Product(models.Model):
     image1 = models.URLField()
     image2 = models.URLField()
     image3 = models.URLField(blank=True)
+    # Inline previews keyed by image URL: {url: {'width', 'height', 'lqip'}} (see marketplace.imaging.placeholder)
+    image_placeholders = models.JSONField(default=dict, blank=True, editable=False)
     
     # Status & Promotion
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
@@ -104,6 +150,8 @@ class Product(models.Model):
 
     video = models.URLField(blank=True, help_text='Cloudinary video URL (30-90 seconds)')
     video_duration = models.IntegerField(null=True, blank=True, help_text='Video duration in seconds')
+    # Container metadata read before upload (see marketplace.media_probe)
+    video_info = models.JSONField(default=dict, blank=True, editable=False)
     is_available = models.BooleanField(default=True)
     marked_unavailable_at = models.DateTimeField(null=True, blank=True)
     marked_unavailable_by = models.ForeignKey(
@@ -113,16 +161,43 @@ class Product(models.Model):
         blank=True, 
         related_name='unavailable_products'
     )
+
+    # Last time the related-listings engine scored this listing
+    related_computed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Approved review aggregates (maintained by marketplace.ratings)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False)
+
+    # Full-text search document (maintained by marketplace.search)
+    search_vector = SearchVectorField(null=True, editable=False)
         
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ListingQuerySet.as_manager()
+
+    OWNER_FIELD = 'seller'
+    CARD_FIELDS = (
+        'id', 'slug', 'title', 'description', 'price', 'condition',
+        'location', 'campus', 'image1', 'image_placeholders', 'status', 'is_featured', 'featured_until',
+        'is_available', 'views', 'availability_reports',
+        'rating_count', 'rating_avg', 'created_at', 'category', 'seller',
+    )
     
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['status', '-created_at']),
             models.Index(fields=['is_featured', '-created_at']),
+            models.Index(fields=['is_featured', 'featured_until']),
             models.Index(fields=['category', 'status']),
+            # Keyset pagination: one (status, sort column, id) index per browse sort
+            models.Index(fields=['status', 'created_at', 'id']),
+            models.Index(fields=['status', 'price', 'id']),
+            models.Index(fields=['status', 'title', 'id']),
+            models.Index(fields=['status', 'rating_avg', 'id']),
         ]
     
     def calculate_commission_and_price(self):
@@ -151,10 +226,7 @@ class Product(models.Model):
     
     @property
     def average_rating(self):
-        ratings = self.reviews.all()
-        if ratings.exists():
-            return sum(r.rating for r in ratings) / ratings.count()
-        return 0
+        return self.rating_avg
     
     @property
     def commission_amount(self):
@@ -166,6 +238,8 @@ class Service(models.Model):
         ('active', 'Active'),
         ('inactive', 'Inactive'),
         ('pending', 'Pending Approval'),
+        # Deferred media still uploading (marketplace.media_jobs)
+        ('processing', 'Processing Media'),
     )
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -200,6 +274,8 @@ class Service(models.Model):
     image1 = models.URLField(blank=True)
     image2 = models.URLField(blank=True)
     image3 = models.URLField(blank=True)
+    # Inline previews keyed by image URL: {url: {'width', 'height', 'lqip'}} (see marketplace.imaging.placeholder)
+    image_placeholders = models.JSONField(default=dict, blank=True, editable=False)
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     is_featured = models.BooleanField(default=False)
@@ -209,6 +285,8 @@ class Service(models.Model):
 
     video = models.URLField(blank=True, help_text='Cloudinary video URL (30-90 seconds)')
     video_duration = models.IntegerField(null=True, blank=True, help_text='Video duration in seconds')
+    # Container metadata read before upload (see marketplace.media_probe)
+    video_info = models.JSONField(default=dict, blank=True, editable=False)
     is_available = models.BooleanField(default=True)
     marked_unavailable_at = models.DateTimeField(null=True, blank=True)
     marked_unavailable_by = models.ForeignKey(
@@ -218,12 +296,41 @@ class Service(models.Model):
         blank=True, 
         related_name='unavailable_services'
     )
+
+    # Last time the related-listings engine scored this listing
+    related_computed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Approved review aggregates (maintained by marketplace.ratings)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False)
+
+    # Full-text search document (maintained by marketplace.search)
+    search_vector = SearchVectorField(null=True, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ListingQuerySet.as_manager()
+
+    OWNER_FIELD = 'provider'
+    CARD_FIELDS = (
+        'id', 'slug', 'title', 'description', 'price', 'price_type',
+        'location', 'campus', 'image1', 'image_placeholders', 'status', 'is_featured', 'featured_until',
+        'is_available', 'views',
+        'rating_count', 'rating_avg', 'created_at', 'category', 'provider',
+    )
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination: one (status, sort column, id) index per browse sort
+            models.Index(fields=['status', 'created_at', 'id']),
+            models.Index(fields=['status', 'price', 'id']),
+            models.Index(fields=['status', 'title', 'id']),
+            models.Index(fields=['status', 'rating_avg', 'id']),
+            models.Index(fields=['is_featured', 'featured_until']),
+        ]
 
 
     def calculate_commission_and_price(self):
@@ -252,10 +359,7 @@ class Service(models.Model):
     
     @property
     def average_rating(self):
-        ratings = self.service_reviews.all()
-        if ratings.exists():
-            return sum(r.rating for r in ratings) / ratings.count()
-        return 0
+        return self.rating_avg
     
     @property
     def commission_amount(self):
@@ -280,6 +384,11 @@ class Review(models.Model):
     class Meta:
         ordering = ['-created_at']
     
+    def save(self, *args, **kwargs):
+        # The rating aggregates are adjusted from the save signals; commit them with the review
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+    
     def __str__(self):
         item = self.product or self.service
         return f"Review by {self.reviewer.username} for {item}"
@@ -336,6 +445,9 @@ class Promotion(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'end_date']),
+        ]
     
     def __str__(self):
         item = self.product or self.service
@@ -394,4 +506,105 @@ class Message(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"Message from {self.sender.username} to {self.recipient.username}"
\ No newline at end of file
+        return f"Message from {self.sender.username} to {self.recipient.username}"
+
+class RelatedListing(models.Model):
+    """Precomputed nearest neighbours of a listing (see marketplace.related)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbours', null=True, blank=True)
+    related_product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbour_of', null=True, blank=True)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='neighbours', null=True, blank=True)
+    related_service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='neighbour_of', null=True, blank=True)
+    
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['rank']
+        indexes = [
+            models.Index(fields=['product', 'rank']),
+            models.Index(fields=['service', 'rank']),
+        ]
+    
+    def __str__(self):
+        source = self.product or self.service
+        target = self.related_product or self.related_service
+        return f"{source} -> {target} ({self.score:.2f})"
+
+class MediaJob(models.Model):
+    """Deferred upload of a listing's spooled media (see marketplace.media_jobs)"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='media_jobs', null=True, blank=True)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='media_jobs', null=True, blank=True)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # form field name -> spooled file path
+    files = models.JSONField(default=dict)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    
+    available_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+    
+    def __str__(self):
+        return f"Media job for {self.product or self.service} - {self.status}"
+
+class MediaAsset(models.Model):
+    """
+    Ledger of uploaded media files: found by content hash before uploading
+    again (marketplace.dedup) and deleted once nothing uses them
+    (marketplace.media_gc)
+    """
+    RESOURCE_TYPES = (
+        ('image', 'Image'),
+        ('video', 'Video'),
+    )
+    
+    # Empty for files that were not fingerprinted (direct uploads, dedup off)
+    sha256 = models.CharField(max_length=64, null=True, blank=True)
+    # dHash of the picture, for near-identical re-encodes (images only)
+    phash = models.CharField(max_length=16, blank=True)
+    # Average RGB of a 4x4 grid, confirming dHash near matches (images only)
+    colors = models.CharField(max_length=96, blank=True)
+    resource_type = models.CharField(max_length=10, choices=RESOURCE_TYPES, default='image')
+    
+    public_id = models.CharField(max_length=255, unique=True)
+    url = models.URLField(max_length=500)
+    duration = models.FloatField(default=0)
+    placeholder = models.JSONField(default=dict, blank=True)
+    
+    # Exact and near matches are both looked up within one owner's files
+    owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='media_assets')
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True)
+    # Set on upload and when a listing or change request lets go of the file;
+    # cleared once the collector finds it in use
+    unreferenced_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['owner', 'resource_type', '-created_at']),
+            models.Index(fields=['unreferenced_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'sha256'], name='media_asset_owner_sha256'),
+        ]
+    
+    def __str__(self):
+        return f"{self.resource_type} {self.public_id}"
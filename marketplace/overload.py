@@ -0,0 +1,164 @@
+"""
+Overload protection.
+
+``DegradedModeMiddleware`` times every database query and counts database
+errors over a rolling ``WINDOW``. Once the mean latency passes
+``DEGRADED_LATENCY_MS`` or the error rate reaches ``DEGRADED_ERROR_RATE``,
+the process switches to degraded mode. It tells the other processes through
+a cache flag that lasts ``HOLD`` seconds. In degraded mode:
+
+* writes (anything but GET, HEAD and OPTIONS) are answered with 503 and
+  ``Retry-After``, except under ``EXEMPT_PATHS``;
+* cache misses get the last stale copy instead of a rebuild when there is
+  one (``caching.single_flight``). Pages rendered in the meantime are cached
+  for only ``DEGRADED_PAGE_TIMEOUT``;
+* detail pages skip view counting, reviews and related listings
+  (``is_degraded``).
+
+Degraded mode ends on its own once query latency drops below
+``DEGRADED_RECOVERY_MS`` and the flag runs out.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import InterfaceError, OperationalError, connection
+from django.http import HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 30
+# Fewer queries than this in the window are too few to judge by
+MIN_QUERIES = 20
+MAX_SAMPLES = 10000
+# Seconds between evaluations of the window
+CHECK_INTERVAL = 1
+FLAG_KEY = 'overload:degraded'
+# Seconds other processes stay degraded after the last overloaded check; also the Retry-After
+HOLD = 30
+DEGRADED_PAGE_TIMEOUT = 30
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+EXEMPT_PATHS = ('/admin/',)
+
+# (monotonic time, seconds, failed) per query
+_samples = deque(maxlen=MAX_SAMPLES)
+_lock = threading.Lock()
+_overloaded = False
+_degraded = False
+_checked_at = 0.0
+
+
+def is_enabled():
+    return getattr(settings, 'DEGRADED_MODE', True)
+
+
+def record_query(duration, failed=False):
+    with _lock:
+        _samples.append((time.monotonic(), duration, failed))
+
+
+def window_stats():
+    """``(queries, mean latency in ms, error rate)`` over the last ``WINDOW`` seconds"""
+    horizon = time.monotonic() - WINDOW
+    with _lock:
+        while _samples and _samples[0][0] < horizon:
+            _samples.popleft()
+        samples = list(_samples)
+    if not samples:
+        return 0, 0.0, 0.0
+    return (
+        len(samples),
+        1000 * sum(duration for _, duration, _ in samples) / len(samples),
+        sum(failed for _, _, failed in samples) / len(samples),
+    )
+
+
+def _is_overloaded(queries, latency, error_rate, overloaded):
+    error_limit = getattr(settings, 'DEGRADED_ERROR_RATE', 0.2)
+    if overloaded:
+        # Stay until the queries that still run are fast again
+        return latency > getattr(settings, 'DEGRADED_RECOVERY_MS', 100) or error_rate >= error_limit
+    return queries >= MIN_QUERIES and (
+        latency > getattr(settings, 'DEGRADED_LATENCY_MS', 300) or error_rate >= error_limit
+    )
+
+
+def is_degraded():
+    """Whether this process, or another one recently, finds the database overloaded"""
+    global _overloaded, _degraded, _checked_at
+    if not is_enabled():
+        return False
+    now = time.monotonic()
+    if now - _checked_at < CHECK_INTERVAL:
+        return _degraded
+    _checked_at = now
+
+    queries, latency, error_rate = window_stats()
+    overloaded = _is_overloaded(queries, latency, error_rate, _overloaded)
+    if overloaded != _overloaded:
+        logger.warning(
+            'Database %s: %d queries in %ds, mean %.0fms, %.0f%% errors',
+            'overloaded' if overloaded else 'recovered', queries, WINDOW, latency, 100 * error_rate,
+        )
+    _overloaded = overloaded
+    if overloaded:
+        cache.set(FLAG_KEY, 1, HOLD)
+        degraded = True
+    else:
+        degraded = bool(cache.get(FLAG_KEY))
+    if degraded != _degraded:
+        logger.warning('%s degraded mode', 'Entering' if degraded else 'Leaving')
+    _degraded = degraded
+    return degraded
+
+
+def _timed(execute, sql, params, many, context):
+    started = time.perf_counter()
+    failed = False
+    try:
+        return execute(sql, params, many, context)
+    except (OperationalError, InterfaceError) as e:
+        failed = e._overload_recorded = True
+        raise
+    finally:
+        record_query(time.perf_counter() - started, failed)
+
+
+def unavailable(request):
+    """503 for a write refused in degraded mode"""
+    if 'text/html' in request.headers.get('Accept', ''):
+        response = HttpResponse(render_to_string('503.html', {'retry_after': HOLD}), status=503)
+    else:
+        response = JsonResponse({'error': 'The site is busy, please try again shortly'}, status=503)
+    response['Retry-After'] = str(HOLD)
+    return response
+
+
+class DegradedModeMiddleware:
+    """Measures database queries and refuses writes while degraded"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_enabled():
+            return self.get_response(request)
+        if (
+            request.method not in SAFE_METHODS
+            and not request.path.startswith(EXEMPT_PATHS)
+            and is_degraded()
+        ):
+            return unavailable(request)
+        with connection.execute_wrapper(_timed):
+            return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        # Failed connection attempts never reach the query wrapper
+        if isinstance(exception, (OperationalError, InterfaceError)) and not getattr(
+            exception, '_overload_recorded', False
+        ):
+            record_query(0, failed=True)
@@ -0,0 +1,120 @@
+"""
+Full-page cache for anonymous visitors.
+
+Pages are keyed on path plus the normalized query string and on the
+generations returned by the view's ``namespaces`` function, so purges are
+targeted (see ``caching.purge_listing_pages``). Detail views tag their
+response with the listing shown, and cache hits still count a view for it.
+
+A miss is rendered by one request at a time (``caching.single_flight``);
+concurrent ones get the last copy from an older generation, or wait for it.
+In degraded mode (``marketplace.overload``) that older copy is served
+without rendering, and cache hits stop counting views.
+"""
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.apps import apps
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from . import overload
+from .caching import STALE_TIMEOUT, get_generation, single_flight
+from .view_counter import record_view
+
+PREFIX = 'page'
+PAGE_CACHE_TIMEOUT = 60 * 5
+
+
+def normalized_query(request):
+    """Query string with empty parameters dropped and keys in a fixed order"""
+    items = []
+    for key in sorted(request.GET):
+        for value in request.GET.getlist(key):
+            value = value.strip()
+            if value:
+                items.append((key, value))
+    return urlencode(items)
+
+
+def page_key(request, namespaces):
+    """``(key, stale key)``; the stale key keeps the last copy of any generation"""
+    generations = ':'.join(str(get_generation(namespace)) for namespace in namespaces)
+    url = hashlib.md5(f'{request.path}?{normalized_query(request)}'.encode()).hexdigest()
+    return f'{PREFIX}:{url}:{generations}', f'{PREFIX}:{url}:stale'
+
+
+def is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # Flash messages are rendered into the page
+    return not len(get_messages(request))
+
+
+def is_cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.cookies
+        and not getattr(response, 'streaming', False)
+        and 'private' not in response.get('Cache-Control', '')
+        # A page rendering {% csrf_token %} needs the visitor's own cookie
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def _cached_response(request, entry, status):
+    content, headers, listing = entry
+    if listing and not overload.is_degraded():
+        label, pk = listing
+        record_view(request, apps.get_model(label)(pk=pk))
+    response = HttpResponse(content, headers=headers)
+    response['X-Page-Cache'] = status
+    return response
+
+
+def anonymous_page_cache(namespaces, timeout=PAGE_CACHE_TIMEOUT):
+    """
+    Cache the decorated view for anonymous visitors.
+
+    ``namespaces(request, *args, **kwargs)`` returns the generation namespaces
+    the page depends on.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+
+            key, stale_key = page_key(request, namespaces(request, *args, **kwargs))
+            degraded = overload.is_degraded()
+            if degraded:
+                # Pages rendered without the optional sections are kept apart,
+                # so none is served once the database has recovered
+                key = f'{key}:degraded'
+            entry = cache.get(key)
+            if entry is not None:
+                return _cached_response(request, entry, 'hit')
+
+            def render():
+                response = view(request, *args, **kwargs)
+                if is_cacheable_response(request, response):
+                    listing = getattr(response, 'viewed_listing', None)
+                    if listing is not None:
+                        listing = (listing._meta.label_lower, str(listing.pk))
+                    entry = (response.content, dict(response.headers), listing)
+                    if degraded:
+                        cache.set(key, entry, overload.DEGRADED_PAGE_TIMEOUT)
+                    else:
+                        cache.set(key, entry, timeout)
+                        cache.set(stale_key, entry, STALE_TIMEOUT)
+                    response['X-Page-Cache'] = 'miss'
+                return response
+
+            value, event = single_flight(key, render, lambda: cache.get(key), lambda: cache.get(stale_key))
+            if event == 'miss':
+                return value
+            return _cached_response(request, value, event)
+        return wrapper
+    return decorator
@@ -0,0 +1,217 @@
+"""
+Keyset (cursor) pagination for the browse pages.
+
+Pages are addressed by an opaque, signed ``after=``/``before=`` token holding
+the sort value and id of the boundary row, so page N costs one index range scan
+no matter how deep it is. ``id`` breaks ties so the order is total.
+"""
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db.models import F, Q
+
+CURSOR_SALT = 'marketplace.pagination.cursor'
+
+# sort option -> (field, descending)
+KEYSET_SORTS = {
+    '-created_at': ('created_at', True),
+    'created_at': ('created_at', False),
+    'price': ('price', False),
+    '-price': ('price', True),
+    'title': ('title', False),
+    '-title': ('title', True),
+    '-rating_avg': ('rating_avg', True),
+}
+
+
+class KeysetPage:
+    """One page of keyset results; iterable like a Paginator page"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class EstimatedPage(Page):
+    """Page of a ``CountedPaginator`` whose count is only a lower bound"""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CountedPaginator(Paginator):
+    """
+    Paginator that reuses a row count computed (or cached) elsewhere. With
+    ``is_estimate`` the count is a lower bound ("1,000+"): pages past it stay
+    reachable and each page finds out whether another follows by fetching one
+    extra row, so nothing ever runs a full COUNT(*).
+    """
+
+    def __init__(self, object_list, per_page, count=None, is_estimate=False, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.is_estimate = is_estimate and count is not None
+        if count is not None:
+            # Pre-fill the cached_property so Paginator skips its own COUNT(*)
+            self.__dict__['count'] = count
+
+    def validate_number(self, number):
+        if not self.is_estimate:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        if not self.is_estimate:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        return EstimatedPage(rows[:self.per_page], number, self, has_next=len(rows) > self.per_page)
+
+    def get_page(self, number):
+        if not self.is_estimate:
+            return super().get_page(number)
+        try:
+            return self.page(number)
+        except PageNotAnInteger:
+            return self.page(1)
+        except EmptyPage:
+            # Past the end: the last page the estimate promises, if it has rows
+            try:
+                return self.page(self.num_pages)
+            except EmptyPage:
+                return self.page(1)
+
+
+def encode_cursor(sort, obj):
+    field, _ = KEYSET_SORTS[sort]
+    value = getattr(obj, field)
+    return signing.dumps(
+        {'s': sort, 'v': None if value is None else str(value), 'id': str(obj.pk)},
+        salt=CURSOR_SALT,
+    )
+
+
+def decode_cursor(model, sort, token):
+    """Return ``(value, pk)`` for a valid token, or None"""
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+        if data['s'] != sort:
+            return None
+        field, _ = KEYSET_SORTS[sort]
+        value = data['v']
+        if value is not None:
+            value = model._meta.get_field(field).to_python(value)
+        return value, model._meta.pk.to_python(data['id'])
+    except (signing.BadSignature, KeyError, TypeError, ValidationError):
+        return None
+
+
+def _ordering(field, descending):
+    # NULLs sort last in both directions so the null tail is a simple range
+    if descending:
+        return [F(field).desc(nulls_last=True), '-id']
+    return [F(field).asc(nulls_last=True), 'id']
+
+
+def _reverse_ordering(field, descending):
+    """Exact reverse of ``_ordering`` (NULL tail first)"""
+    if descending:
+        return [F(field).asc(nulls_first=True), 'id']
+    return [F(field).desc(nulls_first=True), '-id']
+
+
+def _seek(field, descending, value, pk, nullable):
+    """Rows strictly after (value, pk) in the given direction"""
+    pk_op = 'lt' if descending else 'gt'
+    if value is None:
+        return Q(**{f'{field}__isnull': True, f'id__{pk_op}': pk})
+    value_op = 'lt' if descending else 'gt'
+    # The inclusive bound on its own lets the planner range-scan the composite index
+    after = Q(**{f'{field}__{value_op}e': value}) & (
+        Q(**{f'{field}__{value_op}': value}) | Q(**{field: value, f'id__{pk_op}': pk})
+    )
+    if nullable:
+        after |= Q(**{f'{field}__isnull': True})
+    return after
+
+
+def _seek_back(field, descending, value, pk, nullable):
+    """Rows strictly before (value, pk) in the given direction"""
+    pk_op = 'gt' if descending else 'lt'
+    if value is None:
+        return Q(**{f'{field}__isnull': False}) | Q(**{f'{field}__isnull': True, f'id__{pk_op}': pk})
+    value_op = 'gt' if descending else 'lt'
+    return Q(**{f'{field}__{value_op}e': value}) & (
+        Q(**{f'{field}__{value_op}': value}) | Q(**{field: value, f'id__{pk_op}': pk})
+    )
+
+
+def keyset_page(queryset, sort, after=None, before=None, per_page=20):
+    """
+    Return a ``KeysetPage`` for ``queryset`` ordered by ``sort``.
+
+    ``after`` / ``before`` are tokens from a previous page's ``next_cursor`` /
+    ``previous_cursor``; invalid or stale tokens fall back to the first page.
+    """
+    field, descending = KEYSET_SORTS[sort]
+    model = queryset.model
+    nullable = model._meta.get_field(field).null
+
+    if before and (boundary := decode_cursor(model, sort, before)):
+        # Walk backwards with the order flipped, then restore it
+        rows = list(
+            queryset.filter(_seek_back(field, descending, *boundary, nullable))
+            .order_by(*_reverse_ordering(field, descending))
+            [:per_page + 1]
+        )
+        has_more = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(sort, rows[-1]) if rows else None,
+            previous_cursor=encode_cursor(sort, rows[0]) if rows and has_more else None,
+        )
+
+    boundary = decode_cursor(model, sort, after) if after else None
+    page = queryset.order_by(*_ordering(field, descending))
+    if boundary:
+        page = page.filter(_seek(field, descending, *boundary, nullable))
+    rows = list(page[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(sort, rows[-1]) if rows and has_more else None,
+        previous_cursor=encode_cursor(sort, rows[0]) if rows and boundary else None,
+    )
@@ -0,0 +1,49 @@
+"""
+Expiry of paid promotions.
+
+``expire_due`` flips ``Promotion`` rows past ``end_date`` to ``expired`` and
+clears ``is_featured`` on listings past ``featured_until``. Each pass is a
+series of ``UPDATE ... WHERE pk IN (...)`` statements over at most
+``BATCH_SIZE`` rows, so no long lock is held and nothing is loaded as objects.
+"""
+from django.utils import timezone
+
+BATCH_SIZE = 500
+
+
+def update_in_batches(queryset, batch_size=BATCH_SIZE, **values):
+    """Apply ``queryset.update(**values)`` ``batch_size`` rows at a time; returns rows changed"""
+    touched = 0
+    while True:
+        pks = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return touched
+        # Re-apply the filter so rows changed since the SELECT are left alone
+        touched += queryset.filter(pk__in=pks).update(**values)
+        if len(pks) < batch_size:
+            return touched
+
+
+def expire_due(now=None, batch_size=BATCH_SIZE):
+    """
+    Expire everything that is due at ``now``.
+
+    Returns ``{'promotions': n, 'products': n, 'services': n}``.
+    """
+    from .models import Product, Promotion, Service
+
+    now = now or timezone.now()
+    return {
+        'promotions': update_in_batches(
+            Promotion.objects.filter(status='active', end_date__lte=now),
+            batch_size, status='expired',
+        ),
+        'products': update_in_batches(
+            Product.objects.filter(is_featured=True, featured_until__lte=now),
+            batch_size, is_featured=False,
+        ),
+        'services': update_in_batches(
+            Service.objects.filter(is_featured=True, featured_until__lte=now),
+            batch_size, is_featured=False,
+        ),
+    }
@@ -0,0 +1,128 @@
+"""
+Denormalized rating aggregates on Product and Service.
+
+``rating_sum``/``rating_count``/``rating_avg`` only cover approved reviews.
+They are adjusted with single ``UPDATE ... SET x = x + delta`` statements, so
+concurrent reviews never overwrite each other, and in the same transaction as
+the review save or delete that caused them; ``reconcile_ratings`` recomputes
+them from scratch.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from .caching import REVIEW_NAMESPACE, bump_generation, purge_listings
+
+
+def _average(sum_expression, count_expression):
+    return Coalesce(
+        Cast(sum_expression, FloatField()) / NullIf(count_expression, Value(0)),
+        Value(0.0),
+    )
+
+
+def apply_rating_delta(model, pk, sum_delta, count_delta):
+    """Shift one listing's aggregates by the given amounts"""
+    if not pk or (not sum_delta and not count_delta):
+        return
+    model._base_manager.filter(pk=pk).update(
+        rating_sum=F('rating_sum') + sum_delta,
+        rating_count=F('rating_count') + count_delta,
+        rating_avg=_average(F('rating_sum') + sum_delta, F('rating_count') + count_delta),
+    )
+
+
+def _listing_of(review):
+    """``(model, pk)`` of the listing a review counts towards"""
+    from .models import Product, Service
+    if review['product_id']:
+        return Product, review['product_id']
+    if review['service_id']:
+        return Service, review['service_id']
+    return None, None
+
+
+def review_state(review):
+    """The parts of a review that feed the aggregates"""
+    return {
+        'product_id': review.product_id,
+        'service_id': review.service_id,
+        'rating': review.rating,
+        'is_approved': review.is_approved,
+    }
+
+
+def apply_review_change(old, new):
+    """
+    Move a review's contribution from its ``old`` state to its ``new`` state.
+
+    Either side may be None (review created / deleted).
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for state, sign in ((old, -1), (new, 1)):
+        if state and state['is_approved']:
+            model, pk = _listing_of(state)
+            if model:
+                deltas[(model, pk)][0] += sign * state['rating']
+                deltas[(model, pk)][1] += sign
+    with transaction.atomic():
+        for (model, pk), (sum_delta, count_delta) in deltas.items():
+            apply_rating_delta(model, pk, sum_delta, count_delta)
+
+
+def set_reviews_approved(queryset, approved):
+    """Bulk approve/unapprove reviews and adjust the affected listings; returns rows changed"""
+    sign = 1 if approved else -1
+    with transaction.atomic():
+        changing = queryset.filter(is_approved=not approved)
+        totals = list(
+            changing.order_by()
+            .values('product_id', 'service_id')
+            .annotate(total=Sum('rating'), reviews=Count('id'))
+        )
+        count = changing.update(is_approved=approved)
+        changed = defaultdict(list)
+        for row in totals:
+            model, pk = _listing_of(row)
+            if model:
+                apply_rating_delta(model, pk, sign * row['total'], sign * row['reviews'])
+                changed[model].append(pk)
+    if count:
+        # Queryset updates skip the Review signals
+        bump_generation(REVIEW_NAMESPACE)
+        for model, pks in changed.items():
+            purge_listings(model, pks)
+    return count
+
+
+def reconcile(model, review_field):
+    """
+    Recompute aggregates for every listing of ``model`` whose stored values
+    drifted from the approved reviews; returns the number of rows fixed.
+    """
+    from .models import Review
+    approved = Review.objects.filter(**{review_field: OuterRef('pk')}, is_approved=True).order_by()
+    actual_sum = Coalesce(
+        Subquery(approved.values(review_field).annotate(total=Sum('rating')).values('total')),
+        Value(0),
+    )
+    actual_count = Coalesce(
+        Subquery(approved.values(review_field).annotate(reviews=Count('id')).values('reviews')),
+        Value(0),
+    )
+    drifted = model._base_manager.annotate(
+        actual_sum=actual_sum, actual_count=actual_count
+    ).filter(~Q(rating_sum=F('actual_sum')) | ~Q(rating_count=F('actual_count')))
+    pks = list(drifted.values_list('pk', flat=True))
+    if not pks:
+        return 0
+    fixed = model._base_manager.filter(pk__in=pks).update(
+        rating_sum=actual_sum,
+        rating_count=actual_count,
+        rating_avg=_average(actual_sum, actual_count),
+    )
+    bump_generation(REVIEW_NAMESPACE)
+    purge_listings(model, pks)
+    return fixed
@@ -0,0 +1,283 @@
+"""
+Offline "related listings" engine.
+
+Listings are vectorized with TF-IDF over title and description, compared with
+cosine similarity, and the text score is blended with category, campus and
+price proximity. The top ``TOP_K`` neighbours of each listing are stored in
+``RelatedListing`` so detail pages read them back with one indexed query.
+
+NumPy is optional: with it, similarities are computed as batched matrix
+products; without it a pure-Python sparse implementation is used, which is fine
+for small catalogues.
+"""
+import math
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .caching import bump_generation, detail_namespace
+from .search import search_terms
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+TOP_K = 8
+MAX_FEATURES = 4096
+BATCH_SIZE = 256
+
+# Terms found in more than this share of listings carry no signal
+MAX_DOCUMENT_FREQUENCY = 0.5
+
+WEIGHTS = {
+    'text': 0.6,
+    'category': 0.2,
+    'campus': 0.1,
+    'price': 0.1,
+}
+
+
+class Listing:
+    """The columns the engine needs for one listing"""
+
+    def __init__(self, pk, title, description, category_id, campus, price):
+        self.pk = pk
+        # Title terms count double
+        self.terms = search_terms(title) * 2 + search_terms(description)
+        self.category_id = category_id
+        self.campus = (campus or '').strip().lower()
+        self.log_price = math.log1p(float(price)) if price else None
+
+
+def load_listings(model):
+    rows = model.objects.filter(status='active').values_list(
+        'pk', 'title', 'description', 'category_id', 'campus', 'price'
+    )
+    return [Listing(*row) for row in rows]
+
+
+def build_vocabulary(listings):
+    """term -> (column, idf) for the ``MAX_FEATURES`` most common useful terms"""
+    total = len(listings)
+    frequency = Counter()
+    for listing in listings:
+        frequency.update(set(listing.terms))
+    limit = max(2, MAX_DOCUMENT_FREQUENCY * total)
+    common = [
+        (term, df) for term, df in frequency.most_common()
+        if total < 10 or df <= limit
+    ][:MAX_FEATURES]
+    return {
+        term: (column, math.log((1 + total) / (1 + df)) + 1)
+        for column, (term, df) in enumerate(common)
+    }
+
+
+def tfidf(terms, vocabulary):
+    """Sparse, L2-normalized, sublinear TF-IDF vector as ``{column: weight}``"""
+    vector = {}
+    for term, count in Counter(terms).items():
+        if term in vocabulary:
+            column, idf = vocabulary[term]
+            vector[column] = (1 + math.log(count)) * idf
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    if norm:
+        vector = {column: weight / norm for column, weight in vector.items()}
+    return vector
+
+
+def price_proximity(a, b):
+    if a is None or b is None:
+        return 0.0
+    return 1.0 / (1.0 + abs(a - b))
+
+
+def _top_k(scores, k):
+    """Indices of the ``k`` best positive scores, best first"""
+    ranked = sorted(
+        (index for index, score in enumerate(scores) if score > 0),
+        key=lambda index: scores[index],
+        reverse=True,
+    )
+    return ranked[:k]
+
+
+def _neighbours_python(listings, sources, candidates, vocabulary, k):
+    vectors = [tfidf(listing.terms, vocabulary) for listing in listings]
+    results = {}
+    for i in sources:
+        source = listings[i]
+        scores = []
+        for j in candidates:
+            candidate = listings[j]
+            if i == j:
+                scores.append(float('-inf'))
+                continue
+            text = sum(weight * vectors[j].get(column, 0.0) for column, weight in vectors[i].items())
+            score = (
+                WEIGHTS['text'] * text
+                + WEIGHTS['category'] * (source.category_id is not None and source.category_id == candidate.category_id)
+                + WEIGHTS['campus'] * (bool(source.campus) and source.campus == candidate.campus)
+                + WEIGHTS['price'] * price_proximity(source.log_price, candidate.log_price)
+            )
+            scores.append(score)
+        results[i] = [(candidates[c], scores[c]) for c in _top_k(scores, k)]
+    return results
+
+
+def _neighbours_numpy(listings, sources, candidates, vocabulary, k):
+    matrix = np.zeros((len(listings), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, listing in enumerate(listings):
+        for column, weight in tfidf(listing.terms, vocabulary).items():
+            matrix[row, column] = weight
+
+    categories = np.array([l.category_id if l.category_id is not None else -1 for l in listings])
+    campus_ids = {}
+    campuses = np.array([
+        campus_ids.setdefault(l.campus, len(campus_ids)) if l.campus else -1 for l in listings
+    ])
+    prices = np.array([l.log_price if l.log_price is not None else np.nan for l in listings])
+
+    results = {}
+    sources = np.asarray(sources)
+    candidates = np.asarray(candidates)
+    for start in range(0, len(sources), BATCH_SIZE):
+        batch = sources[start:start + BATCH_SIZE]
+        scores = WEIGHTS['text'] * (matrix[batch] @ matrix[candidates].T)
+        scores += WEIGHTS['category'] * (
+            (categories[batch, None] == categories[None, candidates]) & (categories[batch, None] >= 0)
+        )
+        scores += WEIGHTS['campus'] * (
+            (campuses[batch, None] == campuses[None, candidates]) & (campuses[batch, None] >= 0)
+        )
+        proximity = 1.0 / (1.0 + np.abs(prices[batch, None] - prices[None, candidates]))
+        scores += WEIGHTS['price'] * np.nan_to_num(proximity, nan=0.0)
+        scores[batch[:, None] == candidates[None, :]] = -np.inf
+
+        take = min(k, scores.shape[1])
+        if take <= 0:
+            continue
+        top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+        for row, source in enumerate(batch):
+            best = sorted(top[row], key=lambda c: scores[row, c], reverse=True)
+            results[int(source)] = [
+                (int(candidates[c]), float(scores[row, c])) for c in best if scores[row, c] > 0
+            ]
+    return results
+
+
+def compute_neighbours(listings, sources, k=TOP_K, candidates=None):
+    """
+    ``{source index: [(neighbour index, score), ...]}`` best first, choosing
+    among ``candidates`` (indices, every listing by default)
+    """
+    if candidates is None:
+        candidates = range(len(listings))
+    candidates = list(candidates)
+    if not listings or not sources or not candidates:
+        return {}
+    vocabulary = build_vocabulary(listings)
+    if np is not None:
+        return _neighbours_numpy(listings, sources, candidates, vocabulary, k)
+    return _neighbours_python(listings, sources, candidates, vocabulary, k)
+
+
+def stored_neighbours(model, pks):
+    """``{pk: [(neighbour pk, score), ...]}`` best first, as last computed"""
+    from .models import RelatedListing
+    field = model._meta.model_name
+    stored = defaultdict(list)
+    rows = RelatedListing.objects.filter(**{f'{field}__in': pks}).order_by(field, 'rank')
+    for source, target, score in rows.values_list(f'{field}_id', f'related_{field}_id', 'score'):
+        stored[source].append((target, score))
+    return stored
+
+
+def purge_neighbour_pages(model, pks):
+    """Invalidate the cached detail pages of listings whose related listings changed"""
+    for slug in model._base_manager.filter(pk__in=pks).values_list('slug', flat=True):
+        bump_generation(detail_namespace(model, slug))
+
+
+def refresh_related(model, full=False, k=TOP_K):
+    """
+    Recompute neighbours for listings of ``model`` that changed since they were
+    last scored (every active listing when ``full``); returns how many were scored.
+
+    The other listings are only rescored against the changed ones and merged
+    with their stored neighbours, so a new listing shows up next to them
+    without a full run; neighbours that are gone or inactive drop out.
+    Listings whose neighbours changed get their detail pages purged.
+    """
+    from .models import RelatedListing
+
+    field = model._meta.model_name
+    listings = load_listings(model)
+    stale = model.objects.filter(status='active')
+    if not full:
+        stale = stale.filter(Q(related_computed_at__isnull=True) | Q(updated_at__gt=F('related_computed_at')))
+    stale_pks = set(stale.values_list('pk', flat=True))
+    sources = [index for index, listing in enumerate(listings) if listing.pk in stale_pks]
+    others = [index for index, listing in enumerate(listings) if listing.pk not in stale_pks]
+
+    neighbours = {source: [] for source in sources}
+    neighbours.update(compute_neighbours(listings, sources, k))
+    previous = stored_neighbours(model, [listing.pk for listing in listings])
+
+    def changed(index, found):
+        return [listings[target].pk for target, _ in found] != [
+            target for target, _ in previous.get(listings[index].pk, ())
+        ]
+
+    if others:
+        index_of = {listing.pk: index for index, listing in enumerate(listings)}
+        rescored = set(sources)
+        closer = compute_neighbours(listings, others, k, candidates=sources)
+        for index in others:
+            kept = [
+                (index_of[target], score) for target, score in previous.get(listings[index].pk, ())
+                if target in index_of and index_of[target] not in rescored
+            ]
+            merged = sorted(kept + closer.get(index, []), key=lambda item: item[1], reverse=True)[:k]
+            if changed(index, merged):
+                neighbours[index] = merged
+
+    updated = [listings[index].pk for index, found in neighbours.items() if changed(index, found)]
+    now = timezone.now()
+    rows = [
+        RelatedListing(**{
+            field: model(pk=listings[source].pk),
+            f'related_{field}': model(pk=listings[target].pk),
+            'score': score,
+            'rank': rank,
+        })
+        for source, found in neighbours.items()
+        for rank, (target, score) in enumerate(found, 1)
+    ]
+    scored = [listings[source].pk for source in sources]
+    with transaction.atomic():
+        RelatedListing.objects.filter(**{f'{field}__in': [listings[source].pk for source in neighbours]}).delete()
+        RelatedListing.objects.bulk_create(rows, batch_size=1000)
+        model._base_manager.filter(pk__in=scored).update(related_computed_at=now)
+    purge_neighbour_pages(model, updated)
+    return len(scored)
+
+
+def related_listings(listing, limit=4):
+    """
+    Precomputed neighbours of ``listing`` for its detail page, falling back to
+    other active listings in the same category until the job has scored it.
+    """
+    model = type(listing)
+    field = model._meta.model_name
+    active = model.objects.for_cards().filter(status='active')
+    neighbours = list(
+        active.filter(**{f'neighbour_of__{field}': listing})
+        .order_by('neighbour_of__rank')[:limit]
+    )
+    if neighbours:
+        return neighbours
+    return list(active.filter(category=listing.category_id).exclude(pk=listing.pk)[:limit])
@@ -0,0 +1,315 @@
+"""
+Full-text search for product and service listings.
+
+PostgreSQL keeps a weighted ``search_vector`` column per listing (GIN indexed),
+SQLite keeps an FTS5 shadow table named ``<db_table>_fts``. Both are refreshed
+from signals and from ``ListingQuerySet.update`` so bulk edits stay searchable.
+
+When the exact match finds only a handful of listings the search falls back to
+typo-tolerant trigram matching on title and campus: ``pg_trgm`` word similarity
+on PostgreSQL, an in-process n-gram index elsewhere.
+"""
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+)
+from django.db import connections
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .caching import get_generation, listing_namespace
+
+# Text columns that feed the search index
+SEARCH_FIELDS = frozenset({'title', 'description', 'location', 'campus'})
+
+SEARCH_CONFIG = 'english'
+
+INDEX_BATCH_SIZE = 500
+
+# Fuzzy matching kicks in when the exact search finds fewer listings than this
+FUZZY_FALLBACK_THRESHOLD = 5
+
+# Minimum trigram word similarity for a fuzzy match (pg_trgm default is 0.6)
+FUZZY_THRESHOLD = 0.4
+
+FUZZY_MATCH_LIMIT = 200
+# Close matches checked against the caller's filters per query
+FUZZY_FILTER_BATCH = 500
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(query):
+    """Split a raw search box value into safe lowercase terms"""
+    return [term.lower() for term in _TERM_RE.findall(query or '')][:10]
+
+
+def search_vector():
+    """Weighted tsvector expression: title > campus/location > description"""
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('campus', 'location', weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def fts_table(model):
+    return f'{model._meta.db_table}_fts'
+
+
+def _chunks(items, size=INDEX_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def index_listings(model, pks, using='default'):
+    """Refresh the search index for the given listing primary keys"""
+    pks = list(pks)
+    if not pks:
+        return
+    vendor = connections[using].vendor
+
+    if vendor == 'postgresql':
+        for chunk in _chunks(pks):
+            model._base_manager.using(using).filter(pk__in=chunk).update(search_vector=search_vector())
+    elif vendor == 'sqlite':
+        connection = connections[using]
+        table = fts_table(model)
+        source = model._meta.db_table
+        pk_field = model._meta.pk
+        with connection.cursor() as cursor:
+            for chunk in _chunks(pks):
+                ids = [pk_field.get_db_prep_value(pk, connection) for pk in chunk]
+                placeholders = ', '.join(['%s'] * len(ids))
+                cursor.execute(f'DELETE FROM {table} WHERE listing_id IN ({placeholders})', ids)
+                cursor.execute(
+                    f'INSERT INTO {table} (listing_id, title, description, location, campus) '
+                    f'SELECT id, title, description, location, campus FROM {source} '
+                    f'WHERE id IN ({placeholders})',
+                    ids,
+                )
+
+
+def unindex_listings(model, pks, using='default'):
+    """Drop deleted listings from the SQLite shadow table (PostgreSQL needs nothing)"""
+    pks = list(pks)
+    if not pks or connections[using].vendor != 'sqlite':
+        return
+    connection = connections[using]
+    pk_field = model._meta.pk
+    with connection.cursor() as cursor:
+        for chunk in _chunks(pks):
+            ids = [pk_field.get_db_prep_value(pk, connection) for pk in chunk]
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(f'DELETE FROM {fts_table(model)} WHERE listing_id IN ({placeholders})', ids)
+
+
+def rebuild_index(model, using='default'):
+    """Re-index every listing of ``model``; returns the number of rows indexed"""
+    vendor = connections[using].vendor
+    if vendor == 'postgresql':
+        return model._base_manager.using(using).update(search_vector=search_vector())
+    if vendor == 'sqlite':
+        table = fts_table(model)
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table}')
+            cursor.execute(
+                f'INSERT INTO {table} (listing_id, title, description, location, campus) '
+                f'SELECT id, title, description, location, campus FROM {model._meta.db_table}'
+            )
+            return cursor.rowcount
+    return 0
+
+
+def _sqlite_full_text(queryset, terms):
+    """
+    Join ``queryset`` to its FTS5 table, so the match is ranked (bm25) together
+    with the caller's filters instead of cutting off the best rows overall
+    """
+    model = queryset.model
+    table = fts_table(model)
+    match = ' '.join(f'"{term}"*' for term in terms)
+    return queryset.extra(
+        # Column weights follow the table layout: listing_id, title, description, location, campus
+        select={'search_rank': f'-bm25({table}, 0.0, 10.0, 1.0, 4.0, 4.0)'},
+        tables=[table],
+        where=[f'{table}.listing_id = {model._meta.db_table}.{model._meta.pk.column}', f'{table} MATCH %s'],
+        params=[match],
+    )
+
+
+def _no_matches(queryset):
+    return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+
+
+def _full_text(queryset, terms):
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'postgresql':
+        ts_query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms),
+            search_type='raw',
+            config=SEARCH_CONFIG,
+        )
+        return queryset.filter(search_vector=ts_query).annotate(
+            search_rank=SearchRank(F('search_vector'), ts_query)
+        )
+
+    if vendor == 'sqlite':
+        return _sqlite_full_text(queryset, terms)
+
+    # Other backends: plain substring matching
+    condition = Q()
+    for term in terms:
+        condition &= (
+            Q(title__icontains=term) |
+            Q(description__icontains=term) |
+            Q(location__icontains=term) |
+            Q(campus__icontains=term)
+        )
+    return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def trigrams(word):
+    """pg_trgm style trigrams: lowercase, padded with two leading and one trailing space"""
+    padded = f'  {word.lower()} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NgramIndex:
+    """In-memory trigram index over listing titles and campus names"""
+
+    def __init__(self, rows):
+        self.postings = defaultdict(set)
+        self.words = {}
+        for pk, title, campus in rows:
+            word_grams = [trigrams(word) for word in search_terms(f'{title} {campus}')]
+            self.words[pk] = word_grams
+            for grams in word_grams:
+                for gram in grams:
+                    self.postings[gram].add(pk)
+
+    def search(self, terms, threshold=FUZZY_THRESHOLD, limit=FUZZY_MATCH_LIMIT):
+        """
+        Return ``[(pk, score)]`` best first, scoring each term against its
+        closest word; ``limit=None`` returns every match.
+        """
+        term_grams = [trigrams(term) for term in terms]
+        candidates = set()
+        for grams in term_grams:
+            for gram in grams:
+                candidates |= self.postings.get(gram, set())
+
+        results = []
+        for pk in candidates:
+            word_grams = self.words[pk]
+            score = sum(
+                max((len(grams & word) / len(grams | word) for word in word_grams), default=0.0)
+                for grams in term_grams
+            ) / len(term_grams)
+            if score >= threshold:
+                results.append((pk, score))
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results[:limit]
+
+
+_ngram_indexes = {}
+_ngram_lock = threading.Lock()
+
+
+def ngram_index(model, using='default'):
+    """Per-process n-gram index, rebuilt whenever the listing generation changes"""
+    generation = get_generation(listing_namespace(model))
+    key = (model._meta.label, using)
+    cached = _ngram_indexes.get(key)
+    if cached and cached[0] == generation:
+        return cached[1]
+    with _ngram_lock:
+        cached = _ngram_indexes.get(key)
+        if cached and cached[0] == generation:
+            return cached[1]
+        rows = model._base_manager.using(using).values_list('pk', 'title', 'campus').iterator()
+        index = NgramIndex(rows)
+        _ngram_indexes[key] = (generation, index)
+        return index
+
+
+def _fuzzy(queryset, terms, query):
+    if connections[queryset.db].vendor == 'postgresql':
+        # Word similarity threshold comes from pg_trgm.word_similarity_threshold
+        return queryset.filter(
+            Q(title__trigram_word_similar=query) | Q(campus__trigram_word_similar=query)
+        ).annotate(
+            search_rank=Greatest(
+                TrigramWordSimilarity(query, 'title'),
+                TrigramWordSimilarity(query, 'campus'),
+            )
+        )
+
+    # The index covers every listing: walk its matches best first and keep
+    # the ones the caller's filters let through, a batch per query
+    matches = ngram_index(queryset.model, queryset.db).search(terms, limit=None)
+    ranked = []
+    for start in range(0, len(matches), FUZZY_FILTER_BATCH):
+        batch = matches[start:start + FUZZY_FILTER_BATCH]
+        allowed = set(queryset.filter(pk__in=[pk for pk, _ in batch]).values_list('pk', flat=True))
+        ranked.extend(match for match in batch if match[0] in allowed)
+        if len(ranked) >= FUZZY_MATCH_LIMIT:
+            break
+    ranked = ranked[:FUZZY_MATCH_LIMIT]
+    if not ranked:
+        return _no_matches(queryset)
+    return queryset.filter(pk__in=[pk for pk, _ in ranked]).annotate(
+        search_rank=Case(
+            *[When(pk=pk, then=Value(score)) for pk, score in ranked],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    )
+
+
+def configure_trigram_threshold(sender, connection, **kwargs):
+    """connection_created hook: apply FUZZY_THRESHOLD to new PostgreSQL sessions"""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET pg_trgm.word_similarity_threshold = %s', [FUZZY_THRESHOLD])
+
+
+def search_listings(queryset, query, fuzzy=True):
+    """
+    Filter ``queryset`` down to listings matching ``query``.
+
+    Returns ``(queryset, is_fuzzy)``. The queryset is annotated with
+    ``search_rank`` (higher is more relevant) so callers can order by
+    relevance; ``is_fuzzy`` is True when the typo-tolerant fallback was used.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return _no_matches(queryset), False
+
+    exact = _full_text(queryset, terms)
+    if not fuzzy:
+        return exact, False
+
+    exact_ids = list(exact.values_list('pk', flat=True)[:FUZZY_FALLBACK_THRESHOLD])
+    if len(exact_ids) >= FUZZY_FALLBACK_THRESHOLD:
+        return exact, False
+
+    close = _fuzzy(queryset, terms, query)
+    if not exact_ids:
+        return close, True
+
+    # Keep the exact hits and rank them above the close matches
+    scores = dict(close.order_by('-search_rank').values_list('pk', 'search_rank')[:FUZZY_MATCH_LIMIT])
+    results = queryset.filter(pk__in=set(exact_ids) | set(scores)).annotate(
+        search_rank=Case(
+            *[When(pk=pk, then=Value(1.0 + scores.get(pk, 0.0))) for pk in exact_ids],
+            *[When(pk=pk, then=Value(score)) for pk, score in scores.items() if pk not in exact_ids],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    )
+    return results, True
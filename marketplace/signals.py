@@ -0,0 +1,159 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Category, ChangeRequest, Product, RelatedListing, Service, Review, LISTING_METRIC_FIELDS
+from .caching import (
+    CATEGORY_NAMESPACE, REVIEW_NAMESPACE, bump_generation, listing_namespace,
+    purge_listing_pages, purge_listings,
+)
+from . import media_gc, ratings, related, search
+
+connection_created.connect(search.configure_trigram_threshold)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Service)
+def sync_search_index(sender, instance, update_fields=None, using='default', **kwargs):
+    """Keep the listing's search document in step with its text fields"""
+    if update_fields is not None and not search.SEARCH_FIELDS.intersection(update_fields):
+        return
+    search.index_listings(sender, [instance.pk], using=using)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Service)
+def remove_from_search_index(sender, instance, using='default', **kwargs):
+    search.unindex_listings(sender, [instance.pk], using=using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Service)
+def invalidate_listing_caches(sender, instance, update_fields=None, **kwargs):
+    """Bump the listing generation unless only engagement counters changed"""
+    if update_fields is not None and LISTING_METRIC_FIELDS.issuperset(update_fields):
+        return
+    bump_generation(listing_namespace(sender))
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=Service)
+def remember_listing_pages(sender, instance, raw=False, **kwargs):
+    """Stash the slug and category the listing's cached pages live under"""
+    if raw or instance._state.adding:
+        instance._previous_pages = None
+        return
+    instance._previous_pages = sender._base_manager.filter(pk=instance.pk).values_list(
+        'slug', 'category_id'
+    ).first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Service)
+def purge_listing_page_cache(sender, instance, update_fields=None, **kwargs):
+    """Purge the detail page and category browse pages showing this listing"""
+    if update_fields is not None and LISTING_METRIC_FIELDS.issuperset(update_fields):
+        return
+    slugs, category_ids = [instance.slug], [instance.category_id]
+    previous = getattr(instance, '_previous_pages', None)
+    if previous:
+        slugs.append(previous[0])
+        category_ids.append(previous[1])
+    purge_listing_pages(sender, slugs, category_ids)
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=Service)
+def remember_listing_media(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Stash the image and video URLs the save may replace"""
+    instance._previous_media = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not set(media_gc.MEDIA_FIELDS).intersection(update_fields):
+        return
+    instance._previous_media = sender._base_manager.filter(pk=instance.pk).values_list(
+        *media_gc.MEDIA_FIELDS
+    ).first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Service)
+def release_replaced_media(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_media', None)
+    if previous:
+        media_gc.release(set(previous) - media_gc.listing_media(instance))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Service)
+def release_listing_media(sender, instance, **kwargs):
+    media_gc.release(media_gc.listing_media(instance))
+
+
+@receiver(pre_delete, sender=Product)
+@receiver(pre_delete, sender=Service)
+def purge_pages_showing_listing(sender, instance, **kwargs):
+    """Detail pages that show the listing as related; the rows go with it"""
+    field = sender._meta.model_name
+    sources = RelatedListing.objects.filter(**{f'related_{field}': instance}).values_list(f'{field}_id', flat=True)
+    related.purge_neighbour_pages(sender, list(sources))
+
+
+@receiver(post_save, sender=ChangeRequest)
+@receiver(post_delete, sender=ChangeRequest)
+def release_change_request_images(sender, instance, raw=False, **kwargs):
+    """Images of a rejected or withdrawn request are not used by the listing"""
+    if raw or instance.status == 'approved' or not instance.new_images:
+        return
+    if kwargs.get('signal') is post_delete or instance.status == 'rejected':
+        media_gc.release(instance.new_images)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_caches(sender, **kwargs):
+    bump_generation(CATEGORY_NAMESPACE)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_caches(sender, instance, raw=False, **kwargs):
+    """Ratings shown on listing cards and detail pages come from reviews"""
+    if raw:
+        return
+    bump_generation(REVIEW_NAMESPACE)
+    if instance.product_id:
+        purge_listings(Product, [instance.product_id])
+    if instance.service_id:
+        purge_listings(Service, [instance.service_id])
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_state(sender, instance, raw=False, **kwargs):
+    """Stash what the review contributed before this save"""
+    if raw or instance._state.adding:
+        instance._previous_rating_state = None
+        return
+    # Review.save runs in a transaction; the lock keeps concurrent edits from reading the same state
+    previous = sender._base_manager.select_for_update().filter(pk=instance.pk).values(
+        'product_id', 'service_id', 'rating', 'is_approved'
+    ).first()
+    instance._previous_rating_state = previous
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    ratings.apply_review_change(
+        getattr(instance, '_previous_rating_state', None),
+        ratings.review_state(instance),
+    )
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    ratings.apply_review_change(ratings.review_state(instance), None)
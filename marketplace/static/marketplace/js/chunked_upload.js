@@ -0,0 +1,148 @@
+// Resumable chunked video uploads for listing forms.
+//
+// A form with data-chunked-upload-url sends its video to Django in chunks,
+// which are spooled to disk. After a dropped connection, or a reload with the
+// same file selected again, the upload continues from the last byte the server
+// has. The finished upload id is posted in the hidden video_upload field
+// instead of the file.
+(function () {
+    'use strict';
+
+    const RETRIES = 6;
+    const STORAGE_PREFIX = 'chunked-upload:';
+
+    function csrfToken(form) {
+        const input = form.querySelector('input[name="csrfmiddlewaretoken"]');
+        return input ? input.value : '';
+    }
+
+    function fileKey(file) {
+        return `${STORAGE_PREFIX}${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+    async function status(url) {
+        const response = await fetch(url, {credentials: 'same-origin'});
+        return response.ok ? response.json() : null;
+    }
+
+    async function begin(form, file) {
+        // Resume an upload of the same file from an earlier attempt
+        const saved = JSON.parse(localStorage.getItem(fileKey(file)) || 'null');
+        if (saved) {
+            const state = await status(saved.url).catch(() => null);
+            if (state) {
+                return {...saved, offset: state.offset};
+            }
+            localStorage.removeItem(fileKey(file));
+        }
+        const body = new FormData();
+        body.append('name', file.name);
+        body.append('size', file.size);
+        const response = await fetch(form.dataset.chunkedUploadUrl, {
+            method: 'POST',
+            body: body,
+            headers: {'X-CSRFToken': csrfToken(form)},
+            credentials: 'same-origin',
+        });
+        const upload = await response.json();
+        if (!response.ok) {
+            throw new Error(upload.error || 'Could not start upload');
+        }
+        localStorage.setItem(fileKey(file), JSON.stringify(upload));
+        return upload;
+    }
+
+    async function sendChunks(form, file, upload, onProgress) {
+        let offset = upload.offset;
+        let failures = 0;
+        onProgress(offset);
+        while (offset < file.size) {
+            try {
+                const response = await fetch(upload.url, {
+                    method: 'POST',
+                    body: file.slice(offset, offset + upload.chunk_size),
+                    headers: {
+                        'X-CSRFToken': csrfToken(form),
+                        'Content-Type': 'application/octet-stream',
+                        'Upload-Offset': String(offset),
+                    },
+                    credentials: 'same-origin',
+                });
+                const state = await response.json();
+                // 409 means the server has a different offset; continue from there
+                if (!response.ok && response.status !== 409) {
+                    throw new Error(state.error || 'Upload failed');
+                }
+                offset = state.offset;
+                failures = 0;
+                onProgress(offset);
+            } catch (error) {
+                if (++failures > RETRIES) {
+                    throw error;
+                }
+                await sleep(1000 * 2 ** failures);
+                const state = await status(upload.url).catch(() => null);
+                if (state) {
+                    offset = state.offset;
+                }
+            }
+        }
+    }
+
+    function statusLine(input) {
+        let line = input.parentNode.querySelector('.chunked-upload-status');
+        if (!line) {
+            line = document.createElement('small');
+            line.className = 'chunked-upload-status form-text d-block';
+            input.insertAdjacentElement('afterend', line);
+        }
+        return line;
+    }
+
+    function init(form) {
+        const input = form.querySelector('input[type="file"][name="video"]');
+        const hidden = form.querySelector('input[name="video_upload"]');
+        const submit = form.querySelector('[type="submit"]');
+        if (!input || !hidden) {
+            return;
+        }
+
+        input.addEventListener('change', async () => {
+            hidden.value = '';
+            delete input.dataset.chunkedUploaded;
+            const file = input.files[0];
+            if (!file) {
+                return;
+            }
+            const line = statusLine(input);
+            if (submit) submit.disabled = true;
+            try {
+                const upload = await begin(form, file);
+                await sendChunks(form, file, upload, (offset) => {
+                    line.textContent = `Uploading video… ${Math.round(100 * offset / file.size)}%`;
+                });
+                hidden.value = upload.upload_id;
+                input.dataset.chunkedUploaded = file.name;
+                localStorage.removeItem(fileKey(file));
+                line.textContent = `Uploaded ${file.name}`;
+            } catch (error) {
+                line.textContent = 'Video upload failed; the file will be sent with the form.';
+            } finally {
+                if (submit) submit.disabled = false;
+            }
+        });
+
+        form.addEventListener('submit', (event) => {
+            if (!event.defaultPrevented && input.dataset.chunkedUploaded) {
+                // The server already has the video; only post its upload id
+                input.disabled = true;
+            }
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.querySelectorAll('form[data-chunked-upload-url]').forEach(init);
+    });
+})();
@@ -0,0 +1,130 @@
+// Direct-to-Cloudinary uploads for listing forms.
+//
+// A form with data-direct-upload-url uploads each selected image/video straight
+// to Cloudinary using parameters signed by the server, then posts back only the
+// upload response (in the hidden <name>_direct field). If anything fails the
+// file stays in its input and is uploaded through Django as before.
+(function () {
+    'use strict';
+
+    const FIELDS = {image1: 'image', image2: 'image', image3: 'image', video: 'video'};
+
+    function csrfToken(form) {
+        const input = form.querySelector('input[name="csrfmiddlewaretoken"]');
+        return input ? input.value : '';
+    }
+
+    async function uploadFile(form, file, resourceType, onProgress) {
+        const body = new FormData();
+        body.append('resource_type', resourceType);
+        const signed = await fetch(form.dataset.directUploadUrl, {
+            method: 'POST',
+            body: body,
+            headers: {'X-CSRFToken': csrfToken(form)},
+            credentials: 'same-origin',
+        });
+        if (!signed.ok) {
+            throw new Error('Could not sign upload');
+        }
+        const {upload_url: uploadUrl, params} = await signed.json();
+
+        const data = new FormData();
+        Object.entries(params).forEach(([key, value]) => data.append(key, value));
+        data.append('file', file);
+
+        // XMLHttpRequest rather than fetch for upload progress
+        return new Promise((resolve, reject) => {
+            const xhr = new XMLHttpRequest();
+            xhr.open('POST', uploadUrl);
+            xhr.upload.addEventListener('progress', (e) => {
+                if (e.lengthComputable) {
+                    onProgress(Math.round(100 * e.loaded / e.total));
+                }
+            });
+            xhr.onload = () => {
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve(JSON.parse(xhr.responseText));
+                } else {
+                    reject(new Error('Upload failed'));
+                }
+            };
+            xhr.onerror = () => reject(new Error('Upload failed'));
+            xhr.send(data);
+        });
+    }
+
+    function statusLine(input) {
+        let line = input.parentNode.querySelector('.direct-upload-status');
+        if (!line) {
+            line = document.createElement('small');
+            line.className = 'direct-upload-status form-text d-block';
+            input.insertAdjacentElement('afterend', line);
+        }
+        return line;
+    }
+
+    function init(form) {
+        const pending = new Set();
+        const submit = form.querySelector('[type="submit"]');
+
+        Object.entries(FIELDS).forEach(([name, resourceType]) => {
+            const input = form.querySelector(`input[type="file"][name="${name}"]`);
+            const hidden = form.querySelector(`input[name="${name}_direct"]`);
+            if (!input || !hidden) {
+                return;
+            }
+            if (name === 'video' && form.dataset.chunkedUploadUrl) {
+                // Left to chunked_upload.js, which can resume
+                return;
+            }
+            input.addEventListener('change', async () => {
+                hidden.value = '';
+                delete input.dataset.directUploaded;
+                const file = input.files[0];
+                if (!file) {
+                    return;
+                }
+                const line = statusLine(input);
+                pending.add(name);
+                if (submit) submit.disabled = true;
+                try {
+                    const result = await uploadFile(form, file, resourceType, (percent) => {
+                        line.textContent = `Uploading… ${percent}%`;
+                    });
+                    hidden.value = JSON.stringify({
+                        public_id: result.public_id,
+                        version: result.version,
+                        signature: result.signature,
+                        format: result.format,
+                    });
+                    // The file is on Cloudinary now; don't send it through Django as well
+                    input.required = false;
+                    input.dataset.directUploaded = file.name;
+                    line.textContent = `Uploaded ${file.name}`;
+                } catch (error) {
+                    line.textContent = 'Direct upload failed; the file will be sent with the form.';
+                } finally {
+                    pending.delete(name);
+                    if (submit && !pending.size) submit.disabled = false;
+                }
+            });
+        });
+
+        form.addEventListener('submit', (event) => {
+            if (event.defaultPrevented) {
+                return;
+            }
+            // Drop files that were already uploaded so only JSON is posted
+            Object.keys(FIELDS).forEach((name) => {
+                const input = form.querySelector(`input[type="file"][name="${name}"]`);
+                if (input && input.dataset.directUploaded) {
+                    input.disabled = true;
+                }
+            });
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.querySelectorAll('form[data-direct-upload-url]').forEach(init);
+    });
+})();
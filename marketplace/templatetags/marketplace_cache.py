@@ -0,0 +1,49 @@
+from django import template
+
+from marketplace.caching import FRAGMENT_TIMEOUT, versioned_fragment
+
+register = template.Library()
+
+
+class VersionedCacheNode(template.Node):
+    def __init__(self, nodelist, name, namespaces, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.namespaces = namespaces
+        self.vary_on = vary_on
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        namespaces = self.namespaces.resolve(context).split()
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        return versioned_fragment(
+            name, namespaces, lambda: self.nodelist.render(context),
+            vary_on=vary_on, timeout=FRAGMENT_TIMEOUT,
+        )
+
+
+@register.tag('versioned_cache')
+def do_versioned_cache(parser, token):
+    """
+    Cache the enclosed fragment until one of the named generations is bumped::
+
+        {% versioned_cache 'home:categories' 'categories' [vary_on ...] %}
+            ...
+        {% endversioned_cache %}
+
+    The second argument is a space separated list of generation namespaces
+    (see ``marketplace.caching``).
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' takes a fragment name and a list of namespaces"
+        )
+    nodelist = parser.parse(('endversioned_cache',))
+    parser.delete_first_token()
+    return VersionedCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]],
+    )
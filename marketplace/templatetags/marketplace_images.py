@@ -0,0 +1,116 @@
+from urllib.parse import urlsplit
+
+from django import template
+from django.utils.html import format_html
+
+register = template.Library()
+
+# Let Cloudinary pick the format (AVIF/WebP/JPEG) and quality per browser
+BASE_TRANSFORMATION = 'f_auto,q_auto'
+
+# ``widths``/``sizes`` presets are for fluid images and emit width descriptors;
+# ``dprs`` presets are for fixed-size images and emit density descriptors.
+PRESETS = {
+    # col-6 col-md-4 col-lg-3 cards in a 1320px container
+    'card': {
+        'transformation': 'c_limit',
+        'widths': (200, 300, 400, 600),
+        'default': 300,
+        'sizes': '(min-width: 1400px) 306px, (min-width: 992px) 25vw, (min-width: 768px) 33vw, 50vw',
+    },
+    # Main image on the detail pages (col-md-6)
+    'detail': {
+        'transformation': 'c_limit',
+        'widths': (480, 640, 800, 1200),
+        'default': 800,
+        'sizes': '(min-width: 1400px) 636px, (min-width: 768px) 50vw, 100vw',
+    },
+    # Gallery thumbnails, at most 200x120 CSS pixels
+    'thumb': {
+        'transformation': 'c_fill,g_auto,w_200,h_120',
+        'dprs': (1, 2),
+    },
+}
+
+# Cards rendered before this position in a list are likely above the fold
+EAGER_IMAGES = 4
+
+
+def is_cloudinary(url):
+    parts = urlsplit(url or '')
+    return parts.netloc.endswith('res.cloudinary.com') and '/upload/' in parts.path
+
+
+def cloudinary_variant(url, transformation):
+    """
+    Insert a transformation into a Cloudinary delivery URL, after ``/upload/``.
+    Other URLs are returned unchanged.
+    """
+    if not is_cloudinary(url):
+        return url or ''
+    head, tail = url.split('/upload/', 1)
+    return f'{head}/upload/{BASE_TRANSFORMATION},{transformation}/{tail}'
+
+
+def _preset(name):
+    try:
+        return PRESETS[name]
+    except KeyError:
+        raise template.TemplateSyntaxError(f'Unknown image preset {name!r}')
+
+
+def image_src(url, preset='card'):
+    preset = _preset(preset)
+    if 'dprs' in preset:
+        return cloudinary_variant(url, preset['transformation'])
+    return cloudinary_variant(url, f"{preset['transformation']},w_{preset['default']}")
+
+
+def image_srcset(url, preset='card'):
+    preset = _preset(preset)
+    if not is_cloudinary(url):
+        return ''
+    if 'dprs' in preset:
+        variants = [(f'dpr_{dpr}.0', f'{dpr}x') for dpr in preset['dprs']]
+    else:
+        variants = [(f'w_{width}', f'{width}w') for width in preset['widths']]
+    return ', '.join(
+        f"{cloudinary_variant(url, preset['transformation'] + ',' + size)} {descriptor}"
+        for size, descriptor in variants
+    )
+
+
+register.filter('image_src', image_src)
+register.filter('image_srcset', image_srcset)
+
+
+@register.simple_tag
+def responsive_img(url, preset='card', lazy=True, position=None, placeholders=None):
+    """
+    ``src``, ``srcset``, ``sizes`` and loading attributes for an ``<img>``::
+
+        <img {% responsive_img product.image1 'card' position=forloop.counter placeholders=product.image_placeholders %} alt="...">
+
+    Images are lazy-loaded unless ``lazy=False`` is passed or, in a list, their
+    ``position`` is within the first ``EAGER_IMAGES``. When ``placeholders``
+    (a listing's ``image_placeholders``) has an entry for ``url``, the image
+    also gets its intrinsic size and the blurred preview as its background, so
+    the card is painted without any image request.
+    """
+    srcset = image_srcset(url, preset)
+    html = format_html('src="{}"', image_src(url, preset))
+    if srcset:
+        html += format_html(' srcset="{}"', srcset)
+        if 'sizes' in PRESETS[preset]:
+            html += format_html(' sizes="{}"', PRESETS[preset]['sizes'])
+    placeholder = (placeholders or {}).get(url)
+    if placeholder:
+        html += format_html(
+            ' width="{}" height="{}" style="background: center / cover no-repeat url({});"',
+            placeholder['width'], placeholder['height'], placeholder['lqip'],
+        )
+    if position is not None:
+        lazy = position > EAGER_IMAGES
+    if lazy:
+        html += format_html(' loading="lazy" decoding="async"')
+    return html
@@ -1,3 +1,942 @@
-from django.test import TestCase
+import io
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+import cloudinary
+from PIL import Image, ImageDraw
+
+from . import (
+    caching, chunked_uploads, counting, dedup, media_jobs, media_probe, overload, promotions, ratings, related,
+    search, uploads, view_counter, views,
+)
+from .admin import ProductAdmin
+from .models import Category, MediaAsset, MediaJob, Product, Promotion, RelatedListing, Review, Service, User
+from .caching import detail_namespace, get_generation
+from .pagination import CountedPaginator, encode_cursor, keyset_page
+from .uploads import FakeUploader, UploadedAsset
+
+
+def make_product(seller, title='iPhone 13', **fields):
+    defaults = {
+        'description': 'A nice phone', 'vendor_price': Decimal('1000'), 'location': 'Nsukka', 'campus': 'UNN',
+        'image1': 'https://media.invalid/a.jpg', 'image2': 'https://media.invalid/b.jpg',
+    }
+    return Product.objects.create(seller=seller, title=title, **{**defaults, **fields})
+
+
+@override_settings(VIEW_COUNT_BUFFERED=True, VIEW_COUNT_DEDUP_WINDOW=0, VIEW_COUNT_FLUSH_INTERVAL=-1)
+class ViewCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(User.objects.create_user('seller', password='x'))
+        self.request = RequestFactory().get('/')
+
+    def views_in_db(self):
+        return Product.objects.values_list('views', flat=True).get(pk=self.product.pk)
+
+    def test_flush_applies_buffered_views(self):
+        for _ in range(3):
+            view_counter.record_view(self.request, self.product)
+        self.assertEqual(view_counter.flush_view_counts(), 3)
+        self.assertEqual(self.views_in_db(), 3)
+        self.assertEqual(view_counter.pending_views(self.product), 0)
+
+    def test_view_during_flush_is_flushed_later(self):
+        for _ in range(5):
+            view_counter.record_view(self.request, self.product)
+        decr = cache.decr
+
+        def decr_after_hit(key, delta=1, **kwargs):
+            # A view arrives between the flush reading the counter and decrementing it
+            view_counter.record_view(self.request, self.product)
+            return decr(key, delta, **kwargs)
+
+        with mock.patch.object(view_counter.cache, 'decr', side_effect=decr_after_hit):
+            self.assertEqual(view_counter.flush_view_counts(), 5)
+        self.assertEqual(view_counter.pending_views(self.product), 1)
+
+        self.assertEqual(view_counter.flush_view_counts(), 1)
+        self.assertEqual(self.views_in_db(), 6)
+        self.assertEqual(view_counter.pending_views(self.product), 0)
+
+    def test_failed_write_keeps_the_views_for_the_next_flush(self):
+        for _ in range(3):
+            view_counter.record_view(self.request, self.product)
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                view_counter.flush_view_counts()
+        self.assertEqual(view_counter.pending_views(self.product), 3)
+        self.assertEqual(view_counter.flush_view_counts(), 3)
+        self.assertEqual(self.views_in_db(), 3)
+
+    def test_evicted_slot_is_skipped_after_its_deadline(self):
+        other = make_product(self.product.seller, 'Samsung A14')
+        view_counter.record_view(self.request, self.product)
+        view_counter.record_view(self.request, other)
+        cache.delete(view_counter._slot_key(1))
+
+        self.assertEqual(view_counter.flush_view_counts(), 0)
+        later = time.time() + view_counter.SLOT_DEADLINE + 1
+        with mock.patch.object(view_counter.time, 'time', return_value=later):
+            self.assertEqual(view_counter.flush_view_counts(), 1)
+        self.assertEqual(Product.objects.get(pk=other.pk).views, 1)
+
+    def test_restarted_sequence_is_flushed_from_the_start(self):
+        for _ in range(3):
+            view_counter.record_view(self.request, self.product)
+            view_counter.flush_view_counts()
+        cache.delete(view_counter.SEQUENCE_KEY)
+        view_counter.record_view(self.request, self.product)
+        # A flush that was running meanwhile stores its old mark afterwards
+        cache.set(view_counter.FLUSHED_KEY, 3, None)
+        self.assertEqual(view_counter.flush_view_counts(), 1)
+        self.assertEqual(self.views_in_db(), 4)
+
+    @override_settings(VIEW_COUNT_BUFFERED=False)
+    def test_views_are_written_directly_without_a_shared_cache(self):
+        view_counter.record_view(self.request, self.product)
+        self.assertEqual(self.views_in_db(), 1)
+        self.assertEqual(view_counter.pending_views(self.product), 0)
+
+
+def mp4_box(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def ebml_element(element_id, body):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') + bytes([0x80 | len(body)]) + body
+
+
+class MediaProbeTests(TestCase):
+    def mp4(self, seconds):
+        mvhd = mp4_box(b'mvhd', bytes(4) + struct.pack('>IIII', 0, 0, 1000, seconds * 1000) + bytes(80))
+        return mp4_box(b'ftyp', b'isom' + bytes(4) + b'isom') + mp4_box(b'moov', mvhd) + mp4_box(b'mdat', bytes(64))
+
+    def webm(self):
+        header = ebml_element(media_probe.EBML_HEADER, ebml_element(media_probe.DOC_TYPE, b'webm'))
+        block = ebml_element(media_probe.SIMPLE_BLOCK, b'\x81' + struct.pack('>h', 40) + b'\x80' + bytes(8))
+        cluster = ebml_element(media_probe.CLUSTER, ebml_element(media_probe.CLUSTER_TIMECODE, bytes([30])) + block)
+        return header + ebml_element(media_probe.SEGMENT, cluster)
+
+    def test_reads_duration(self):
+        self.assertEqual(media_probe.probe(io.BytesIO(self.mp4(45))).duration, 45)
+        self.assertAlmostEqual(media_probe.probe(io.BytesIO(self.webm())).duration, 0.07)
+
+    def test_truncated_files_only_raise_probe_error(self):
+        for data in (self.mp4(45), self.webm()):
+            for length in range(1, len(data)):
+                try:
+                    media_probe.probe(io.BytesIO(data[:length]))
+                except media_probe.ProbeError:
+                    pass
+
+
+def image_file(image, name='photo.jpg', format='JPEG', **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format, **options)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{format.lower()}')
+
+
+def phone_photo(color):
+    """A product shot: the same layout, with the phone in ``color``"""
+    image = Image.new('RGB', (640, 480))
+    draw = ImageDraw.Draw(image)
+    for x in range(640):
+        draw.line([(x, 0), (x, 480)], fill=(120 + x // 8, 110 + x // 10, 100))
+    draw.rounded_rectangle([220, 60, 420, 420], radius=30, fill=color)
+    draw.ellipse([300, 360, 340, 400], fill=(20, 20, 20))
+    return image
+
+
+class DedupTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('seller', password='x')
+
+    def upload(self, file, owner=None):
+        """Record ``file`` as uploaded by ``owner`` (the default owner)"""
+        fingerprints = {'image1': dedup.fingerprint(file, 'image')}
+        asset = UploadedAsset(url=f'https://media.invalid/{file.name}', public_id=file.name)
+        dedup.remember({'image1': asset}, fingerprints, owner or self.owner)
+
+    def reused(self, file, owner=None):
+        hits = dedup.lookup({'image1': dedup.fingerprint(file, 'image')}, {'image1': 'image'}, owner or self.owner)
+        return hits['image1'].public_id if 'image1' in hits else None
+
+    def test_exact_copy_is_reused(self):
+        self.upload(image_file(phone_photo((200, 30, 30)), 'red.jpg'))
+        self.assertEqual(self.reused(image_file(phone_photo((200, 30, 30)), 'again.jpg')), 'red.jpg')
+
+    def test_reencoded_photo_is_reused(self):
+        self.upload(image_file(phone_photo((200, 30, 30)), 'red.png', 'PNG'))
+        self.assertEqual(self.reused(image_file(phone_photo((200, 30, 30)), 'red.jpg', quality=70)), 'red.png')
+
+    def test_same_layout_in_another_color_is_not_reused(self):
+        self.upload(image_file(phone_photo((200, 30, 30)), 'red.jpg'))
+        self.assertIsNone(self.reused(image_file(phone_photo((30, 30, 200)), 'blue.jpg')))
+
+    def test_flat_images_only_match_exactly(self):
+        self.upload(image_file(Image.new('RGB', (300, 300), (200, 30, 30)), 'red.png', 'PNG'))
+        self.assertIsNone(self.reused(image_file(Image.new('RGB', (300, 300), (30, 30, 200)), 'blue.png', 'PNG')))
+        self.assertIsNone(self.reused(image_file(Image.new('RGB', (300, 300), (200, 30, 30)), 'red.jpg')))
+
+    def test_another_owners_copy_is_not_reused(self):
+        other = User.objects.create_user('other', password='x')
+        self.upload(image_file(phone_photo((200, 30, 30)), 'red.png', 'PNG'))
+        self.assertIsNone(self.reused(image_file(phone_photo((200, 30, 30)), 'copy.png', 'PNG'), other))
+
+        # Their own upload of the same bytes gets its own row
+        self.upload(image_file(phone_photo((200, 30, 30)), 'theirs.png', 'PNG'), other)
+        self.assertEqual(self.reused(image_file(phone_photo((200, 30, 30)), 'copy.png', 'PNG'), other), 'theirs.png')
+        self.assertEqual(MediaAsset.objects.count(), 2)
+
+    def test_reuse_keeps_the_file_from_collection(self):
+        self.upload(image_file(phone_photo((200, 30, 30)), 'red.png', 'PNG'))
+        MediaAsset.objects.update(last_used_at=timezone.now() - timedelta(days=2))
+        self.reused(image_file(phone_photo((200, 30, 30)), 'again.png', 'PNG'))
+        self.assertGreater(MediaAsset.objects.get().last_used_at, timezone.now() - timedelta(minutes=1))
+
+    @override_settings(UPLOAD_DEDUP_NEAR=False)
+    def test_near_matching_can_be_turned_off(self):
+        self.upload(image_file(phone_photo((200, 30, 30)), 'red.png', 'PNG'))
+        self.assertIsNone(self.reused(image_file(phone_photo((200, 30, 30)), 'red.jpg', quality=70)))
+        self.assertEqual(MediaAsset.objects.count(), 1)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', password='x')
+        self.phones = Category.objects.create(name='Phones')
+        # Many more inactive matches than any cut-off taken before filtering
+        Product.objects.bulk_create([
+            Product(
+                seller=self.seller, title=f'Phone case {i}', slug=f'phone-case-{i}', description='Old stock',
+                vendor_price=Decimal('10'), price=Decimal('11'), location='Nsukka', campus='UNN',
+                image1='https://media.invalid/a.jpg', status='inactive',
+            )
+            for i in range(510)
+        ])
+        search.rebuild_index(Product)
+        self.best = make_product(self.seller, 'Phone phone phone', category=self.phones, status='active')
+        self.others = [
+            make_product(self.seller, f'Used phone {i}', category=self.phones, status='active')
+            for i in range(5)
+        ]
+
+    def test_matches_are_ranked_within_the_filtered_listings(self):
+        listings = Product.objects.filter(status='active', category=self.phones)
+        results, fuzzy = search.search_listings(listings, 'phone')
+        self.assertFalse(fuzzy)
+        self.assertEqual(results.count(), 6)
+        self.assertEqual(results.order_by('-search_rank', '-created_at').first(), self.best)
+
+    def test_close_matches_are_scored_within_the_filtered_listings(self):
+        # Inactive listings that match the typo better than the one that is for sale
+        Product.objects.bulk_create([
+            Product(
+                seller=self.seller, title='iPhone', slug=f'iphone-{i}', description='Sold',
+                vendor_price=Decimal('10'), price=Decimal('11'), location='Nsukka', campus='UNN',
+                image1='https://media.invalid/a.jpg', status='inactive',
+            )
+            for i in range(search.FUZZY_MATCH_LIMIT + 10)
+        ])
+        for_sale = make_product(self.seller, 'iPhones 13', category=self.phones, status='active')
+        listings = Product.objects.filter(status='active', category=self.phones)
+        results, fuzzy = search.search_listings(listings, 'iphonr')
+        self.assertTrue(fuzzy)
+        self.assertEqual(list(results), [for_sale])
+
+    def test_close_matches_are_filtered_without_loading_every_listing(self):
+        Product.objects.bulk_create([
+            Product(
+                seller=self.seller, title=f'Laptop {i}', slug=f'laptop-{i}', description='Fast',
+                vendor_price=Decimal('10'), price=Decimal('11'), location='Nsukka', campus='UNN',
+                image1='https://media.invalid/a.jpg',
+            )
+            for i in range(50)
+        ])
+        for_sale = make_product(self.seller, 'iPhones 13', category=self.phones, status='active')
+        listings = Product.objects.filter(status='active')
+        search.ngram_index(Product)
+        with mock.patch.object(search, 'FUZZY_FILTER_BATCH', 1), CaptureQueriesContext(connection) as queries:
+            ranked = list(search._fuzzy(listings, ['iphonr'], 'iphonr'))
+        self.assertIn(for_sale, ranked)
+        # Only index matches are checked against the filters, never the whole listing table
+        self.assertTrue(all(' IN (' in query['sql'] for query in queries.captured_queries))
+
+
+class BrowseRevalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user('seller', password='x')
+        self.old = make_product(seller, 'Old phone', status='active')
+        self.new = make_product(seller, 'New phone', status='active')
+
+    def test_removing_a_listing_invalidates_the_page(self):
+        url = reverse('browse_products')
+        first = self.client.get(url)
+        self.assertFalse(first.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        # The newest listing is untouched, so its updated_at would not move
+        self.old.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Old phone')
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user('seller', password='x')
+        self.product = make_product(self.seller, 'Old phone', status='active')
+
+    def test_repeat_anonymous_visits_are_served_from_the_cache(self):
+        url = reverse('browse_products')
+        self.assertEqual(self.client.get(url, {'sort': '-created_at', 'q': ''})['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'q': ' ', 'sort': '-created_at'})
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Old phone')
+        # Another filter is another page
+        self.assertEqual(self.client.get(url, {'sort': 'price'})['X-Page-Cache'], 'miss')
+
+    def test_editing_a_listing_purges_the_pages_showing_it(self):
+        url = reverse('browse_products')
+        self.client.get(url)
+        self.product.title = 'Renamed phone'
+        self.product.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Renamed phone')
+
+    def test_signed_in_visitors_bypass_the_cache(self):
+        self.client.force_login(self.seller)
+        url = reverse('browse_products')
+        self.client.get(url)
+        self.assertFalse(self.client.get(url).has_header('X-Page-Cache'))
+
+    @override_settings(VIEW_COUNT_BUFFERED=False, VIEW_COUNT_DEDUP_WINDOW=0)
+    def test_cached_detail_page_still_counts_the_view(self):
+        url = reverse('product_detail', args=[self.product.slug])
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.views, 2)
+
+
+class DetailRevalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user('buyer', password='x')
+        self.product = make_product(User.objects.create_user('seller', password='x'), status='active')
+        self.url = reverse('product_detail', args=[self.product.slug])
+
+    def test_new_review_invalidates_the_page(self):
+        first = self.client.get(self.url)
+        self.assertFalse(first.has_header('Last-Modified'))
+        Review.objects.create(product=self.product, reviewer=self.buyer, rating=4, comment='Works well')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Works well')
+
+    @override_settings(VIEW_COUNT_BUFFERED=False, VIEW_COUNT_DEDUP_WINDOW=0)
+    def test_revalidation_counts_views_unless_degraded(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).views, 2)
+
+        with mock.patch.object(overload, 'is_degraded', return_value=True):
+            etag = self.client.get(self.url)['ETag']
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).views, 2)
+
+
+class RatingTests(TestCase):
+    def setUp(self):
+        self.reviewer = User.objects.create_user('buyer', password='x')
+        self.product = make_product(User.objects.create_user('seller', password='x'))
+
+    def aggregates(self):
+        return Product.objects.values_list('rating_sum', 'rating_count').get(pk=self.product.pk)
+
+    def review(self, rating):
+        return Review.objects.create(product=self.product, reviewer=self.reviewer, rating=rating, comment='Fine')
+
+    def test_reviews_update_the_aggregates(self):
+        review = self.review(5)
+        self.review(3)
+        self.assertEqual(self.aggregates(), (8, 2))
+        review.rating = 1
+        review.save()
+        self.assertEqual(self.aggregates(), (4, 2))
+        review.delete()
+        self.assertEqual(self.aggregates(), (3, 1))
+
+    def test_review_is_not_saved_without_its_aggregates(self):
+        review = self.review(5)
+        review.rating = 1
+        with mock.patch.object(ratings, 'apply_rating_delta', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                review.save()
+            with self.assertRaises(RuntimeError):
+                self.review(4)
+        self.assertEqual(Review.objects.get().rating, 5)
+        self.assertEqual(self.aggregates(), (5, 1))
+
+
+class CountingUploader(FakeUploader):
+    """FakeUploader that records how many uploads ran at once"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.running = 0
+        self.most_running = 0
+
+    def upload(self, file, resource_type='image', timeout=None):
+        with self._lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            return super().upload(file, resource_type, timeout)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+@override_settings(UPLOAD_MAX_WORKERS=2, IMAGE_PREPROCESS=False)
+class UploadTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('seller', password='x')
+        # A pool sized by this test's settings, not by whichever test ran first
+        uploads._executor = None
+
+    def tearDown(self):
+        uploads.get_executor().shutdown(wait=True)
+        uploads._executor = None
+
+    def images(self, *names):
+        colors = [(200, 30, 30), (30, 200, 30), (30, 30, 200), (200, 200, 30)]
+        return {
+            f'image{i}': (image_file(Image.new('RGB', (64, 64), colors[i]), name, 'PNG'), 'image')
+            for i, name in enumerate(names)
+        }
+
+    def test_uploads_run_concurrently_within_the_pool_size(self):
+        uploader = CountingUploader(delay=0.1)
+        batch = uploads.upload_files(self.images('a.png', 'b.png', 'c.png', 'd.png'), uploader, owner=self.owner)
+        self.assertEqual(len(batch.assets), 4)
+        self.assertEqual(uploader.most_running, 2)
+
+    def test_one_failed_file_keeps_the_others(self):
+        uploader = FakeUploader(fail={'b.png'})
+        with self.assertLogs('marketplace.uploads', 'WARNING'):
+            batch = uploads.upload_files(self.images('a.png', 'b.png', 'c.png'), uploader, owner=self.owner)
+        self.assertEqual(batch.errors, {'image1': 'upload failed'})
+        self.assertEqual(batch.url('image1'), '')
+        self.assertTrue(batch.url('image0') and batch.url('image2'))
+        self.assertEqual(MediaAsset.objects.count(), 2)
+
+    def test_slow_upload_times_out_and_is_deleted_when_it_lands(self):
+        uploader = FakeUploader(delay=0.5)
+        started = time.monotonic()
+        batch = uploads.upload_files(self.images('a.png'), uploader, timeout=0.1, owner=self.owner)
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(batch.errors, {'image0': 'timed out'})
+        self.assertEqual(batch.assets, {})
+
+        uploads.get_executor().shutdown(wait=True)
+        self.assertEqual(uploader.destroyed, uploader.uploaded)
+        self.assertEqual(len(uploader.destroyed), 1)
+
+    @override_settings(UPLOAD_MAX_WORKERS=1)
+    def test_timeout_covers_the_whole_batch(self):
+        uploader = FakeUploader(delay=0.3)
+        started = time.monotonic()
+        batch = uploads.upload_files(self.images('a.png', 'b.png', 'c.png'), uploader, timeout=0.5, owner=self.owner)
+        self.assertLess(time.monotonic() - started, 0.8)
+        self.assertEqual(list(batch.assets), ['image0'])
+        self.assertEqual(batch.errors, {'image1': 'timed out', 'image2': 'timed out'})
+
+        # The running upload is deleted once it lands, the queued one never starts
+        uploads.get_executor().shutdown(wait=True)
+        self.assertEqual(len(uploader.uploaded), 2)
+        self.assertEqual(uploader.destroyed, uploader.uploaded[1:])
+
+    def test_discard_deletes_uploads_but_not_reused_files(self):
+        uploader = FakeUploader()
+        earlier = uploads.upload_files(self.images('a.png'), uploader, owner=self.owner)
+        batch = uploads.upload_files(self.images('a.png', 'b.png'), uploader, owner=self.owner)
+        self.assertTrue(batch.assets['image0'].reused)
+
+        batch.discard()
+        self.assertEqual(batch.assets, {})
+        self.assertEqual(uploader.destroyed, [uploader.uploaded[1]])
+        self.assertEqual(
+            list(MediaAsset.objects.values_list('public_id', flat=True)), [earlier.assets['image0'].public_id]
+        )
+
+
+class DirectUploadTests(TestCase):
+    payload = {
+        'public_id': f'{uploads.IMAGE_FOLDER}/abc', 'version': '1700000000', 'signature': 'signed',
+        'format': 'jpg', 'width': 800, 'height': 450,
+    }
+
+    def setUp(self):
+        # Runs offline, without the account settings from the environment
+        config = cloudinary.config()
+        saved = dict(vars(config))
+
+        def restore():
+            vars(config).clear()
+            vars(config).update(saved)
+        self.addCleanup(restore)
+        cloudinary.config(cloud_name='arparte-test', api_key='key', api_secret='secret')
+
+    def verify(self, **urlopen):
+        with mock.patch('cloudinary.utils.verify_api_response_signature', return_value=True), \
+                mock.patch.object(uploads.urllib.request, 'urlopen', **urlopen) as fetch:
+            return uploads.verify_direct_upload(dict(self.payload)), fetch
+
+    def test_placeholder_comes_from_a_small_copy(self):
+        copy = image_file(Image.new('RGB', (128, 72), (200, 30, 30)), 'copy.jpg').read()
+        response = mock.MagicMock()
+        response.__enter__.return_value.read.return_value = copy
+        asset, fetch = self.verify(return_value=response)
+        self.assertIn('c_limit,h_128,w_128', fetch.call_args.args[0])
+        self.assertEqual(asset.placeholder['width'], 800)
+        self.assertEqual(asset.placeholder['height'], 450)
+        self.assertTrue(asset.placeholder['lqip'].startswith('data:image/webp;base64,'))
+
+    def test_unreachable_copy_leaves_no_placeholder(self):
+        with self.assertLogs('marketplace.uploads', 'WARNING'):
+            asset, _ = self.verify(side_effect=OSError('timed out'))
+        self.assertEqual(asset.public_id, f'{uploads.IMAGE_FOLDER}/abc')
+        self.assertIsNone(asset.placeholder)
+
+
+class CountingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user('seller', password='x')
+        for i in range(5):
+            make_product(self.seller, f'Phone {i}', status='active')
+        self.listings = Product.objects.filter(status='active')
+
+    def test_small_results_are_counted_exactly(self):
+        count = counting.count_results(self.listings, {})
+        self.assertEqual(count, 5)
+        self.assertEqual(str(count), '5')
+
+    @mock.patch.object(counting, 'EXACT_COUNT_LIMIT', 3)
+    def test_large_results_are_capped(self):
+        count = counting.count_results(self.listings, {})
+        self.assertTrue(count.is_estimate)
+        self.assertEqual(str(count), '3+')
+
+    def test_large_planner_estimate_skips_the_count(self):
+        estimate = counting.EXACT_COUNT_LIMIT * counting.PLANNER_TRUST_FACTOR
+        with mock.patch.object(counting, 'planner_estimate', return_value=estimate), \
+                mock.patch.object(counting, 'capped_count') as capped:
+            count = counting.count_results(self.listings, {})
+        capped.assert_not_called()
+        self.assertEqual(count, counting.ResultCount(counting.EXACT_COUNT_LIMIT, True))
+
+    def test_counts_are_cached_per_filters_until_a_listing_changes(self):
+        counting.count_results(self.listings, {'q': 'Phone', 'page': '2'})
+        with self.assertNumQueries(0):
+            # Paging and spacing do not change the filters
+            self.assertEqual(counting.count_results(self.listings, {'page': '3', 'q': ' phone '}), 5)
+        make_product(self.seller, 'Phone 5', status='active')
+        self.assertEqual(counting.count_results(self.listings, {'q': 'phone'}), 6)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.computed = 0
+        self.lock = threading.Lock()
+
+    def compute(self, delay=0):
+        with self.lock:
+            self.computed += 1
+        time.sleep(delay)
+        cache.set('sf:key', 'fresh')
+        return 'fresh'
+
+    def test_concurrent_misses_compute_once(self):
+        results = []
+
+        def request():
+            results.append(caching.single_flight('sf:key', lambda: self.compute(0.2), lambda: cache.get('sf:key')))
+
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.computed, 1)
+        self.assertEqual(sorted(results), [('fresh', 'hit')] * 4 + [('fresh', 'miss')])
+
+    def test_others_serve_the_stale_copy_during_a_rebuild(self):
+        cache.add('sf:key:lock', 1)
+        value = caching.single_flight('sf:key', self.compute, lambda: cache.get('sf:key'), lambda: 'old')
+        self.assertEqual(value, ('old', 'stale'))
+        self.assertEqual(self.computed, 0)
+
+    def test_waiting_gives_up_on_a_slow_rebuild(self):
+        cache.add('sf:key:lock', 1)
+        started = time.monotonic()
+        value = caching.single_flight('sf:key', self.compute, lambda: cache.get('sf:key'), wait=0.1)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(value, ('fresh', 'miss'))
+
+    @mock.patch.object(overload, 'is_degraded', return_value=True)
+    def test_degraded_mode_serves_stale_without_rebuilding(self, _):
+        value = caching.single_flight('sf:key', self.compute, lambda: cache.get('sf:key'), lambda: 'old')
+        self.assertEqual(value, ('old', 'stale'))
+        self.assertEqual(self.computed, 0)
+
+
+@mock.patch.object(caching, '_expires_early', return_value=False)
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user('seller', password='x')
+        self.renders = 0
+
+    def render(self):
+        self.renders += 1
+        return f'render {self.renders}'
+
+    def fragment(self, vary_on=()):
+        return caching.versioned_fragment('home:recent-products', ['listings:product', 'reviews'], self.render, vary_on)
+
+    def test_fragment_is_kept_until_one_of_its_generations_moves(self, _):
+        self.assertEqual(self.fragment(), 'render 1')
+        self.assertEqual(self.fragment(), 'render 1')
+        caching.bump_generation(caching.CATEGORY_NAMESPACE)
+        self.assertEqual(self.fragment(), 'render 1')
+        caching.bump_generation(caching.REVIEW_NAMESPACE)
+        self.assertEqual(self.fragment(), 'render 2')
+        self.assertEqual(self.fragment(vary_on=[True]), 'render 3')
+
+    def test_listing_edits_invalidate_but_view_counts_do_not(self, _):
+        product = make_product(self.seller)
+        self.fragment()
+        product.views += 1
+        product.save(update_fields=['views'])
+        self.assertEqual(self.fragment(), 'render 1')
+        product.title = 'iPhone 13 Pro'
+        product.save()
+        self.assertEqual(self.fragment(), 'render 2')
+
+
+class PromotionExpiryTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', password='x')
+        self.now = timezone.now()
+
+    def promote(self, ends, status='active'):
+        product = make_product(self.seller, is_featured=True, featured_until=ends)
+        return Promotion.objects.create(product=product, amount_paid=Decimal('500'), status=status, end_date=ends)
+
+    def test_due_promotions_expire_in_batches(self):
+        due = [self.promote(self.now - timedelta(hours=i + 1)) for i in range(5)]
+        running = self.promote(self.now + timedelta(days=1))
+        cancelled = self.promote(self.now - timedelta(days=1), status='cancelled')
+
+        with CaptureQueriesContext(connection) as queries:
+            expired = promotions.expire_due(self.now, batch_size=2)
+        self.assertEqual(expired, {'promotions': 5, 'products': 6, 'services': 0})
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "marketplace_promotion"')]
+        self.assertEqual(len(updates), 3)
+
+        self.assertEqual(
+            set(Promotion.objects.filter(status='expired').values_list('pk', flat=True)), {row.pk for row in due}
+        )
+        for promotion, status in ((running, 'active'), (cancelled, 'cancelled')):
+            promotion.refresh_from_db()
+            self.assertEqual(promotion.status, status)
+        self.assertEqual(list(Product.objects.filter(is_featured=True)), [running.product])
+
+    def test_nothing_due_is_one_query_per_table(self):
+        self.promote(self.now + timedelta(days=1))
+        with self.assertNumQueries(3):
+            self.assertEqual(promotions.expire_due(self.now), {'promotions': 0, 'products': 0, 'services': 0})
+
+
+class ListingCardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.phones = Category.objects.create(name='Phones')
+
+    def add_listings(self, count):
+        for i in range(count):
+            seller = User.objects.create_user(f'seller{Product.objects.count()}', password='x')
+            make_product(seller, f'Phone {i}', category=self.phones, status='active')
+
+    def test_cards_render_from_one_query(self):
+        self.add_listings(3)
+        with self.assertNumQueries(1):
+            cards = [
+                (product.title, product.price, product.category.name, product.seller.username,
+                 product.seller.is_verified, product.rating_avg)
+                for product in Product.objects.for_cards()
+            ]
+        self.assertEqual(len(cards), 3)
+
+    def browse_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('browse_products'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_browse_queries_do_not_grow_with_the_page(self):
+        self.add_listings(2)
+        few = self.browse_queries()
+        self.add_listings(8)
+        self.assertEqual(self.browse_queries(), few)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', password='x')
+
+    def walk(self, queryset, sort, per_page=3):
+        """Follow next cursors to the end, then previous cursors back to the start"""
+        forwards, pages = [], []
+        page = keyset_page(queryset, sort, per_page=per_page)
+        while True:
+            pages.append(list(page))
+            forwards.extend(page)
+            # A cursor that skips or repeats rows would never reach the end
+            self.assertLessEqual(len(forwards), queryset.count())
+            if not page.next_cursor:
+                break
+            page = keyset_page(queryset, sort, after=page.next_cursor, per_page=per_page)
+        backwards = [list(page)]
+        while page.previous_cursor:
+            page = keyset_page(queryset, sort, before=page.previous_cursor, per_page=per_page)
+            backwards.append(list(page))
+        self.assertEqual(backwards[::-1], pages)
+        return forwards
+
+    def test_equal_prices_are_ordered_by_id(self):
+        for i in range(4):
+            make_product(self.seller, f'Phone {i}', vendor_price=Decimal('1000'))
+        for i in range(3):
+            make_product(self.seller, f'Case {i}', vendor_price=Decimal('50'))
+        products = Product.objects.all()
+        self.assertEqual(self.walk(products, 'price'), list(products.order_by('price', 'id')))
+        self.assertEqual(self.walk(products, '-price'), list(products.order_by('-price', '-id')))
+
+    def test_unpriced_services_page_last_in_both_directions(self):
+        for i, price in enumerate([Decimal('500'), None, Decimal('200'), None, Decimal('500'), None, Decimal('900')]):
+            Service.objects.create(
+                provider=self.seller, title=f'Tutoring {i}', description='Maths', location='Nsukka',
+                vendor_price=price,
+            )
+        services = Service.objects.all()
+        for sort, tie_break in (('price', 'id'), ('-price', '-id')):
+            walked = self.walk(services, sort, per_page=2)
+            self.assertEqual([service.price is None for service in walked], [False] * 4 + [True] * 3)
+            self.assertEqual(walked[4:], list(services.filter(price__isnull=True).order_by(tie_break)))
+
+    def test_tampered_or_foreign_cursor_starts_over(self):
+        products = [make_product(self.seller, f'Phone {i}') for i in range(5)]
+        first = list(keyset_page(Product.objects.all(), 'title', per_page=2))
+        for token in (encode_cursor('title', products[2]) + 'x', encode_cursor('price', products[2])):
+            page = keyset_page(Product.objects.all(), 'title', after=token, per_page=2)
+            self.assertEqual(list(page), first)
+            self.assertIsNone(page.previous_cursor)
+
+
+class EstimatedPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user('seller', password='x')
+        for i in range(7):
+            make_product(seller, f'Phone {i}', status='active')
+        self.listings = Product.objects.order_by('title')
+
+    def test_pages_past_the_estimate_stay_reachable(self):
+        paginator = CountedPaginator(self.listings, 3, count=3, is_estimate=True)
+        with self.assertNumQueries(1):
+            page = paginator.get_page(2)
+            self.assertEqual([product.title for product in page], ['Phone 3', 'Phone 4', 'Phone 5'])
+        self.assertTrue(page.has_next())
+        last = paginator.get_page(3)
+        self.assertEqual([product.title for product in last], ['Phone 6'])
+        self.assertFalse(last.has_next())
+        # Past the end falls back to the last page the estimate promises
+        self.assertEqual(paginator.get_page(9).number, 1)
+
+    @mock.patch.object(counting, 'EXACT_COUNT_LIMIT', 4)
+    @mock.patch.object(views, 'BROWSE_PAGE_SIZE', 3)
+    def test_numbered_pages_never_count_every_result(self):
+        url = reverse('browse_products')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'page': 2})
+        self.assertFalse([query['sql'] for query in queries if 'COUNT(' in query['sql']])
+        self.assertEqual(str(response.context['total_results']), '4+')
+        self.assertContains(response, 'Page 2<')
+        self.assertTrue(response.context['page_obj'].has_next())
+
+
+class RelatedListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user('seller', password='x')
+        self.phones = Category.objects.create(name='Phones')
+        self.books = Category.objects.create(name='Books')
+        self.iphone = self.listing('iPhone 13 Pro 128GB', 'Clean iPhone with charger', self.phones)
+        self.samsung = self.listing('Samsung Galaxy S21', 'Android phone with charger', self.phones)
+        self.novel = self.listing('Things Fall Apart', 'Chinua Achebe novel, paperback', self.books)
+
+    def listing(self, title, description, category):
+        return make_product(self.seller, title, description=description, category=category, status='active')
+
+    def related_titles(self, product):
+        return list(
+            RelatedListing.objects.filter(product=product).order_by('rank')
+            .values_list('related_product__title', flat=True)
+        )
+
+    def test_similar_text_ranks_first_with_and_without_numpy(self):
+        listings = [
+            related.Listing(1, 'iPhone 13 Pro', 'Clean iPhone 13 with box', None, 'UNN', 700000),
+            related.Listing(2, 'iPhone 12', 'Used iPhone, box included', None, 'UNN', 500000),
+            related.Listing(3, 'Calculus textbook', 'Stewart, 8th edition', None, 'UNN', 8000),
+        ]
+        expected = related.compute_neighbours(listings, [0])
+        self.assertEqual([target for target, _ in expected[0]], [1, 2])
+        with mock.patch.object(related, 'np', None):
+            fallback = related.compute_neighbours(listings, [0])
+        self.assertEqual([target for target, _ in fallback[0]], [1, 2])
+        for (_, score), (_, other) in zip(expected[0], fallback[0]):
+            self.assertAlmostEqual(score, other, places=5)
+
+    def test_new_listing_joins_unchanged_listings_neighbours(self):
+        related.refresh_related(Product)
+        self.assertEqual(self.related_titles(self.iphone)[0], 'Samsung Galaxy S21')
+
+        newer = self.listing('iPhone 13 Pro Max 256GB', 'Clean iPhone 13 Pro Max with charger', self.phones)
+        self.assertEqual(related.refresh_related(Product), 1)
+        self.assertEqual(self.related_titles(self.iphone)[0], newer.title)
+        self.assertIn(newer.title, self.related_titles(self.samsung))
+
+    def test_changed_neighbours_purge_detail_pages(self):
+        related.refresh_related(Product)
+        iphone_page = detail_namespace(Product, self.iphone.slug)
+        novel_page = detail_namespace(Product, self.novel.slug)
+        before = get_generation(iphone_page), get_generation(novel_page)
+
+        self.listing('iPhone 13 Pro Max 256GB', 'Clean iPhone 13 Pro Max with charger', self.phones)
+        related.refresh_related(Product)
+        self.assertNotEqual(get_generation(iphone_page), before[0])
+
+        before = get_generation(iphone_page)
+        self.samsung.delete()
+        self.assertNotEqual(get_generation(iphone_page), before)
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.enterContext(override_settings(MEDIA_SPOOL_DIR=spool.name))
+        self.owner = User.objects.create_user('seller', password='x')
+        self.upload_id = chunked_uploads.start(self.owner, 'clip.mp4', 10)
+
+    def append(self, offset, data):
+        return chunked_uploads.append(self.upload_id, self.owner, offset, io.BytesIO(data), len(data))
+
+    def test_chunks_are_appended_in_order(self):
+        self.assertEqual(self.append(0, b'12345'), 5)
+        self.assertEqual(self.append(5, b'67890'), 10)
+        self.assertTrue(chunked_uploads.completed_path(self.upload_id, self.owner))
+
+    def test_repeated_chunk_is_refused(self):
+        self.append(0, b'12345')
+        with self.assertRaisesMessage(chunked_uploads.ChunkError, 'expected offset 5'):
+            self.append(0, b'12345')
+        with self.assertRaisesMessage(chunked_uploads.ChunkError, 'chunk too large'):
+            self.append(5, b'6789012')
+        self.assertEqual(chunked_uploads.received(self.upload_id, self.owner), (5, 10))
+
+    @skipIf(chunked_uploads.fcntl is None, 'appends are only locked where fcntl exists')
+    def test_chunk_arriving_during_another_is_refused(self):
+        path, _ = chunked_uploads._load(self.upload_id, self.owner)
+        with open(path, 'ab') as other:
+            chunked_uploads.fcntl.flock(other, chunked_uploads.fcntl.LOCK_EX)
+            with self.assertRaisesMessage(chunked_uploads.ChunkError, 'being received'):
+                self.append(0, b'12345')
+        self.assertEqual(os.path.getsize(path), 0)
+
+
+@override_settings(IMAGE_PREPROCESS=False)
+class MediaJobTests(TestCase):
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.enterContext(override_settings(MEDIA_SPOOL_DIR=spool.name))
+        self.seller = User.objects.create_user('seller', password='x')
+        self.product = make_product(self.seller, status='processing', image1='', image2='')
+
+    def enqueue(self):
+        return media_jobs.enqueue(self.product, {
+            'image1': image_file(Image.new('RGB', (64, 64), (200, 30, 30)), 'a.png', 'PNG'),
+            'image2': image_file(Image.new('RGB', (64, 64), (30, 30, 200)), 'b.png', 'PNG'),
+        })
+
+    def test_listing_is_published_by_its_job_only(self):
+        self.enqueue()
+        with mock.patch.object(ProductAdmin, 'message_user'):
+            ProductAdmin(Product, admin.site).mark_as_active(None, Product.objects.all())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.status, 'processing')
+
+        self.assertEqual(media_jobs.run_pending(uploader=FakeUploader())['done'], 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.status, 'active')
+        self.assertTrue(self.product.image1 and self.product.image2)
+
+    def test_reclaimed_job_does_not_upload_twice(self):
+        stalled = timezone.now() - timedelta(seconds=media_jobs.PROCESSING_TIMEOUT + 60)
+        job = self.enqueue()
+        MediaJob.objects.filter(pk=job.pk).update(available_at=stalled)
+        with mock.patch('django.utils.timezone.now', return_value=stalled):
+            [slow] = media_jobs.claim_jobs()
+        [reclaimed] = media_jobs.claim_jobs()
+        self.assertEqual(reclaimed.attempts, 2)
+
+        uploader = FakeUploader()
+        # The slow worker finishes after losing its claim; its uploads stay in the ledger
+        self.assertEqual(media_jobs.process_job(slow, uploader), 'superseded')
+        self.assertEqual(media_jobs.process_job(reclaimed, uploader), 'done')
+        self.assertEqual(len(uploader.uploaded), 2)
+        self.assertEqual(uploader.destroyed, [])
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.status, 'active')
+        self.assertEqual({self.product.image1, self.product.image2}, {asset.url for asset in uploader.uploaded})
+        reclaimed.refresh_from_db()
+        self.assertEqual(reclaimed.status, 'done')
@@ -0,0 +1,437 @@
+"""
+Media uploads for listing submissions.
+
+All files of one submission are uploaded concurrently on a shared, bounded
+thread pool (``UPLOAD_MAX_WORKERS``) and must all finish within one
+``UPLOAD_TIMEOUT``, counted from submission.
+Images are shrunk locally first (``marketplace.imaging``).
+``upload_files`` returns an ``UploadBatch`` that reports per-file failures and
+can ``discard()`` everything it uploaded when the submission is rejected.
+
+The uploader is injectable: ``MEDIA_UPLOADER`` names the class, or pass an
+instance to ``upload_files``. An uploader has ``upload(file, resource_type,
+timeout)`` returning an ``UploadedAsset`` (with the video duration),
+``destroy(asset)`` and ``destroy_many(assets)`` for garbage collection
+(``marketplace.media_gc``). ``CloudinaryUploader`` is the production backend;
+``LocalUploader`` keeps files on disk so the whole listing pipeline runs
+offline, and ``FakeUploader`` stores nothing at all.
+
+Browsers can also upload straight to Cloudinary with parameters from
+``direct_upload_params``; the form then only posts back the upload response,
+which ``verify_direct_upload`` checks. Their placeholders are computed from a
+small copy Cloudinary derives on request.
+"""
+import io
+import logging
+import os
+import shutil
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import dedup, imaging, media_probe
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FOLDER = 'arparte_products'
+VIDEO_FOLDER = 'arparte_videos'
+
+IMAGE_TRANSFORMATION = [
+    {'width': 800, 'height': 600, 'crop': 'limit'},
+    {'quality': 'auto:good'},
+]
+VIDEO_TRANSFORMATION = [
+    {'width': 1280, 'height': 720, 'crop': 'limit'},
+    {'quality': 'auto:good'},
+]
+# Cloudinary's chunked upload API wants parts of at least 5MB
+VIDEO_CHUNK_SIZE = 6 * 1024 * 1024
+# Most public ids the Admin API deletes in one call
+DESTROY_BATCH_SIZE = 100
+
+
+@dataclass
+class UploadedAsset:
+    url: str
+    public_id: str
+    resource_type: str = 'image'
+    duration: float = 0
+    # Found in the dedup table rather than uploaded by this batch
+    reused: bool = False
+    # Inline preview for images (marketplace.imaging.placeholder)
+    placeholder: dict | None = None
+
+
+class UploadError(Exception):
+    pass
+
+
+class CloudinaryUploader:
+    """Uploads straight to Cloudinary"""
+
+    # Browsers may upload with signed parameters (direct_upload_params)
+    supports_direct_uploads = True
+
+    def upload(self, file, resource_type='image', timeout=None):
+        import cloudinary.uploader
+        options = {
+            'resource_type': resource_type,
+            'folder': VIDEO_FOLDER if resource_type == 'video' else IMAGE_FOLDER,
+            'transformation': VIDEO_TRANSFORMATION if resource_type == 'video' else IMAGE_TRANSFORMATION,
+        }
+        if timeout:
+            options['timeout'] = timeout
+        if resource_type == 'video':
+            # Sent in VIDEO_CHUNK_SIZE parts, read from disk one at a time
+            if hasattr(file, 'temporary_file_path'):
+                file = file.temporary_file_path()
+            result = cloudinary.uploader.upload_large(file, chunk_size=VIDEO_CHUNK_SIZE, **options)
+        else:
+            result = cloudinary.uploader.upload(file, **options)
+        return UploadedAsset(
+            url=result['secure_url'],
+            public_id=result['public_id'],
+            resource_type=resource_type,
+            duration=result.get('duration', 0),
+        )
+
+    def destroy(self, asset):
+        import cloudinary.uploader
+        cloudinary.uploader.destroy(asset.public_id, resource_type=asset.resource_type, invalidate=True)
+
+    def destroy_many(self, assets):
+        """
+        Delete up to ``DESTROY_BATCH_SIZE`` assets with one Admin API call per
+        resource type; returns the public ids that are gone.
+        """
+        import cloudinary.api
+        gone = set()
+        for resource_type in sorted({asset.resource_type for asset in assets}):
+            public_ids = [asset.public_id for asset in assets if asset.resource_type == resource_type]
+            result = cloudinary.api.delete_resources(public_ids, resource_type=resource_type, invalidate=True)
+            gone.update(
+                public_id for public_id, status in result.get('deleted', {}).items()
+                if status in ('deleted', 'not_found')
+            )
+        return gone
+
+
+class LocalUploader:
+    """
+    Stores files under ``LOCAL_MEDIA_ROOT`` and links them below
+    ``LOCAL_MEDIA_URL``, where ``arparte.urls`` serves them. For offline
+    development, CI and load tests: no network, no transformations, and video
+    durations come from ``marketplace.media_probe``.
+    """
+
+    def upload(self, file, resource_type='image', timeout=None):
+        name = file if isinstance(file, str) else getattr(file, 'name', '') or ''
+        _, extension = os.path.splitext(name)
+        folder = VIDEO_FOLDER if resource_type == 'video' else IMAGE_FOLDER
+        public_id = f'{folder}/{uuid.uuid4().hex}{extension.lower()}'
+        path = os.path.join(settings.LOCAL_MEDIA_ROOT, public_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(file, str):
+            shutil.copyfile(file, path)
+        else:
+            file.seek(0)
+            with open(path, 'wb') as destination:
+                shutil.copyfileobj(file, destination)
+
+        duration = 0
+        if resource_type == 'video':
+            try:
+                duration = media_probe.probe(path).duration or 0
+            except media_probe.ProbeError:
+                pass
+        return UploadedAsset(
+            url=settings.LOCAL_MEDIA_URL + public_id,
+            public_id=public_id,
+            resource_type=resource_type,
+            duration=duration,
+        )
+
+    def destroy(self, asset):
+        try:
+            os.remove(os.path.join(settings.LOCAL_MEDIA_ROOT, asset.public_id))
+        except FileNotFoundError:
+            pass
+
+    def destroy_many(self, assets):
+        for asset in assets:
+            self.destroy(asset)
+        return {asset.public_id for asset in assets}
+
+
+class FakeUploader:
+    """
+    In-process uploader for tests and offline development.
+
+    ``fail`` holds file names that raise, ``delay`` is slept per upload and
+    ``duration`` is reported for videos; ``uploaded``/``destroyed`` record calls.
+    """
+
+    def __init__(self, fail=(), delay=0, duration=45):
+        self.fail = set(fail)
+        self.delay = delay
+        self.duration = duration
+        self.uploaded = []
+        self.destroyed = []
+        self._lock = threading.Lock()
+
+    def upload(self, file, resource_type='image', timeout=None):
+        if self.delay:
+            time.sleep(self.delay)
+        name = getattr(file, 'name', str(file))
+        if name in self.fail:
+            raise UploadError(f'fake failure for {name}')
+        public_id = f'fake/{uuid.uuid4().hex}'
+        asset = UploadedAsset(
+            url=f'https://media.invalid/{public_id}',
+            public_id=public_id,
+            resource_type=resource_type,
+            duration=self.duration if resource_type == 'video' else 0,
+        )
+        with self._lock:
+            self.uploaded.append(asset)
+        return asset
+
+    def destroy(self, asset):
+        with self._lock:
+            self.destroyed.append(asset)
+
+    def destroy_many(self, assets):
+        with self._lock:
+            self.destroyed.extend(assets)
+        return {asset.public_id for asset in assets}
+
+
+def get_uploader():
+    return import_string(getattr(settings, 'MEDIA_UPLOADER', 'marketplace.uploads.CloudinaryUploader'))()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process-wide pool, so concurrent requests share one bound"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'UPLOAD_MAX_WORKERS', 4),
+                thread_name_prefix='media-upload',
+            )
+        return _executor
+
+
+class UploadBatch:
+    """Outcome of uploading one submission's files"""
+
+    def __init__(self, uploader):
+        self.uploader = uploader
+        self.assets = {}
+        self.errors = {}
+
+    def url(self, name):
+        """URL of the uploaded file, or '' when it was missing or failed"""
+        asset = self.assets.get(name)
+        return asset.url if asset else ''
+
+    def placeholders(self):
+        """``{url: placeholder}`` for the images that have one"""
+        return {asset.url: asset.placeholder for asset in self.assets.values() if asset.placeholder}
+
+    def discard(self, *names):
+        """
+        Delete uploaded assets (all of them when no names are given); reused
+        assets belong to earlier uploads and are only dropped from the batch.
+        """
+        for name in names or list(self.assets):
+            asset = self.assets.pop(name, None)
+            if asset and not asset.reused:
+                _destroy_quietly(self.uploader, asset)
+                dedup.forget(asset)
+
+    def error_summary(self):
+        return ', '.join(f'{name} ({error})' for name, error in self.errors.items())
+
+
+def _destroy_quietly(uploader, asset):
+    try:
+        uploader.destroy(asset)
+    except Exception:
+        logger.exception('Could not delete uploaded asset %s', asset.public_id)
+
+
+def _destroy_when_done(uploader, future):
+    """A timed-out upload keeps running; delete its asset once it lands"""
+    def callback(done):
+        if not done.cancelled() and done.exception() is None:
+            _destroy_quietly(uploader, done.result())
+    future.add_done_callback(callback)
+
+
+def _upload_one(uploader, file, resource_type, timeout):
+    if resource_type == 'image' and imaging.is_enabled():
+        # Shrink on the worker thread; Pillow releases the GIL while resizing
+        file = imaging.preprocess_image(file)
+    placeholder = imaging.placeholder(file) if resource_type == 'image' else None
+    asset = uploader.upload(file, resource_type, timeout)
+    asset.placeholder = placeholder
+    return asset
+
+
+def upload_files(files, uploader=None, timeout=None, owner=None):
+    """
+    Upload ``files`` (``{name: (file, resource_type)}``, ``None`` files are
+    skipped) concurrently and return an ``UploadBatch``. Files already
+    uploaded before (``marketplace.dedup``) are reused instead.
+    """
+    uploader = uploader or get_uploader()
+    timeout = timeout or getattr(settings, 'UPLOAD_TIMEOUT', 60)
+    executor = get_executor()
+    batch = UploadBatch(uploader)
+
+    files = {name: (file, resource_type) for name, (file, resource_type) in files.items() if file}
+    fingerprints = {}
+    if dedup.is_enabled() and files:
+        fingerprints = {name: dedup.fingerprint(file, resource_type) for name, (file, resource_type) in files.items()}
+        resource_types = {name: resource_type for name, (_, resource_type) in files.items()}
+        batch.assets.update(dedup.lookup(fingerprints, resource_types, owner))
+
+    futures = {
+        name: executor.submit(_upload_one, uploader, file, resource_type, timeout)
+        for name, (file, resource_type) in files.items()
+        if name not in batch.assets
+    }
+    # One deadline for the batch; time spent queued behind other requests counts too
+    done, _ = wait(futures.values(), timeout=timeout)
+    for name, future in futures.items():
+        if future not in done:
+            if not future.cancel():
+                _destroy_when_done(uploader, future)
+            batch.errors[name] = 'timed out'
+            continue
+        try:
+            batch.assets[name] = future.result()
+        except Exception as e:
+            logger.warning('Upload of %s failed: %s', name, e)
+            batch.errors[name] = 'upload failed'
+    dedup.remember(batch.assets, fingerprints, owner)
+    return batch
+
+
+def upload_listing_media(request_files, uploader=None, direct_assets=None, owner=None):
+    """
+    Upload the image1-3 and video fields of a listing form. Fields in
+    ``direct_assets`` (already uploaded by the browser) are taken as they are.
+    """
+    direct_assets = direct_assets or {}
+    batch = upload_files({
+        name: (request_files.get(name), resource_type)
+        for name, resource_type in (('image1', 'image'), ('image2', 'image'), ('image3', 'image'), ('video', 'video'))
+        if name not in direct_assets
+    }, uploader=uploader, owner=owner)
+    dedup.remember(direct_assets, {}, owner)
+    batch.assets.update(direct_assets)
+    return batch
+
+
+# Direct browser uploads: the server signs, the browser talks to Cloudinary,
+# Django only sees the resulting public id
+
+DIRECT_UPLOAD_TRANSFORMATION = {
+    'image': 'c_limit,w_800,h_600/q_auto:good',
+    'video': 'c_limit,w_1280,h_720/q_auto:good',
+}
+# Derived copy a direct upload's placeholder is computed from
+PLACEHOLDER_SOURCE_TRANSFORMATION = {'width': 128, 'height': 128, 'crop': 'limit'}
+PLACEHOLDER_SOURCE_TIMEOUT = 3
+MAX_PLACEHOLDER_SOURCE = 1024 * 1024
+
+
+def direct_upload_params(resource_type='image'):
+    """
+    Signed parameters for one browser upload. Cloudinary refuses signatures
+    whose timestamp is more than an hour old.
+    """
+    import cloudinary
+    import cloudinary.utils
+    config = cloudinary.config()
+    params = {
+        'timestamp': int(time.time()),
+        'folder': VIDEO_FOLDER if resource_type == 'video' else IMAGE_FOLDER,
+        'transformation': DIRECT_UPLOAD_TRANSFORMATION[resource_type],
+    }
+    params['signature'] = cloudinary.utils.api_sign_request(params, config.api_secret)
+    params['api_key'] = config.api_key
+    return {
+        'upload_url': f'https://api.cloudinary.com/v1_1/{config.cloud_name}/{resource_type}/upload',
+        'params': params,
+    }
+
+
+def verify_direct_upload(payload, resource_type='image'):
+    """
+    Check a Cloudinary upload response posted back by the browser and return
+    its ``UploadedAsset``; raises ``UploadError`` when it was not signed by
+    Cloudinary for our account or landed outside our folders.
+    """
+    import cloudinary.api
+    import cloudinary.utils
+    try:
+        public_id = str(payload['public_id'])
+        version = str(payload['version'])
+        signature = str(payload['signature'])
+    except (KeyError, TypeError):
+        raise UploadError('incomplete upload response')
+    if not cloudinary.utils.verify_api_response_signature(public_id, version, signature):
+        raise UploadError('upload signature does not match')
+    folder = VIDEO_FOLDER if resource_type == 'video' else IMAGE_FOLDER
+    if not public_id.startswith(f'{folder}/'):
+        raise UploadError('upload is outside the expected folder')
+
+    duration = 0
+    if resource_type == 'video':
+        # The browser reports a duration, but it is not covered by the signature
+        duration = cloudinary.api.resource(public_id, resource_type='video').get('duration', 0)
+    url, _ = cloudinary.utils.cloudinary_url(
+        public_id, resource_type=resource_type, version=version,
+        format=payload.get('format') or None, secure=True,
+    )
+    asset = UploadedAsset(url=url, public_id=public_id, resource_type=resource_type, duration=duration)
+    if resource_type == 'image':
+        asset.placeholder = _direct_upload_placeholder(public_id, version, payload)
+    return asset
+
+
+def _direct_upload_placeholder(public_id, version, payload):
+    """
+    Placeholder of a browser upload, or None when its small copy cannot be
+    fetched; the listing is saved without one then
+    """
+    import cloudinary.utils
+    url, _ = cloudinary.utils.cloudinary_url(
+        public_id, version=version, format='jpg', secure=True,
+        transformation=[PLACEHOLDER_SOURCE_TRANSFORMATION],
+    )
+    try:
+        with urllib.request.urlopen(url, timeout=PLACEHOLDER_SOURCE_TIMEOUT) as response:
+            source = io.BytesIO(response.read(MAX_PLACEHOLDER_SOURCE))
+    except (OSError, ValueError) as e:
+        logger.warning('No placeholder for direct upload %s: %s', public_id, e)
+        return None
+    # The upload response has the stored size; the derived copy only its aspect ratio
+    try:
+        size = int(payload['width']), int(payload['height'])
+    except (KeyError, TypeError, ValueError):
+        size = None
+    return imaging.placeholder(source, size if size and min(size) > 0 else None)
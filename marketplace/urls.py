@@ -15,6 +15,13 @@ urlpatterns = [
     path('products/', views.browse_products, name='browse_products'),
     path('services/', views.browse_services, name='browse_services'),
     
+    # Direct-to-Cloudinary upload signatures
+    path('media/upload-signature/', views.upload_signature, name='upload_signature'),
+    
+    # Resumable chunked video uploads
+    path('media/chunked/', views.start_chunked_upload, name='start_chunked_upload'),
+    path('media/chunked/<str:upload_id>/', views.chunked_upload, name='chunked_upload'),
+    
     # Create - MUST come before detail patterns to avoid slug conflicts
     path('product/create/', views.create_product, name='create_product'),
     path('service/create/', views.create_service, name='create_service'),
@@ -0,0 +1,210 @@
+"""
+Write-behind view counting for listing detail pages.
+
+A hit only touches the cache: the listing's pending counter is incremented,
+and the first increment after a flush registers the listing in a numbered
+"dirty" slot. ``flush_view_counts`` (called inline every
+``VIEW_COUNT_FLUSH_INTERVAL`` seconds, or from the management command) drains
+the slots and applies the totals with one ``UPDATE ... SET views = views + n``
+per distinct total. The counters are only decremented once that UPDATE has
+committed, so a failed write is retried by the next flush.
+
+Buffering needs a cache every process shares (``VIEW_COUNT_BUFFERED``, on
+unless the default cache is per-process); without one each view is written
+straight away, since the management command could not see the counters.
+
+Repeat views from the same session/IP within ``VIEW_COUNT_DEDUP_WINDOW``
+seconds, and obvious bots, are not counted.
+"""
+import hashlib
+import re
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+PREFIX = 'views'
+SEQUENCE_KEY = f'{PREFIX}:seq'
+FLUSHED_KEY = f'{PREFIX}:flushed'
+LAST_FLUSH_KEY = f'{PREFIX}:last-flush'
+FLUSH_LOCK_KEY = f'{PREFIX}:flush-lock'
+FLUSH_LOCK_TIMEOUT = 30
+# Seconds a reserved slot may stay empty before flushes skip it (its key was evicted)
+SLOT_DEADLINE = 10
+
+BOT_RE = re.compile(r'bot|crawl|spider|slurp|facebookexternalhit|preview|headless', re.I)
+
+
+def flush_interval():
+    return getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 60)
+
+
+def dedup_window():
+    return getattr(settings, 'VIEW_COUNT_DEDUP_WINDOW', 30 * 60)
+
+
+def is_buffered():
+    return getattr(settings, 'VIEW_COUNT_BUFFERED', True)
+
+
+def _counter_key(label, pk):
+    return f'{PREFIX}:count:{label}:{pk}'
+
+
+def _slot_key(seq):
+    return f'{PREFIX}:slot:{seq}'
+
+
+def _gap_key(seq):
+    return f'{PREFIX}:gap:{seq}'
+
+
+def _incr(key):
+    """Atomic increment that creates the key (without expiry) on first use"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, None):
+            return 1
+        return cache.incr(key)
+
+
+def _register(label, pk):
+    """Put the listing in the next dirty slot"""
+    seq = _incr(SEQUENCE_KEY)
+    if seq == 1:
+        # A new (or evicted and restarted) sequence; nothing below it is flushed
+        cache.delete(FLUSHED_KEY)
+    cache.set(_slot_key(seq), (label, pk), None)
+
+
+def visitor_id(request):
+    """Session key when there is one, otherwise a hash of IP and user agent"""
+    session_key = getattr(getattr(request, 'session', None), 'session_key', None)
+    if session_key:
+        return f's:{session_key}'
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    ip = forwarded.split(',')[0].strip() or request.META.get('REMOTE_ADDR', '')
+    agent = request.META.get('HTTP_USER_AGENT', '')
+    return 'a:' + hashlib.sha1(f'{ip}|{agent}'.encode()).hexdigest()
+
+
+def is_bot(request):
+    return bool(BOT_RE.search(request.META.get('HTTP_USER_AGENT', '')))
+
+
+def record_view(request, listing):
+    """Count one view of ``listing`` (Product or Service); returns True if counted"""
+    if is_bot(request):
+        return False
+
+    label = listing._meta.label_lower
+    window = dedup_window()
+    if window:
+        seen_key = f'{PREFIX}:seen:{label}:{listing.pk}:{visitor_id(request)}'
+        if not cache.add(seen_key, 1, window):
+            return False
+
+    if not is_buffered():
+        listing._meta.model._base_manager.filter(pk=listing.pk).update(views=F('views') + 1)
+        return True
+
+    if _incr(_counter_key(label, listing.pk)) == 1:
+        # First view since the last flush: register the listing as dirty
+        _register(label, str(listing.pk))
+
+    maybe_flush()
+    return True
+
+
+def pending_views(listing):
+    """Views recorded for ``listing`` but not yet written to the database"""
+    return cache.get(_counter_key(listing._meta.label_lower, listing.pk)) or 0
+
+
+def maybe_flush():
+    """Flush inline when the last flush is older than the flush interval"""
+    interval = flush_interval()
+    if interval is None or interval < 0:
+        return None
+    last = cache.get(LAST_FLUSH_KEY)
+    if last is not None and time.time() - last < interval:
+        return None
+    return flush_view_counts()
+
+
+def flush_view_counts():
+    """
+    Write buffered views to the database.
+
+    Returns the number of views applied, or None when another flush holds
+    the lock.
+    """
+    if not cache.add(FLUSH_LOCK_KEY, 1, FLUSH_LOCK_TIMEOUT):
+        return None
+    try:
+        cache.set(LAST_FLUSH_KEY, time.time(), None)
+        flushed = cache.get(FLUSHED_KEY) or 0
+        head = cache.get(SEQUENCE_KEY) or 0
+        if head < flushed:
+            # The sequence was evicted and restarted; its numbers are reused from 1
+            flushed = 0
+        if head <= flushed:
+            cache.set(FLUSHED_KEY, flushed, None)
+            return 0
+
+        slot_keys = [_slot_key(seq) for seq in range(flushed + 1, head + 1)]
+        slots = cache.get_many(slot_keys)
+
+        # Stop at the first slot a writer has reserved but not filled yet,
+        # unless it has been empty for longer than any writer takes
+        now = time.time()
+        dirty = set()
+        drained = []
+        for seq, key in zip(range(flushed + 1, head + 1), slot_keys):
+            if key in slots:
+                dirty.add(slots[key])
+                drained.append(key)
+            else:
+                cache.add(_gap_key(seq), now, SLOT_DEADLINE * 6)
+                if now - cache.get(_gap_key(seq), now) < SLOT_DEADLINE:
+                    break
+                drained.append(_gap_key(seq))
+            flushed = seq
+
+        counts = {}
+        for label, pk in dirty:
+            count = cache.get(_counter_key(label, pk)) or 0
+            if count:
+                counts[label, pk] = count
+
+        pending = defaultdict(lambda: defaultdict(list))
+        for (label, pk), count in counts.items():
+            pending[label][count].append(pk)
+        # All or nothing, so a failed flush can be repeated without counting twice
+        with transaction.atomic():
+            for label, by_count in pending.items():
+                model = apps.get_model(label)
+                for count, pks in by_count.items():
+                    model._base_manager.filter(pk__in=pks).update(views=F('views') + count)
+
+        for (label, pk), count in counts.items():
+            # Decrement rather than delete so concurrent hits are kept.
+            # A hit since the get left the counter above zero without
+            # registering a slot; register it again.
+            try:
+                if cache.decr(_counter_key(label, pk), count) > 0:
+                    _register(label, pk)
+            except ValueError:
+                # Evicted since the get; the views are in the database already
+                pass
+
+        cache.set(FLUSHED_KEY, flushed, None)
+        cache.delete_many(drained)
+        return sum(counts.values())
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
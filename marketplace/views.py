@@ -2,12 +2,12 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Avg, Count
-from django.core.paginator import Paginator
+from django.db.models import Avg, Count
 from django.utils import timezone
 from django.http import JsonResponse
+from django.views.decorators.http import condition, require_POST, require_http_methods
+from django.urls import reverse
 from urllib.parse import quote
-import cloudinary.uploader
 from .models import (
     User, Category, Product, Service, Review, 
     AvailabilityReport, PromotionPackage, Promotion, 
@@ -17,6 +17,35 @@ from .forms import (
     UserRegisterForm, UserLoginForm, ProductForm, ServiceForm,
     ReviewForm, AvailabilityReportForm, ChangeRequestForm
 )
+from .search import search_listings
+from .pagination import KEYSET_SORTS, CountedPaginator, keyset_page
+from .counting import count_results
+from .view_counter import record_view, pending_views
+from .related import related_listings
+from .overload import is_degraded
+from .uploads import upload_listing_media, upload_files, direct_upload_params, get_uploader
+from . import chunked_uploads, media_jobs
+from .caching import CATEGORY_NAMESPACE, browse_namespace, detail_namespace
+from .page_cache import anonymous_page_cache
+from .http_cache import (
+    cache_policy, conditional_detail, home_etag, categories_etag, browse_etag,
+)
+
+BROWSE_PAGE_SIZE = 20
+
+
+def _browse_page_namespaces(model):
+    """Cached browse pages depend on the filtered category's listings"""
+    def namespaces(request):
+        return [browse_namespace(model, request.GET.get('category', '').strip()), CATEGORY_NAMESPACE]
+    return namespaces
+
+
+def _detail_page_namespaces(model):
+    def namespaces(request, slug):
+        return [detail_namespace(model, slug), CATEGORY_NAMESPACE]
+    return namespaces
+
 
 def error_404(request, exception):
     """Custom 404 error page"""
@@ -37,55 +66,25 @@ def error_400(request, exception):
 # Admin WhatsApp number
 ADMIN_WHATSAPP = "2348135923286"
 
-# Update the upload_to_cloudinary function to handle videos:
-def upload_video_to_cloudinary(video_file):
-    """Upload video to Cloudinary and return the URL"""
-    try:
-        upload_result = cloudinary.uploader.upload(
-            video_file,
-            resource_type="video",
-            folder="arparte_videos",
-            transformation=[
-                {'width': 1280, 'height': 720, 'crop': 'limit'},
-                {'quality': 'auto:good'}
-            ]
-        )
-        return upload_result['secure_url'], upload_result.get('duration', 0)
-    except Exception as e:
-        print(f"Cloudinary video upload error: {e}")
-        return None, 0
-
-def upload_to_cloudinary(image_file):
-    """Upload image to Cloudinary and return the URL"""
-    try:
-        upload_result = cloudinary.uploader.upload(
-            image_file,
-            folder="arparte_products",
-            transformation=[
-                {'width': 800, 'height': 600, 'crop': 'limit'},
-                {'quality': 'auto:good'}
-            ]
-        )
-        return upload_result['secure_url']
-    except Exception as e:
-        print(f"Cloudinary upload error: {e}")
-        return None
-
+@condition(etag_func=home_etag)
+@cache_policy(s_maxage=60, stale_while_revalidate=300)
 def home(request):
     """Homepage with featured items and categories"""
-    featured_products = Product.objects.filter(
+    # The querysets are lazy: sections served from the versioned fragment
+    # cache in home.html never hit the database
+    featured_products = Product.objects.for_cards().filter(
         status='active', is_featured=True
     ).order_by('-created_at')[:8]
     
-    featured_services = Service.objects.filter(
+    featured_services = Service.objects.for_cards().filter(
         status='active', is_featured=True
     ).order_by('-created_at')[:8]
     
     # Only show first 8 categories on home page
     categories = Category.objects.filter(is_active=True)[:8]
     
-    recent_products = Product.objects.filter(status='active').order_by('-created_at')[:12]
-    recent_services = Service.objects.filter(status='active').order_by('-created_at')[:12]
+    recent_products = Product.objects.for_cards().filter(status='active').order_by('-created_at')[:12]
+    recent_services = Service.objects.for_cards().filter(status='active').order_by('-created_at')[:12]
     
     context = {
         'featured_products': featured_products,
@@ -96,6 +95,8 @@ def home(request):
     }
     return render(request, 'marketplace/home.html', context)
 
+@condition(etag_func=categories_etag)
+@cache_policy(s_maxage=600, stale_while_revalidate=3600)
 def categories_list(request):
     """Display all categories"""
     categories = Category.objects.filter(is_active=True)
@@ -151,9 +152,12 @@ def user_logout(request):
     messages.success(request, 'You have been logged out.')
     return redirect('home')
 
+@condition(etag_func=browse_etag(Product))
+@cache_policy(s_maxage=60, stale_while_revalidate=300)
+@anonymous_page_cache(_browse_page_namespaces(Product))
 def browse_products(request):
     """Browse all products with WORKING filters"""
-    products = Product.objects.filter(status='active')
+    products = Product.objects.for_cards().filter(status='active')
     
     # Get all filter parameters
     category_slug = request.GET.get('category', '').strip()
@@ -162,19 +166,15 @@ def browse_products(request):
     max_price = request.GET.get('max_price', '').strip()
     condition = request.GET.get('condition', '').strip()
     campus = request.GET.get('campus', '').strip()
-    sort_by = request.GET.get('sort', '-created_at')
+    sort_by = request.GET.get('sort', 'relevance' if search_query else '-created_at')
     
     # Apply filters
     if category_slug:
         products = products.filter(category__slug=category_slug)
     
+    fuzzy_match = False
     if search_query:
-        products = products.filter(
-            Q(title__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(location__icontains=search_query) |
-            Q(campus__icontains=search_query)
-        )
+        products, fuzzy_match = search_listings(products, search_query)
     
     if min_price:
         try:
@@ -202,17 +202,39 @@ def browse_products(request):
         '-price': '-price',
         'title': 'title',
         '-title': '-title',
+        '-rating_avg': '-rating_avg',
     }
     
-    if sort_by in sort_options:
+    if sort_by == 'relevance' and search_query:
+        products = products.order_by('-search_rank', '-created_at')
+    elif sort_by in sort_options:
         products = products.order_by(sort_options[sort_by])
     else:
+        sort_by = '-created_at'
         products = products.order_by('-created_at')
     
-    # Pagination
-    paginator = Paginator(products, 20)
+    # Pagination: keyset cursors by default, numbered pages for old ?page= links
+    # and relevance-ranked searches
     page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    cursor_pagination = sort_by in KEYSET_SORTS and not page_number
+    total_results = count_results(products, request.GET)
+    if cursor_pagination:
+        page_obj = keyset_page(
+            products, sort_by,
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+            per_page=BROWSE_PAGE_SIZE,
+        )
+    else:
+        paginator = CountedPaginator(
+            products, BROWSE_PAGE_SIZE,
+            count=int(total_results), is_estimate=total_results.is_estimate,
+        )
+        page_obj = paginator.get_page(page_number)
+    
+    pagination_query = request.GET.copy()
+    for key in ('page', 'after', 'before'):
+        pagination_query.pop(key, None)
     
     categories = Category.objects.filter(is_active=True)
     
@@ -225,37 +247,39 @@ def browse_products(request):
         'condition_choices': condition_choices,
         'current_category': category_slug,
         'search_query': search_query,
+        'fuzzy_match': fuzzy_match,
         'min_price': min_price,
         'max_price': max_price,
         'selected_condition': condition,
         'selected_campus': campus,
         'current_sort': sort_by,
-        'total_results': products.count(),
+        'total_results': total_results,
+        'cursor_pagination': cursor_pagination,
+        'pagination_query': pagination_query.urlencode(),
     }
     return render(request, 'marketplace/browse_products.html', context)
 
+@condition(etag_func=browse_etag(Service))
+@cache_policy(s_maxage=60, stale_while_revalidate=300)
+@anonymous_page_cache(_browse_page_namespaces(Service))
 def browse_services(request):
     """Browse all services with WORKING filters"""
-    services = Service.objects.filter(status='active')
+    services = Service.objects.for_cards().filter(status='active')
     
     # Get all filter parameters
     category_slug = request.GET.get('category', '').strip()
     search_query = request.GET.get('q', '').strip()
     price_type = request.GET.get('price_type', '').strip()
     campus = request.GET.get('campus', '').strip()
-    sort_by = request.GET.get('sort', '-created_at')
+    sort_by = request.GET.get('sort', 'relevance' if search_query else '-created_at')
     
     # Apply filters
     if category_slug:
         services = services.filter(category__slug=category_slug)
     
+    fuzzy_match = False
     if search_query:
-        services = services.filter(
-            Q(title__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(location__icontains=search_query) |
-            Q(campus__icontains=search_query)
-        )
+        services, fuzzy_match = search_listings(services, search_query)
     
     if price_type:
         services = services.filter(price_type=price_type)
@@ -271,17 +295,39 @@ def browse_services(request):
         '-price': '-price',
         'title': 'title',
         '-title': '-title',
+        '-rating_avg': '-rating_avg',
     }
     
-    if sort_by in sort_options:
+    if sort_by == 'relevance' and search_query:
+        services = services.order_by('-search_rank', '-created_at')
+    elif sort_by in sort_options:
         services = services.order_by(sort_options[sort_by])
     else:
+        sort_by = '-created_at'
         services = services.order_by('-created_at')
     
-    # Pagination
-    paginator = Paginator(services, 20)
+    # Pagination: keyset cursors by default, numbered pages for old ?page= links
+    # and relevance-ranked searches
     page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    cursor_pagination = sort_by in KEYSET_SORTS and not page_number
+    total_results = count_results(services, request.GET)
+    if cursor_pagination:
+        page_obj = keyset_page(
+            services, sort_by,
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+            per_page=BROWSE_PAGE_SIZE,
+        )
+    else:
+        paginator = CountedPaginator(
+            services, BROWSE_PAGE_SIZE,
+            count=int(total_results), is_estimate=total_results.is_estimate,
+        )
+        page_obj = paginator.get_page(page_number)
+    
+    pagination_query = request.GET.copy()
+    for key in ('page', 'after', 'before'):
+        pagination_query.pop(key, None)
     
     categories = Category.objects.filter(is_active=True)
     
@@ -298,29 +344,39 @@ def browse_services(request):
         'price_type_choices': price_type_choices,
         'current_category': category_slug,
         'search_query': search_query,
+        'fuzzy_match': fuzzy_match,
         'selected_price_type': price_type,
         'selected_campus': campus,
         'current_sort': sort_by,
-        'total_results': services.count(),
+        'total_results': total_results,
+        'cursor_pagination': cursor_pagination,
+        'pagination_query': pagination_query.urlencode(),
     }
     return render(request, 'marketplace/browse_services.html', context)
 
+@conditional_detail(Product)
+@cache_policy(s_maxage=120, stale_while_revalidate=600)
+@anonymous_page_cache(_detail_page_namespaces(Product))
 def product_detail(request, slug):
     """Product detail page with admin WhatsApp contact"""
     product = get_object_or_404(Product, slug=slug)
     
-    # Increment views
-    product.views += 1
-    product.save(update_fields=['views'])
+    # Under overload (marketplace.overload) skip the optional queries:
+    # view counting, reviews and related products
+    degraded = is_degraded()
+    
+    # Count the view; buffered and applied in bulk when the cache is shared
+    if not degraded:
+        record_view(request, product)
+        product.views += pending_views(product)
     
     # Get reviews
     reviews = product.reviews.filter(is_approved=True).order_by('-created_at')
+    if degraded:
+        reviews = reviews.none()
     
-    # Get related products
-    related_products = Product.objects.filter(
-        category=product.category,
-        status='active'
-    ).exclude(id=product.id)[:4]
+    # Get related products (precomputed by compute_related_listings)
+    related_products = [] if degraded else related_listings(product)
     
     # Check if user has reviewed
     user_has_reviewed = False
@@ -342,29 +398,40 @@ def product_detail(request, slug):
     context = {
         'product': product,
         'reviews': reviews,
+        'reviews_unavailable': degraded,
         'related_products': related_products,
         'user_has_reviewed': user_has_reviewed,
         'show_vendor_whatsapp': show_vendor_whatsapp,
         'vendor_whatsapp_link': vendor_whatsapp_link,
     }
-    return render(request, 'marketplace/product_detail.html', context)
+    response = render(request, 'marketplace/product_detail.html', context)
+    # Lets cached copies of this page keep counting views
+    response.viewed_listing = product
+    return response
 
+@conditional_detail(Service)
+@cache_policy(s_maxage=120, stale_while_revalidate=600)
+@anonymous_page_cache(_detail_page_namespaces(Service))
 def service_detail(request, slug):
     """Service detail page with admin WhatsApp contact"""
     service = get_object_or_404(Service, slug=slug)
     
-    # Increment views
-    service.views += 1
-    service.save(update_fields=['views'])
+    # Under overload (marketplace.overload) skip the optional queries:
+    # view counting, reviews and related services
+    degraded = is_degraded()
+    
+    # Count the view; buffered and applied in bulk when the cache is shared
+    if not degraded:
+        record_view(request, service)
+        service.views += pending_views(service)
     
     # Get reviews
     reviews = service.service_reviews.filter(is_approved=True).order_by('-created_at')
+    if degraded:
+        reviews = reviews.none()
     
-    # Get related services
-    related_services = Service.objects.filter(
-        category=service.category,
-        status='active'
-    ).exclude(id=service.id)[:4]
+    # Get related services (precomputed by compute_related_listings)
+    related_services = [] if degraded else related_listings(service)
     
     # Check if user has reviewed
     user_has_reviewed = False
@@ -386,56 +453,121 @@ def service_detail(request, slug):
     context = {
         'service': service,
         'reviews': reviews,
+        'reviews_unavailable': degraded,
         'related_services': related_services,
         'user_has_reviewed': user_has_reviewed,
         'show_provider_whatsapp': show_provider_whatsapp,
         'provider_whatsapp_link': provider_whatsapp_link,
     }
-    return render(request, 'marketplace/service_detail.html', context)
+    response = render(request, 'marketplace/service_detail.html', context)
+    # Lets cached copies of this page keep counting views
+    response.viewed_listing = service
+    return response
+
+@login_required
+@require_POST
+def upload_signature(request):
+    """Signed parameters for uploading one file straight to Cloudinary"""
+    if not getattr(get_uploader(), 'supports_direct_uploads', False):
+        # The form's script then sends the file through Django instead
+        return JsonResponse({'error': 'Direct uploads are not available'}, status=404)
+    resource_type = request.POST.get('resource_type', 'image')
+    if resource_type not in ('image', 'video'):
+        return JsonResponse({'error': 'Unsupported resource type'}, status=400)
+    return JsonResponse(direct_upload_params(resource_type))
+
+@login_required
+@require_POST
+def start_chunked_upload(request):
+    """Reserve a resumable video upload"""
+    try:
+        upload_id = chunked_uploads.start(request.user, request.POST.get('name', ''), int(request.POST.get('size', 0)))
+    except (ValueError, chunked_uploads.ChunkError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({
+        'upload_id': upload_id,
+        'url': reverse('chunked_upload', args=[upload_id]),
+        'offset': 0,
+        'chunk_size': chunked_uploads.CHUNK_SIZE,
+    })
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+def chunked_upload(request, upload_id):
+    """
+    GET reports how many bytes arrived; POST appends the raw request body,
+    which must start at the ``Upload-Offset`` header. The body is streamed to
+    disk, never read into memory as a whole.
+    """
+    try:
+        offset, size = chunked_uploads.received(upload_id, request.user)
+        if request.method == 'POST':
+            if int(request.headers.get('Upload-Offset', -1)) != offset:
+                # Tell the client where to resume from
+                return JsonResponse({'error': 'Offset mismatch', 'offset': offset, 'size': size}, status=409)
+            length = int(request.headers.get('Content-Length') or 0)
+            offset = chunked_uploads.append(upload_id, request.user, offset, request, length)
+    except ValueError:
+        return JsonResponse({'error': 'Bad chunk headers'}, status=400)
+    except chunked_uploads.ChunkError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'offset': offset, 'size': size, 'complete': offset == size})
 
 @login_required
 def create_product(request):
     """Create a new product"""
     if request.method == 'POST':
-        form = ProductForm(request.POST, request.FILES)
+        form = ProductForm(request.POST, request.FILES, user=request.user)
         if form.is_valid():
             product = form.save(commit=False)
             product.seller = request.user
             
-            # Upload images to Cloudinary
-            image1 = request.FILES.get('image1')
-            image2 = request.FILES.get('image2')
-            image3 = request.FILES.get('image3')
+            if media_jobs.is_deferred() and not form.direct_assets:
+                # Hidden until process_media_jobs uploads the files and publishes it
+                product.status = 'processing'
+                if form.video_info:
+                    product.video_info = form.video_info.as_dict()
+                product.save()
+                media_jobs.enqueue(product, form.media_files(request.FILES))
+                form.release_chunked_upload()
+                messages.success(request, f'Product submitted! It will go live as soon as its media is processed. Final price: ₦{product.price:,.0f} (includes {product.commission_rate}% commission)')
+                return redirect('my_products')
             
-            if image1:
-                product.image1 = upload_to_cloudinary(image1)
-            if image2:
-                product.image2 = upload_to_cloudinary(image2)
-            if image3:
-                product.image3 = upload_to_cloudinary(image3)
+            # Upload images and video to Cloudinary concurrently
+            # (files the browser already uploaded directly are verified by the form)
+            uploads = upload_listing_media(form.media_files(request.FILES), direct_assets=form.direct_assets, owner=request.user)
+            product.image1 = uploads.url('image1')
+            product.image2 = uploads.url('image2')
+            product.image3 = uploads.url('image3')
+            product.image_placeholders = uploads.placeholders()
             
-            # Upload video if provided
-            video = request.FILES.get('video')
+            video = uploads.assets.get('video')
             if video:
-                video_url, duration = upload_video_to_cloudinary(video)
-                if video_url:
-                    # Validate duration (30-90 seconds)
-                    if 30 <= duration <= 90:
-                        product.video = video_url
-                        product.video_duration = duration
-                    else:
-                        messages.warning(request, f'Video duration must be between 30-90 seconds. Your video is {duration} seconds.')
+                # Validate duration (30-90 seconds)
+                if 30 <= video.duration <= 90:
+                    product.video = video.url
+                    product.video_duration = video.duration
+                    if form.video_info:
+                        product.video_info = form.video_info.as_dict()
+                else:
+                    uploads.discard('video')
+                    messages.warning(request, f'Video duration must be between 30-90 seconds. Your video is {video.duration} seconds.')
             
             # Check if all required images were uploaded successfully
             if not product.image1 or not product.image2:
-                messages.error(request, 'Failed to upload images. Please try again.')
+                uploads.discard()
+                messages.error(request, f'Failed to upload images: {uploads.error_summary() or "image1 and image2 are required"}. Please try again.')
                 return render(request, 'marketplace/create_product.html', {'form': form})
             
+            if uploads.errors:
+                messages.warning(request, f'Some files could not be uploaded: {uploads.error_summary()}')
+            
             product.save()
+            form.release_chunked_upload()
             messages.success(request, f'Product created successfully! Final price: ₦{product.price:,.0f} (includes {product.commission_rate}% commission)')
             return redirect('my_products')
     else:
-        form = ProductForm()
+        form = ProductForm(user=request.user)
     
     return render(request, 'marketplace/create_product.html', {'form': form})
 
@@ -443,36 +575,47 @@ def create_product(request):
 def create_service(request):
     """Create a new service"""
     if request.method == 'POST':
-        form = ServiceForm(request.POST, request.FILES)
+        form = ServiceForm(request.POST, request.FILES, user=request.user)
         if form.is_valid():
             service = form.save(commit=False)
             service.provider = request.user
             
-            # Upload images to Cloudinary (optional for services)
-            image1 = request.FILES.get('image1')
-            image2 = request.FILES.get('image2')
-            image3 = request.FILES.get('image3')
+            if media_jobs.is_deferred() and not form.direct_assets:
+                # Hidden until process_media_jobs uploads the files and publishes it
+                service.status = 'processing'
+                if form.video_info:
+                    service.video_info = form.video_info.as_dict()
+                service.save()
+                media_jobs.enqueue(service, form.media_files(request.FILES))
+                form.release_chunked_upload()
+                messages.success(request, 'Service submitted! It will go live as soon as its media is processed.')
+                return redirect('my_services')
             
-            if image1:
-                service.image1 = upload_to_cloudinary(image1)
-            if image2:
-                service.image2 = upload_to_cloudinary(image2)
-            if image3:
-                service.image3 = upload_to_cloudinary(image3)
+            # Upload images (optional for services) and video concurrently
+            # (files the browser already uploaded directly are verified by the form)
+            uploads = upload_listing_media(form.media_files(request.FILES), direct_assets=form.direct_assets, owner=request.user)
+            service.image1 = uploads.url('image1')
+            service.image2 = uploads.url('image2')
+            service.image3 = uploads.url('image3')
+            service.image_placeholders = uploads.placeholders()
             
-            # Upload video if provided
-            video = request.FILES.get('video')
+            video = uploads.assets.get('video')
             if video:
-                video_url, duration = upload_video_to_cloudinary(video)
-                if video_url:
-                    # Validate duration (30-90 seconds)
-                    if 30 <= duration <= 90:
-                        service.video = video_url
-                        service.video_duration = duration
-                    else:
-                        messages.warning(request, f'Video duration must be between 30-90 seconds. Your video is {duration} seconds.')
+                # Validate duration (30-90 seconds)
+                if 30 <= video.duration <= 90:
+                    service.video = video.url
+                    service.video_duration = video.duration
+                    if form.video_info:
+                        service.video_info = form.video_info.as_dict()
+                else:
+                    uploads.discard('video')
+                    messages.warning(request, f'Video duration must be between 30-90 seconds. Your video is {video.duration} seconds.')
+            
+            if uploads.errors:
+                messages.warning(request, f'Some files could not be uploaded: {uploads.error_summary()}')
             
             service.save()
+            form.release_chunked_upload()
             
             if service.price:
                 messages.success(request, f'Service created successfully! Final price: ₦{service.price:,.0f} (includes {service.commission_rate}% commission)')
@@ -481,14 +624,14 @@ def create_service(request):
             
             return redirect('my_services')
     else:
-        form = ServiceForm()
+        form = ServiceForm(user=request.user)
     
     return render(request, 'marketplace/create_service.html', {'form': form})
 
 @login_required
 def my_products(request):
     """User's products dashboard"""
-    products = Product.objects.filter(seller=request.user).order_by('-created_at')
+    products = Product.objects.for_cards().filter(seller=request.user).order_by('-created_at')
     
     context = {
         'products': products,
@@ -498,7 +641,7 @@ def my_products(request):
 @login_required
 def my_services(request):
     """User's services dashboard"""
-    services = Service.objects.filter(provider=request.user).order_by('-created_at')
+    services = Service.objects.for_cards().filter(provider=request.user).order_by('-created_at')
     
     context = {
         'services': services,
@@ -517,7 +660,9 @@ def edit_product(request, pk):
         product.location = request.POST.get('location', product.location)
         product.campus = request.POST.get('campus', product.campus)
         product.condition = request.POST.get('condition', product.condition)
-        product.status = request.POST.get('status', product.status)
+        if product.status != 'processing':
+            # Only the media job publishes a listing whose media is still uploading
+            product.status = request.POST.get('status', product.status)
         product.save()
         
         messages.success(request, 'Product updated successfully!')
@@ -535,7 +680,9 @@ def edit_service(request, pk):
         service.description = request.POST.get('description', service.description)
         service.location = request.POST.get('location', service.location)
         service.campus = request.POST.get('campus', service.campus)
-        service.status = request.POST.get('status', service.status)
+        if service.status != 'processing':
+            # Only the media job publishes a listing whose media is still uploading
+            service.status = request.POST.get('status', service.status)
         service.save()
         
         messages.success(request, 'Service updated successfully!')
@@ -595,24 +742,13 @@ def request_image_change(request, pk):
     product = get_object_or_404(Product, id=pk, seller=request.user)
     
     if request.method == 'POST':
-        # Get new image files
-        image1 = request.FILES.get('image1')
-        image2 = request.FILES.get('image2')
-        image3 = request.FILES.get('image3')
-        
-        new_images = []
-        if image1:
-            url = upload_to_cloudinary(image1)
-            if url:
-                new_images.append(url)
-        if image2:
-            url = upload_to_cloudinary(image2)
-            if url:
-                new_images.append(url)
-        if image3:
-            url = upload_to_cloudinary(image3)
-            if url:
-                new_images.append(url)
+        # Upload the new image files concurrently
+        uploads = upload_files({
+            name: (request.FILES.get(name), 'image') for name in ('image1', 'image2', 'image3')
+        }, owner=request.user)
+        new_images = [url for url in map(uploads.url, ('image1', 'image2', 'image3')) if url]
+        if uploads.errors:
+            messages.warning(request, f'Some images could not be uploaded: {uploads.error_summary()}')
         
         reason = request.POST.get('reason')
         